@@ -0,0 +1,94 @@
+"""
+Micro-benchmark de `generar_mapa_ruta`.
+
+Compara, para rutas sintéticas de distinto tamaño, la búsqueda anterior (filtro booleano sobre todo
+el DataFrame por cada punto de la ruta, O(n·m)) con el índice por coordenadas redondeadas que usa
+ahora la función (O(n + m)), y mide el tiempo total de generación del mapa.
+
+Después compara el tiempo de construcción y el tamaño del HTML con marcadores individuales
+y con la capa ligera de marcadores (`modo_marcadores`).
+
+Uso (desde la raíz del proyecto):
+    python benchmarks/bench_mapa.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions import generar_mapa_ruta
+
+
+def datos_sinteticos(n_paradas: int, semilla: int = 0):
+    rng = np.random.default_rng(semilla)
+    lat = 40.4 + rng.normal(0, 0.05, n_paradas)
+    lng = -3.7 + rng.normal(0, 0.05, n_paradas)
+    df_lugares = pd.DataFrame({
+        "Nombre": [f"Lugar {i}" for i in range(n_paradas)],
+        "Dirección": [f"Calle {i}" for i in range(n_paradas)],
+        "Lat": lat,
+        "Lng": lng
+    })
+    coords = [[-3.7, 40.4]] + np.column_stack([lng, lat]).tolist() + [[-3.71, 40.41]]
+    ruta = {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "properties": {},
+            "geometry": {"type": "LineString", "coordinates": coords}
+        }]
+    }
+    return ruta, coords, df_lugares
+
+
+def busqueda_anterior(coords, df_lugares):
+    encontrados = 0
+    for lon, lat in coords:
+        lugar = df_lugares[
+            (df_lugares["Lat"].round(6) == round(lat, 6)) &
+            (df_lugares["Lng"].round(6) == round(lon, 6))
+        ]
+        encontrados += not lugar.empty
+    return encontrados
+
+
+def busqueda_con_indice(coords, df_lugares):
+    indice = {}
+    for clave, nombre in zip(zip(df_lugares["Lat"].round(6).tolist(), df_lugares["Lng"].round(6).tolist()), df_lugares["Nombre"]):
+        indice.setdefault(clave, nombre)
+    return sum((float(np.round(lat, 6)), float(np.round(lon, 6))) in indice for lon, lat in coords)
+
+
+def cronometrar(funcion, *args, repeticiones: int = 3) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor
+
+
+if __name__ == "__main__":
+    print(f"{'paradas':>8} {'anterior (ms)':>14} {'índice (ms)':>12} {'aceleración':>12} {'mapa completo (ms)':>19}")
+    for n in (30, 100, 300, 1000):
+        ruta, coords, df_lugares = datos_sinteticos(n)
+        assert busqueda_anterior(coords, df_lugares) == busqueda_con_indice(coords, df_lugares)
+
+        t_anterior = cronometrar(busqueda_anterior, coords, df_lugares)
+        t_indice = cronometrar(busqueda_con_indice, coords, df_lugares)
+        t_mapa = cronometrar(generar_mapa_ruta, ruta, coords, df_lugares)
+        print(f"{n:>8} {t_anterior * 1000:>14.1f} {t_indice * 1000:>12.2f} {t_anterior / t_indice:>11.0f}x {t_mapa * 1000:>19.1f}")
+
+    print()
+    print(f"{'paradas':>8} {'modo':>11} {'construir + HTML (ms)':>22} {'HTML (KB)':>10}")
+    for n in (100, 500, 1000):
+        ruta, coords, df_lugares = datos_sinteticos(n)
+        for modo in ("individual", "ligero"):
+            def construir():
+                return generar_mapa_ruta(ruta, coords, df_lugares, modo_marcadores=modo).get_root().render()
+            t_html = cronometrar(construir, repeticiones=1)
+            print(f"{n:>8} {modo:>11} {t_html * 1000:>22.0f} {len(construir()) / 1024:>10.0f}")
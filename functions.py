@@ -1,14 +1,38 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
 import pandas as pd
-from typing import List, Optional, Dict, Literal
+import numpy as np
+from typing import Callable, List, Optional, Dict, Literal, Union
 import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import queue
+import re
+import unicodedata
+import hashlib
+import zlib
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
 import openrouteservice
 from openrouteservice.optimization import Vehicle, Job
 import folium
 from folium.features import DivIcon
 from folium import FeatureGroup
-from groq import Groq
+from folium.plugins import FastMarkerCluster
+from groq import Groq, RateLimitError
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # dependencia opcional: sin ella se omite la validación local por embeddings
+    SentenceTransformer = None
 
 load_dotenv();
 
@@ -17,177 +41,3531 @@ ORS_API_KEY = os.getenv('ORS_API_KEY')
 FOURSQUARE_API_KEY = os.getenv('FOURSQUARE_API_KEY') 
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 
+# Timeouts (en segundos) de conexión y de lectura de todas las peticiones HTTP a proveedores externos
+TIMEOUT_CONEXION = float(os.getenv('HTTP_TIMEOUT_CONEXION', 5))
+TIMEOUT_LECTURA = float(os.getenv('HTTP_TIMEOUT_LECTURA', 30))
 
-def buscar_lugares(
-    query: str,
-    radius: int,
-    latitude: float,
-    longitude: float
-):
+# Política de uso de Nominatim: como máximo 1 petición por segundo
+NOMINATIM_PETICIONES_POR_SEGUNDO = float(os.getenv('NOMINATIM_PETICIONES_POR_SEGUNDO', 1.0))
+
+# Límites de la API de Foursquare (resultados por petición y radio máximo en metros)
+# y número máximo de peticiones de una búsqueda teselada
+LIMITE_FOURSQUARE = 50
+RADIO_MAX_FOURSQUARE = 100000
+MAX_PETICIONES_TESELADO = int(os.getenv('MAX_PETICIONES_TESELADO', 40))
+
+# Número máximo de celdas (orígenes x destinos) por petición al endpoint de matrices de ORS
+MAX_ELEMENTOS_MATRIZ_ORS = int(os.getenv('MAX_ELEMENTOS_MATRIZ_ORS', 3500))
+
+# Número máximo de puntos por petición de direcciones a ORS
+MAX_PUNTOS_DIRECCIONES_ORS = int(os.getenv('MAX_PUNTOS_DIRECCIONES_ORS', 50))
+
+# Modelo LLM usado para validar los lugares y tamaño de lote por defecto en la validación agrupada
+MODELO_LLM = "llama-3.3-70b-versatile"
+TAMANO_LOTE_VALIDACION = 25
+
+# Validación local por embeddings: modelo y umbrales de similitud (aceptar / rechazar sin consultar al LLM)
+MODELO_EMBEDDINGS = os.getenv('MODELO_EMBEDDINGS', "paraphrase-multilingual-MiniLM-L12-v2")
+UMBRAL_LOCAL_ACEPTAR = float(os.getenv('UMBRAL_LOCAL_ACEPTAR', 0.75))
+UMBRAL_LOCAL_RECHAZAR = float(os.getenv('UMBRAL_LOCAL_RECHAZAR', 0.15))
+
+# Resolución de la query a categorías de Foursquare: similitud mínima, número máximo de categorías
+# y origen de la taxonomía completa: fichero JSON local (lista de {"fsq_category_id", "name"} o
+# {"version", "categorias": [...]}) y/o URL desde la que descargarla una vez con la clave de Foursquare
+UMBRAL_CATEGORIA = float(os.getenv('UMBRAL_CATEGORIA', 0.8))
+MAX_CATEGORIAS_QUERY = int(os.getenv('MAX_CATEGORIAS_QUERY', 3))
+FICHERO_TAXONOMIA_FOURSQUARE = os.getenv('FICHERO_TAXONOMIA_FOURSQUARE')
+URL_TAXONOMIA_FOURSQUARE = os.getenv('URL_TAXONOMIA_FOURSQUARE')
+
+# Número de paradas a partir del cual el mapa dibuja los marcadores en el navegador (capa ligera)
+# en lugar de generar un marcador HTML por parada
+MAX_MARCADORES_INDIVIDUALES = int(os.getenv('MAX_MARCADORES_INDIVIDUALES', 30))
+
+# Memoria máxima (en bytes) de las rutas que cada sesión mantiene en memoria; las que no caben se vuelcan a disco
+MAX_BYTES_RUTAS_SESION = int(os.getenv('MAX_BYTES_RUTAS_SESION', 8 * 1024 * 1024))
+
+# Directorio de las cachés persistentes en disco (compartidas entre sesiones y procesos de Streamlit)
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+class LimitadorTasa:
+    """
+    Limitador de tasa de tipo "token bucket" seguro entre hilos.
+
+    Parámetros:
+    -----------
+    tasa_por_segundo : float
+        Número de peticiones permitidas por segundo (ritmo al que se reponen los tokens).
+
+    capacidad : int
+        Número máximo de tokens acumulables (ráfaga máxima permitida).
+    """
+
+    def __init__(self, tasa_por_segundo: float, capacidad: int = 1):
+        self.tasa_por_segundo = tasa_por_segundo
+        self.capacidad = capacidad
+        self._tokens = float(capacidad)
+        self._ultima_recarga = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        """
+        Bloquea el hilo actual hasta que haya un token disponible y lo consume.
+        """
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultima_recarga) * self.tasa_por_segundo)
+                self._ultima_recarga = ahora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa_por_segundo
+            time.sleep(espera)
+
+
+# Limitador compartido por todos los hilos (y sesiones) del proceso para respetar la política de Nominatim
+limitador_nominatim = LimitadorTasa(NOMINATIM_PETICIONES_POR_SEGUNDO, capacidad=1)
+
+_sesiones_http = {}
+_clientes = {}
+_lock_clientes = threading.Lock()
+
+
+def obtener_sesion_http(proveedor: Literal["foursquare", "nominatim"]) -> requests.Session:
+    """
+    Devuelve la sesión HTTP compartida del proveedor indicado (una por proceso), con conexiones
+    persistentes (keep-alive), un pool de conexiones propio y reintentos ante errores 502/503/504.
+    Las cabeceras comunes del proveedor (autenticación, User-Agent) ya vienen configuradas.
+    """
+    with _lock_clientes:
+        if proveedor not in _sesiones_http:
+            sesion = requests.Session()
+            reintentos = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+            sesion.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=reintentos))
+
+            if proveedor == "foursquare":
+                sesion.headers.update({
+                    "accept": "application/json",
+                    "X-Places-Api-Version": "2025-06-17",
+                    "authorization": f"Bearer {FOURSQUARE_API_KEY}"
+                })
+            elif proveedor == "nominatim":
+                sesion.headers.update({
+                    "User-Agent": "PlanificadorDeRutasApp/1.0 (maria.martinez135@alu.uclm.es)"  # requerido por Nominatim
+                })
+            else:
+                raise ValueError(f"Proveedor HTTP desconocido: {proveedor}")
+
+            _sesiones_http[proveedor] = sesion
+        return _sesiones_http[proveedor]
+
+
+def obtener_cliente_ors() -> openrouteservice.Client:
+    """
+    Devuelve el cliente de OpenRouteService compartido por el proceso, con timeouts explícitos
+    y un pool de conexiones persistentes.
+    """
+    with _lock_clientes:
+        if "ors" not in _clientes:
+            client = openrouteservice.Client(key=ORS_API_KEY, timeout=(TIMEOUT_CONEXION, TIMEOUT_LECTURA))
+            client._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+            _clientes["ors"] = client
+        return _clientes["ors"]
+
+
+def obtener_cliente_groq() -> Groq:
+    """
+    Devuelve el cliente Groq compartido por el proceso (reutiliza sus conexiones HTTP), con timeouts explícitos.
+    """
+    with _lock_clientes:
+        if "groq" not in _clientes:
+            _clientes["groq"] = Groq(
+                api_key=GROQ_API_KEY,
+                timeout=httpx.Timeout(TIMEOUT_LECTURA, connect=TIMEOUT_CONEXION)
+            )
+        return _clientes["groq"]
+
+
+class CachePersistente:
+    """
+    Caché clave-valor persistente en disco (SQLite) con caducidad (TTL), expulsión LRU
+    por número de entradas y contadores de aciertos y fallos.
+
+    Cada operación abre su propia conexión y la base de datos trabaja en modo WAL,
+    por lo que puede compartirse entre hilos, sesiones de Streamlit y procesos.
+
+    Parámetros:
+    -----------
+    nombre : str
+        Nombre de la caché. Se guarda en `CACHE_DIR/<nombre>.sqlite`.
+
+    ttl_segundos : float
+        Tiempo de vida por defecto de cada entrada.
+
+    max_entradas : int
+        Número máximo de entradas. Al superarlo se eliminan las menos usadas recientemente.
+
+    max_bytes : int, opcional
+        Tamaño máximo (suma de los valores serializados) en disco. Al superarlo también se
+        eliminan las entradas menos usadas recientemente.
+    """
+
+    def __init__(self, nombre: str, ttl_segundos: float, max_entradas: int, max_bytes: Optional[int] = None):
+        self.nombre = nombre
+        self.ruta = os.path.join(CACHE_DIR, f"{nombre}.sqlite")
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self._inicializada = False
+
+    def _conectar(self) -> sqlite3.Connection:
+        if not self._inicializada:
+            with self._lock:
+                if not self._inicializada:
+                    os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+                    with closing(sqlite3.connect(self.ruta, timeout=30)) as con:
+                        con.execute("PRAGMA journal_mode=WAL")
+                        con.execute(
+                            "CREATE TABLE IF NOT EXISTS cache ("
+                            " clave TEXT PRIMARY KEY, valor TEXT NOT NULL,"
+                            " expira REAL NOT NULL, accedido REAL NOT NULL)"
+                        )
+                        con.execute("CREATE INDEX IF NOT EXISTS idx_accedido ON cache (accedido)")
+                        con.commit()
+                    self._inicializada = True
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def obtener_varios(self, claves: List[str]) -> Dict[str, object]:
+        """
+        Devuelve un diccionario {clave: valor} con las claves encontradas y no caducadas.
+        """
+        claves = list(dict.fromkeys(claves))
+        if not claves:
+            return {}
+
+        ahora = time.time()
+        encontrados = {}
+        with closing(self._conectar()) as con:
+            for inicio in range(0, len(claves), 500):  # límite de parámetros de SQLite
+                trozo = claves[inicio:inicio + 500]
+                marcas = ",".join("?" * len(trozo))
+                filas = con.execute(
+                    f"SELECT clave, valor FROM cache WHERE clave IN ({marcas}) AND expira > ?",
+                    (*trozo, ahora)
+                ).fetchall()
+                encontrados.update({clave: json.loads(valor) for clave, valor in filas})
+
+            # Actualizar la marca de último acceso (LRU)
+            if encontrados:
+                con.executemany(
+                    "UPDATE cache SET accedido = ? WHERE clave = ?",
+                    [(ahora, clave) for clave in encontrados]
+                )
+                con.commit()
+
+        with self._lock:
+            self.aciertos += len(encontrados)
+            self.fallos += len(claves) - len(encontrados)
+
+        return encontrados
+
+    def obtener(self, clave: str, por_defecto=None):
+        """
+        Devuelve el valor asociado a la clave, o `por_defecto` si no existe o ha caducado.
+        """
+        return self.obtener_varios([clave]).get(clave, por_defecto)
+
+    def guardar_varios(self, valores: Dict[str, object], ttl_segundos: Optional[float] = None):
+        """
+        Guarda varias entradas a la vez. `ttl_segundos` sustituye al TTL por defecto de la caché.
+        """
+        if not valores:
+            return
+
+        ahora = time.time()
+        expira = ahora + (self.ttl_segundos if ttl_segundos is None else ttl_segundos)
+        with closing(self._conectar()) as con:
+            con.executemany(
+                "INSERT OR REPLACE INTO cache (clave, valor, expira, accedido) VALUES (?, ?, ?, ?)",
+                [(clave, json.dumps(valor, ensure_ascii=False), expira, ahora) for clave, valor in valores.items()]
+            )
+            self._expulsar(con, ahora)
+            con.commit()
+
+    def guardar(self, clave: str, valor, ttl_segundos: Optional[float] = None):
+        """
+        Guarda una entrada. `ttl_segundos` sustituye al TTL por defecto de la caché.
+        """
+        self.guardar_varios({clave: valor}, ttl_segundos)
+
+    def eliminar(self, clave: str):
+        with closing(self._conectar()) as con:
+            con.execute("DELETE FROM cache WHERE clave = ?", (clave,))
+            con.commit()
+
+    def limpiar(self):
+        with closing(self._conectar()) as con:
+            con.execute("DELETE FROM cache")
+            con.commit()
+
+    def _expulsar(self, con: sqlite3.Connection, ahora: float):
+        # Elimina las entradas caducadas y, si se supera el máximo, las menos usadas recientemente
+        con.execute("DELETE FROM cache WHERE expira <= ?", (ahora,))
+        total = con.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if total > self.max_entradas:
+            con.execute(
+                "DELETE FROM cache WHERE clave IN (SELECT clave FROM cache ORDER BY accedido ASC LIMIT ?)",
+                (total - self.max_entradas,)
+            )
+            total = self.max_entradas
+
+        # Presupuesto en bytes: se eliminan por tandas (10 % de las entradas) las menos usadas
+        if self.max_bytes is not None:
+            while total > 0 and con.execute("SELECT COALESCE(SUM(LENGTH(valor)), 0) FROM cache").fetchone()[0] > self.max_bytes:
+                tanda = max(1, total // 10)
+                con.execute(
+                    "DELETE FROM cache WHERE clave IN (SELECT clave FROM cache ORDER BY accedido ASC LIMIT ?)",
+                    (tanda,)
+                )
+                total -= tanda
+
+    def estadisticas(self) -> Dict[str, float]:
+        """
+        Devuelve los contadores de aciertos y fallos de este proceso y el número de entradas guardadas.
+        """
+        with closing(self._conectar()) as con:
+            entradas = con.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "entradas": entradas
+        }
+
+
+class CacheMemoria:
+    """
+    Caché LRU en memoria del proceso, compartida por todas las sesiones de Streamlit, que agrupa
+    las peticiones concurrentes de una misma clave en un único cálculo.
+
+    Pensada para resultados caros de calcular que no merece la pena serializar a disco
+    (por ejemplo, rutas completas ya optimizadas). Los valores devueltos son compartidos:
+    quien los reciba no debe modificarlos.
+
+    Parámetros:
+    -----------
+    max_entradas : int
+        Número máximo de entradas. Al superarlo se eliminan las menos usadas recientemente.
+
+    max_bytes : int, opcional
+        Tamaño máximo (suma de `tamano(valor)`) de los valores guardados. Al superarlo también se
+        eliminan las entradas menos usadas recientemente. Requiere `tamano`.
+
+    tamano : callable, opcional
+        Función que estima el tamaño en bytes de un valor (por ejemplo, `len` para textos).
+    """
+
+    def __init__(self, max_entradas: int, max_bytes: Optional[int] = None, tamano=None):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.tamano = tamano
+        self.aciertos = 0
+        self.fallos = 0
+        self._bytes = 0
+        self._tamanos: Dict[str, int] = {}
+        self._datos = OrderedDict()
+        self._en_curso: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def obtener_o_calcular(self, clave: str, calcular):
+        """
+        Devuelve el valor de `clave`. Si no está, lo calcula con `calcular()` y lo guarda.
+        Si otro hilo ya lo está calculando, espera a su resultado (o a su excepción) en lugar de repetir el cálculo.
+        """
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return self._datos[clave]
+            futuro = self._en_curso.get(clave)
+            propietario = futuro is None
+            if propietario:
+                futuro = Future()
+                self._en_curso[clave] = futuro
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+
+        if not propietario:
+            return futuro.result()
+
+        try:
+            valor = calcular()
+        except BaseException as e:
+            with self._lock:
+                if self._en_curso.get(clave) is futuro:
+                    del self._en_curso[clave]
+            futuro.set_exception(e)
+            raise
+
+        with self._lock:
+            # Si la clave se invalidó durante el cálculo, el resultado se entrega pero no se guarda
+            if self._en_curso.get(clave) is futuro:
+                del self._en_curso[clave]
+                self._guardar(clave, valor)
+        futuro.set_result(valor)
+        return valor
+
+    def guardar(self, clave: str, valor):
+        with self._lock:
+            self._guardar(clave, valor)
+
+    def _guardar(self, clave: str, valor):
+        self._quitar(clave)
+        self._datos[clave] = valor
+        if self.tamano is not None:
+            self._tamanos[clave] = self.tamano(valor)
+            self._bytes += self._tamanos[clave]
+        while len(self._datos) > self.max_entradas or (
+            self.max_bytes is not None and self._bytes > self.max_bytes and len(self._datos) > 1
+        ):
+            self._quitar(next(iter(self._datos)))
+
+    def _quitar(self, clave: str):
+        self._datos.pop(clave, None)
+        self._bytes -= self._tamanos.pop(clave, 0)
+
+    def invalidar(self, clave: Optional[str] = None):
+        """
+        Elimina la entrada `clave` o, si no se indica, todas. Los cálculos en curso de las claves
+        invalidadas terminan normalmente, pero su resultado ya no se guarda.
+        """
+        with self._lock:
+            if clave is None:
+                self._datos.clear()
+                self._tamanos.clear()
+                self._bytes = 0
+                self._en_curso.clear()
+            else:
+                self._quitar(clave)
+                self._en_curso.pop(clave, None)
+
+    def estadisticas(self) -> Dict[str, float]:
+        """
+        Devuelve los contadores de aciertos y fallos y el número de entradas guardadas.
+        """
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "entradas": len(self._datos),
+            "bytes": self._bytes
+        }
+
+
+class AlmacenRutas:
+    """
+    Almacén persistente (SQLite) de las rutas guardadas por los usuarios, con índices para no tener
+    que recorrer ni cargar todo el historial.
+
+    El fichero es único para todo el servidor, pero cada ruta pertenece a un propietario (el
+    identificador del navegador que la guardó, ver `resolver_propietario`) y todas las operaciones
+    reciben ese propietario: cada usuario solo lista, abre, elimina y borra sus propias rutas. El
+    identificador no es una credencial: quien conozca el de otro usuario (por ejemplo, porque le
+    han pasado su URL) ve su historial.
+
+    - La huella de la ruta (ver `huella_ruta`) tiene un índice único por propietario: comprobar si
+      una ruta ya está guardada es una consulta por índice y el propio `INSERT` rechaza los duplicados
+      (la misma ruta guardada por otro usuario no cuenta como duplicado).
+    - La fecha, el origen y el destino tienen índices secundarios (por propietario) para listar y
+      filtrar el historial.
+    - Los metadatos del resumen (fecha, origen, destino, perfil, distancia, duración y número de
+      lugares) van en columnas propias: la lista del historial no lee ni descomprime nada más.
+    - Las coordenadas de las paradas y la geometría de la ruta se guardan como polilíneas codificadas
+      (precisión de 6 decimales, ~0,1 m); los lugares, en formato columnar; y todo lo que es JSON,
+      comprimido con zlib. La ruta completa solo se reconstruye al pedirla por su ID (`cargar`).
+
+    Igual que `CachePersistente`, cada operación abre su propia conexión en modo WAL, por lo que el
+    almacén puede compartirse entre hilos, sesiones de Streamlit y procesos.
+
+    Parámetros:
+    -----------
+    ruta : str
+        Fichero SQLite del almacén.
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._inicializado = False
+
+    def _conectar(self) -> sqlite3.Connection:
+        if not self._inicializado:
+            with self._lock:
+                if not self._inicializado:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+                    with closing(sqlite3.connect(self.ruta, timeout=30)) as con:
+                        con.execute("PRAGMA journal_mode=WAL")
+                        con.execute(
+                            "CREATE TABLE IF NOT EXISTS rutas ("
+                            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                            " propietario TEXT NOT NULL DEFAULT '',"
+                            " hash TEXT NOT NULL,"
+                            " fecha_hora TEXT NOT NULL,"
+                            " origen TEXT, destino TEXT, perfil TEXT,"
+                            " distancia_km REAL, duracion_min REAL, n_lugares INTEGER,"
+                            " coords TEXT NOT NULL,"
+                            " geometrias BLOB, ruta_geojson BLOB, instrucciones BLOB, lugares BLOB)"
+                        )
+                        # Almacenes creados antes de guardar el propietario: las rutas existentes quedan sin propietario
+                        columnas = {fila[1] for fila in con.execute("PRAGMA table_info(rutas)")}
+                        if "propietario" not in columnas:
+                            con.execute("ALTER TABLE rutas ADD COLUMN propietario TEXT NOT NULL DEFAULT ''")
+                        for indice in ("idx_rutas_hash", "idx_rutas_fecha", "idx_rutas_origen", "idx_rutas_destino"):
+                            con.execute(f"DROP INDEX IF EXISTS {indice}")
+                        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_rutas_propietario_hash ON rutas (propietario, hash)")
+                        con.execute("CREATE INDEX IF NOT EXISTS idx_rutas_propietario_fecha ON rutas (propietario, fecha_hora)")
+                        con.execute("CREATE INDEX IF NOT EXISTS idx_rutas_propietario_origen ON rutas (propietario, origen)")
+                        con.execute("CREATE INDEX IF NOT EXISTS idx_rutas_propietario_destino ON rutas (propietario, destino)")
+                        con.commit()
+                    self._inicializado = True
+        return sqlite3.connect(self.ruta, timeout=30)
+
+    def guardar(self, propietario: str, ruta: Dict) -> Optional[int]:
+        """
+        Guarda una ruta de `propietario` con la misma estructura que construye el planificador (`lugares` como lista
+        de registros, `coords`, `instrucciones`, `ruta_geojson`, `fecha_hora`, `origen`, `destino`,
+        `perfil`, `distancia_km`, `duracion_min` y `hash`).
+
+        Devuelve el ID asignado, o None si el propietario ya tenía una ruta guardada con la misma huella.
+        """
+        geometrias, ruta_sin_geometria = _separar_geometrias(ruta["ruta_geojson"])
+        lugares = pd.DataFrame(ruta["lugares"])
+        fila = (
+            propietario,
+            ruta["hash"],
+            ruta["fecha_hora"],
+            ruta.get("origen"),
+            ruta.get("destino"),
+            ruta.get("perfil"),
+            float(ruta["distancia_km"]),
+            float(ruta["duracion_min"]),
+            len(lugares),
+            _codificar_polilinea(ruta["coords"]),
+            _comprimir_json(geometrias),
+            _comprimir_json(ruta_sin_geometria),
+            _comprimir_json(ruta["instrucciones"]),
+            _comprimir_json({"columnas": list(lugares.columns), "datos": lugares.to_dict(orient="list")})
+        )
+        try:
+            with closing(self._conectar()) as con:
+                cursor = con.execute(
+                    "INSERT INTO rutas (propietario, hash, fecha_hora, origen, destino, perfil, distancia_km,"
+                    " duracion_min, n_lugares, coords, geometrias, ruta_geojson, instrucciones, lugares)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    fila
+                )
+                con.commit()
+                return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            return None
+
+    def existe(self, propietario: str, huella: str) -> bool:
+        """
+        Indica si `propietario` ya tiene una ruta guardada con la huella `huella` (consulta por el índice único).
+        """
+        with closing(self._conectar()) as con:
+            return con.execute(
+                "SELECT 1 FROM rutas WHERE propietario = ? AND hash = ?", (propietario, huella)
+            ).fetchone() is not None
+
+    def contar(self, propietario: str, origen: Optional[str] = None, destino: Optional[str] = None) -> int:
+        """
+        Número de rutas guardadas de `propietario`, opcionalmente solo las de un origen y/o un destino.
+        """
+        condiciones, valores = self._filtros(propietario, origen, destino)
+        with closing(self._conectar()) as con:
+            return con.execute(f"SELECT COUNT(*) FROM rutas{condiciones}", valores).fetchone()[0]
+
+    def listar_resumen(
+        self,
+        propietario: str,
+        limite: int = 10,
+        desplazamiento: int = 0,
+        origen: Optional[str] = None,
+        destino: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Devuelve una página del historial de `propietario`, de la ruta más reciente a la más antigua,
+        solo con los metadatos del resumen: id, fecha_hora, origen, destino, perfil, distancia_km,
+        duracion_min y n_lugares. Se puede filtrar por origen y/o destino.
+        """
+        condiciones, valores = self._filtros(propietario, origen, destino)
+        with closing(self._conectar()) as con:
+            con.row_factory = sqlite3.Row
+            filas = con.execute(
+                "SELECT id, fecha_hora, origen, destino, perfil, distancia_km, duracion_min, n_lugares"
+                f" FROM rutas{condiciones} ORDER BY fecha_hora DESC, id DESC LIMIT ? OFFSET ?",
+                (*valores, limite, desplazamiento)
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+
+    def cargar(self, propietario: str, id_ruta: int) -> Optional[Dict]:
+        """
+        Reconstruye la ruta completa con `id_ruta`, con la misma estructura con la que se guardó.
+        Devuelve None si no existe o no es de `propietario`.
+        """
+        with closing(self._conectar()) as con:
+            con.row_factory = sqlite3.Row
+            fila = con.execute(
+                "SELECT * FROM rutas WHERE id = ? AND propietario = ?", (id_ruta, propietario)
+            ).fetchone()
+        if fila is None:
+            return None
+
+        lugares = _descomprimir_json(fila["lugares"])
+        return {
+            "id": fila["id"],
+            "hash": fila["hash"],
+            "fecha_hora": fila["fecha_hora"],
+            "origen": fila["origen"],
+            "destino": fila["destino"],
+            "perfil": fila["perfil"],
+            "distancia_km": fila["distancia_km"],
+            "duracion_min": fila["duracion_min"],
+            "coords": _decodificar_polilinea(fila["coords"]),
+            "ruta_geojson": _unir_geometrias(
+                _descomprimir_json(fila["ruta_geojson"]), _descomprimir_json(fila["geometrias"])
+            ),
+            "instrucciones": _descomprimir_json(fila["instrucciones"]),
+            "lugares": pd.DataFrame(lugares["datos"], columns=lugares["columnas"]).to_dict(orient="records")
+        }
+
+    def eliminar(self, propietario: str, id_ruta: int):
+        with closing(self._conectar()) as con:
+            con.execute("DELETE FROM rutas WHERE id = ? AND propietario = ?", (id_ruta, propietario))
+            con.commit()
+
+    def borrar_todo(self, propietario: str):
+        """
+        Elimina todas las rutas de `propietario` (las de los demás usuarios no se tocan).
+        """
+        with closing(self._conectar()) as con:
+            con.execute("DELETE FROM rutas WHERE propietario = ?", (propietario,))
+            con.commit()
+
+    @staticmethod
+    def _filtros(propietario: str, origen: Optional[str], destino: Optional[str]) -> tuple:
+        condiciones, valores = ["propietario = ?"], [propietario]
+        if origen is not None:
+            condiciones.append("origen = ?")
+            valores.append(origen)
+        if destino is not None:
+            condiciones.append("destino = ?")
+            valores.append(destino)
+        return " WHERE " + " AND ".join(condiciones), tuple(valores)
+
+
+def _comprimir_json(valor) -> bytes:
+    # Los tipos de NumPy que puedan venir de los DataFrames (np.int64, np.bool_...) se guardan como nativos
+    return zlib.compress(
+        json.dumps(valor, ensure_ascii=False, separators=(",", ":"), default=lambda x: x.item()).encode()
+    )
+
+
+def _descomprimir_json(valor: bytes):
+    return json.loads(zlib.decompress(valor))
+
+
+def _codificar_polilinea(coords: List[List[float]], precision: int = 6) -> str:
+    """
+    Codifica una lista de coordenadas [lng, lat] con el algoritmo de polilíneas de Google
+    (deltas en enteros con signo en zigzag, en grupos de 5 bits). Se codifica en orden [lat, lng],
+    como en el formato original.
+    """
+    if len(coords) == 0:
+        return ""
+    enteros = np.rint(np.asarray(coords, dtype=float)[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(enteros, axis=0, prepend=0).ravel()
+    zigzag = ((deltas << 1) ^ (deltas >> 63)).tolist()
+
+    caracteres = []
+    for valor in zigzag:
+        while valor >= 0x20:
+            caracteres.append(chr((0x20 | (valor & 0x1f)) + 63))
+            valor >>= 5
+        caracteres.append(chr(valor + 63))
+    return "".join(caracteres)
+
+
+def _decodificar_polilinea(polilinea: str, precision: int = 6) -> List[List[float]]:
+    """
+    Inversa de `_codificar_polilinea`: devuelve la lista de coordenadas [lng, lat].
+    """
+    valores = []
+    valor = desplazamiento = 0
+    for caracter in polilinea:
+        bits = ord(caracter) - 63
+        valor |= (bits & 0x1f) << desplazamiento
+        desplazamiento += 5
+        if bits < 0x20:
+            valores.append(~(valor >> 1) if valor & 1 else valor >> 1)
+            valor = desplazamiento = 0
+    if not valores:
+        return []
+    enteros = np.cumsum(np.asarray(valores, dtype=np.int64).reshape(-1, 2), axis=0)
+    return (enteros[:, ::-1] / 10 ** precision).tolist()
+
+
+def _separar_geometrias(ruta: Dict) -> tuple:
+    """
+    Separa las líneas 2D de una ruta GeoJSON, codificadas como polilíneas, del resto de la ruta.
+    Las geometrías que no son líneas 2D (por ejemplo, con elevación) se quedan tal cual en la ruta.
+    """
+    geometrias = []
+    features = []
+    for feature in ruta.get("features", []):
+        geometria = feature.get("geometry") or {}
+        coordenadas = geometria.get("coordinates")
+        if geometria.get("type") == "LineString" and coordenadas and all(len(c) == 2 for c in coordenadas):
+            geometrias.append(_codificar_polilinea(coordenadas))
+            feature = {**feature, "geometry": {**geometria, "coordinates": None}}
+        else:
+            geometrias.append(None)
+        features.append(feature)
+    return geometrias, {**ruta, "features": features}
+
+
+def _unir_geometrias(ruta: Dict, geometrias: List[Optional[str]]) -> Dict:
+    """
+    Inversa de `_separar_geometrias`.
+    """
+    for feature, polilinea in zip(ruta.get("features", []), geometrias):
+        if polilinea is not None:
+            feature["geometry"]["coordinates"] = _decodificar_polilinea(polilinea)
+    return ruta
+
+
+def resolver_propietario(*candidatos: Optional[str]) -> str:
+    """
+    Devuelve el primero de `candidatos` que sea un identificador de propietario válido (32 caracteres
+    hexadecimales, como los que genera esta función) o, si no hay ninguno, uno nuevo.
+
+    Las páginas lo guardan en el estado de la sesión y en el parámetro `usuario` de la URL, de modo que
+    el historial de `almacen_rutas` se mantiene al recargar la página o volver desde un marcador.
+    """
+    for candidato in candidatos:
+        if isinstance(candidato, str) and re.fullmatch(r"[0-9a-f]{32}", candidato):
+            return candidato
+    return uuid.uuid4().hex
+
+
+class RutaCompacta:
+    """
+    Representación compacta en memoria de una ruta, para las rutas que se mantienen en el estado de
+    la sesión de Streamlit.
+
+    - Las coordenadas de las paradas se guardan en un array `int32` de millonésimas de grado
+      (4 bytes por valor, exactas a 6 decimales, la misma precisión con la que se emparejan
+      paradas y lugares en el mapa).
+    - La geometría de la ruta se guarda como polilíneas codificadas y el resto del GeoJSON de ORS
+      (resumen, tramos, pasos...), comprimido. `a_geojson` reconstruye el GeoJSON solo cuando
+      se necesita; el resultado no se guarda.
+    - Los lugares se guardan por columnas: las numéricas como arrays de NumPy y las de texto
+      (categoría, dirección...) como códigos enteros sobre sus valores distintos, internados con
+      `sys.intern` para que los textos repetidos entre rutas y sesiones se compartan.
+    - `huella` identifica lo que se dibuja de la ruta (paradas y geometría) y se calcula una sola vez
+      al crearla, sobre los datos ya compactados. Es la clave de la caché de mapas
+      (ver `generar_mapa_ruta_html`), que así no necesita reconstruir el GeoJSON en cada rerun.
+      No confundir con `hash`, la huella de la selección con la que se detectan rutas duplicadas.
+
+    Se construye con `desde_dict` (misma estructura que `AlmacenRutas.cargar`) o con `crear`.
+    """
+
+    __slots__ = (
+        "id", "hash", "huella", "fecha_hora", "origen", "destino", "perfil", "distancia_km", "duracion_min",
+        "instrucciones", "_coords", "_geometrias", "_ruta", "_lugares", "_tamano"
+    )
+
+    @classmethod
+    def crear(
+        cls,
+        ruta_geojson: Dict,
+        coords: List[List[float]],
+        instrucciones: List[str],
+        lugares=None,
+        **metadatos
+    ) -> "RutaCompacta":
+        """
+        Compacta una ruta tal y como la devuelven `obtener_ruta_optimizada` y compañía. `lugares`
+        (DataFrame o lista de registros) es opcional. `metadatos` admite id, hash, fecha_hora, origen,
+        destino, perfil, distancia_km y duracion_min; la distancia y la duración se toman del resumen
+        de ORS si no se indican.
+        """
+        ruta = cls.__new__(cls)
+        resumen = ((ruta_geojson.get("features") or [{}])[0].get("properties") or {}).get("summary", {})
+        ruta.id = metadatos.get("id")
+        ruta.hash = metadatos.get("hash")
+        ruta.fecha_hora = metadatos.get("fecha_hora")
+        ruta.origen = metadatos.get("origen")
+        ruta.destino = metadatos.get("destino")
+        ruta.perfil = metadatos.get("perfil")
+        ruta.distancia_km = metadatos.get("distancia_km", resumen.get("distance", 0) / 1000)
+        ruta.duracion_min = metadatos.get("duracion_min", resumen.get("duration", 0) / 60)
+        ruta.instrucciones = tuple(sys.intern(str(paso)) for paso in instrucciones)
+        ruta._coords = np.rint(np.asarray(coords, dtype=float).reshape(-1, 2) * 1e6).astype(np.int32)
+        geometrias, ruta_sin_geometria = _separar_geometrias(ruta_geojson)
+        ruta._geometrias = tuple(geometrias)
+        ruta._ruta = _comprimir_json(ruta_sin_geometria)
+        ruta._lugares = None if lugares is None else _compactar_lugares(pd.DataFrame(lugares))
+        huella = hashlib.sha256(ruta._coords.tobytes())
+        for geometria in ruta._geometrias:
+            huella.update(b"\0" + (geometria or "").encode())
+        ruta.huella = huella.hexdigest()
+        ruta._tamano = ruta._medir()
+        return ruta
+
+    @classmethod
+    def desde_dict(cls, ruta: Dict) -> "RutaCompacta":
+        metadatos = {k: v for k, v in ruta.items() if k not in ("ruta_geojson", "coords", "instrucciones", "lugares")}
+        # Sin lugares guardados (lista vacía) la ruta no tiene lugares, igual que si faltara la clave
+        return cls.crear(ruta["ruta_geojson"], ruta["coords"], ruta["instrucciones"], ruta.get("lugares") or None, **metadatos)
+
+    @property
+    def coords(self) -> List[List[float]]:
+        return (self._coords / 1e6).tolist()
+
+    def a_geojson(self) -> Dict:
+        return _unir_geometrias(_descomprimir_json(self._ruta), list(self._geometrias))
+
+    def lugares_df(self) -> Optional[pd.DataFrame]:
+        return None if self._lugares is None else _expandir_lugares(self._lugares)
+
+    def a_dict(self) -> Dict:
+        """
+        Devuelve la ruta completa con la estructura de `AlmacenRutas.cargar` (lugares como registros).
+        """
+        lugares = self.lugares_df()
+        return {
+            "id": self.id,
+            "hash": self.hash,
+            "fecha_hora": self.fecha_hora,
+            "origen": self.origen,
+            "destino": self.destino,
+            "perfil": self.perfil,
+            "distancia_km": self.distancia_km,
+            "duracion_min": self.duracion_min,
+            "coords": self.coords,
+            "ruta_geojson": self.a_geojson(),
+            "instrucciones": list(self.instrucciones),
+            "lugares": [] if lugares is None else lugares.to_dict(orient="records")
+        }
+
+    def tamano_bytes(self) -> int:
+        """
+        Estimación de la memoria que ocupa la ruta (arrays, textos y bloques comprimidos).
+        """
+        return self._tamano
+
+    def _medir(self) -> int:
+        tamano = sys.getsizeof(self._ruta) + self._coords.nbytes
+        tamano += sum(sys.getsizeof(g) for g in self._geometrias if g is not None)
+        tamano += sum(sys.getsizeof(paso) for paso in self.instrucciones)
+        for columna in (self._lugares or {}).get("datos", {}).values():
+            if isinstance(columna, np.ndarray):
+                tamano += columna.nbytes
+            else:
+                valores, codigos = columna
+                tamano += codigos.nbytes + sum(sys.getsizeof(v) for v in valores)
+        return tamano
+
+
+def _compactar_lugares(df: pd.DataFrame) -> Dict:
+    """
+    Lugares por columnas: arrays de NumPy para las numéricas y (valores distintos internados, códigos)
+    para las de texto. Las columnas con valores no hashables (listas...) se guardan como tuplas.
+    """
+    datos = {}
+    for columna in df.columns:
+        serie = df[columna]
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+            datos[columna] = serie.to_numpy(copy=True)
+            continue
+        try:
+            codigos, valores = pd.factorize(serie)
+        except TypeError:
+            datos[columna] = (tuple(serie), np.arange(len(serie), dtype=np.int32))
+            continue
+        valores = tuple(sys.intern(v) if isinstance(v, str) else v for v in valores)
+        datos[columna] = (valores, codigos.astype(np.int16 if len(valores) < 2 ** 15 else np.int32))
+    return {"columnas": tuple(df.columns), "datos": datos}
+
+
+def _expandir_lugares(lugares: Dict) -> pd.DataFrame:
+    columnas = {}
+    for columna, datos in lugares["datos"].items():
+        if isinstance(datos, np.ndarray):
+            columnas[columna] = datos.copy()
+        else:
+            valores, codigos = datos
+            columnas[columna] = [valores[c] if c >= 0 else None for c in codigos.tolist()]
+    return pd.DataFrame(columnas, columns=list(lugares["columnas"]))
+
+
+class MemoriaRutasSesion:
+    """
+    Rutas de una sesión de Streamlit (como `RutaCompacta`) con un presupuesto de memoria propio.
+
+    Al superar `max_bytes` se sacan de memoria las rutas usadas hace más tiempo (LRU): las que están
+    en el almacén de rutas guardadas (tienen `id`) simplemente se descartan y se vuelven a cargar de
+    él al pedirlas; las demás se vuelcan a disco (`cache_rutas_sesion`) y se recuperan de allí.
+    La ruta que se acaba de guardar o pedir nunca se expulsa, aunque por sí sola supere el presupuesto.
+
+    Parámetros:
+    -----------
+    max_bytes : int
+        Memoria máxima (según `RutaCompacta.tamano_bytes`) de las rutas de la sesión.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES_RUTAS_SESION):
+        self.max_bytes = max_bytes
+        self.id_sesion = uuid.uuid4().hex
+        self.volcadas = 0
+        self.recuperadas = 0
+        self._bytes = 0
+        self._rutas = OrderedDict()
+        self._en_disco = set()
+        self._lock = threading.Lock()
+
+    def guardar(self, clave: str, ruta: RutaCompacta):
+        with self._lock:
+            self._quitar(clave)
+            self._en_disco.discard(clave)
+            self._rutas[clave] = ruta
+            self._bytes += ruta.tamano_bytes()
+            self._expulsar()
+
+    def obtener(self, clave: str) -> Optional[RutaCompacta]:
+        """
+        Devuelve la ruta `clave`, recuperándola del disco si se había volcado, o None si no está.
+        """
+        with self._lock:
+            if clave in self._rutas:
+                self._rutas.move_to_end(clave)
+                return self._rutas[clave]
+            if clave not in self._en_disco:
+                return None
+            self._en_disco.discard(clave)
+            registro = cache_rutas_sesion.obtener(self._clave_disco(clave))
+            if registro is None:  # caducada o expulsada de la caché
+                return None
+            ruta = RutaCompacta.desde_dict(registro)
+            self.recuperadas += 1
+            self._rutas[clave] = ruta
+            self._bytes += ruta.tamano_bytes()
+            self._expulsar()
+            return ruta
+
+    def cargar_guardada(self, propietario: str, id_ruta: int) -> Optional[RutaCompacta]:
+        """
+        Devuelve la ruta `id_ruta` de `propietario` del almacén de rutas guardadas, leyéndola de él solo
+        si no está ya en memoria.
+        """
+        clave = f"almacen|{propietario}|{id_ruta}"
+        ruta = self.obtener(clave)
+        if ruta is None:
+            datos = almacen_rutas.cargar(propietario, id_ruta)
+            if datos is None:
+                return None
+            ruta = RutaCompacta.desde_dict(datos)
+            self.guardar(clave, ruta)
+        return ruta
+
+    def eliminar(self, clave: str):
+        with self._lock:
+            self._quitar(clave)
+            if clave in self._en_disco:
+                self._en_disco.discard(clave)
+                cache_rutas_sesion.eliminar(self._clave_disco(clave))
+
+    def estadisticas(self) -> Dict[str, int]:
+        """
+        Devuelve la memoria usada y el presupuesto de la sesión, el número de rutas en memoria y en
+        disco y cuántas se han volcado y recuperado.
+        """
+        with self._lock:
+            return {
+                "rutas_en_memoria": len(self._rutas),
+                "bytes_en_memoria": self._bytes,
+                "max_bytes": self.max_bytes,
+                "rutas_en_disco": len(self._en_disco),
+                "volcadas": self.volcadas,
+                "recuperadas": self.recuperadas
+            }
+
+    def _quitar(self, clave: str):
+        ruta = self._rutas.pop(clave, None)
+        if ruta is not None:
+            self._bytes -= ruta.tamano_bytes()
+
+    def _expulsar(self):
+        while self._bytes > self.max_bytes and len(self._rutas) > 1:
+            clave, ruta = next(iter(self._rutas.items()))
+            self._quitar(clave)
+            if ruta.id is None:
+                cache_rutas_sesion.guardar(self._clave_disco(clave), ruta.a_dict())
+                self._en_disco.add(clave)
+                self.volcadas += 1
+
+    def _clave_disco(self, clave: str) -> str:
+        return f"{self.id_sesion}|{clave}"
+
+
+def _normalizar_texto(texto) -> str:
+    """
+    Normaliza un texto para usarlo como clave de caché: minúsculas, sin tildes y con los espacios colapsados.
+    """
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+
+_modelo_embeddings = None
+_modelo_embeddings_fallido = False
+_lock_modelo_embeddings = threading.Lock()
+
+
+def _obtener_modelo_embeddings():
+    """
+    Carga una única vez (por proceso) el modelo de embeddings en CPU.
+    Devuelve None si `sentence-transformers` no está disponible o el modelo no se puede cargar.
+    """
+    global _modelo_embeddings, _modelo_embeddings_fallido
+
+    if SentenceTransformer is None or _modelo_embeddings_fallido:
+        return None
+
+    with _lock_modelo_embeddings:
+        if _modelo_embeddings is None and not _modelo_embeddings_fallido:
+            try:
+                _modelo_embeddings = SentenceTransformer(MODELO_EMBEDDINGS, device="cpu")
+            except Exception as e:
+                print(f"Error al cargar el modelo de embeddings '{MODELO_EMBEDDINGS}':", e)
+                _modelo_embeddings_fallido = True  # no reintentar en cada búsqueda
+    return _modelo_embeddings
+
+
+def similitud_local(query: str, textos: List[str]) -> Optional[np.ndarray]:
+    """
+    Calcula en CPU la similitud coseno entre la query y cada texto usando el modelo de embeddings.
+
+    Devuelve un array con una similitud por texto, o None si el modelo no está disponible.
+    """
+    modelo = _obtener_modelo_embeddings()
+    if modelo is None or not textos:
+        return None
+
+    embeddings = modelo.encode([query] + list(textos), normalize_embeddings=True, convert_to_numpy=True)
+    return embeddings[1:] @ embeddings[0]
+
+
+class EjecutorLLM:
+    """
+    Ejecuta llamadas al LLM (Groq) en paralelo con concurrencia acotada y una ventana de
+    peticiones en vuelo que se adapta a los límites de uso del proveedor.
+
+    - La ventana crece de uno en uno con cada respuesta correcta y se reduce a lo que indiquen
+      las cabeceras `x-ratelimit-remaining-requests` cuando quedan pocas peticiones disponibles.
+    - Ante un 429 la ventana se reduce a la mitad y no se envía nada nuevo hasta que pase
+      el tiempo indicado en `retry-after`; la petición se reintenta hasta `max_reintentos` veces.
+    - Cada petición tiene un timeout propio y cada tarea un plazo máximo, de modo que una llamada
+      lenta no bloquea la búsqueda completa. El plazo solo corre mientras la tarea se ejecuta:
+      no cuenta el tiempo en la cola del pool ni la espera a que haya hueco en la ventana.
+
+    Se comparte una única instancia por proceso (`ejecutor_llm`), ya que los límites de Groq
+    se aplican por API key y no por sesión.
+
+    Parámetros:
+    -----------
+    max_concurrencia : int
+        Número máximo de peticiones simultáneas (tamaño del pool de hilos y techo de la ventana).
+
+    concurrencia_inicial : int
+        Tamaño inicial de la ventana de peticiones en vuelo.
+
+    timeout_peticion : float
+        Timeout en segundos de cada petición HTTP al LLM.
+
+    max_reintentos : int
+        Reintentos tras un 429 antes de dar la petición por fallida.
+    """
+
+    def __init__(
+        self,
+        max_concurrencia: int = 8,
+        concurrencia_inicial: int = 4,
+        timeout_peticion: float = 20.0,
+        max_reintentos: int = 2
+    ):
+        self.max_concurrencia = max(1, max_concurrencia)
+        self.ventana = max(1, min(concurrencia_inicial, self.max_concurrencia))
+        self.timeout_peticion = timeout_peticion
+        self.max_reintentos = max_reintentos
+        self.respuestas_429 = 0
+        self._en_vuelo = 0
+        self._pausa_hasta = 0.0
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrencia, thread_name_prefix="llm")
+        self._local = threading.local()  # marca de inicio de la tarea que ejecuta cada hilo del pool
+
+    def completar(self, groq_client: Groq, **kwargs):
+        """
+        Llamada bloqueante a `chat.completions.create` respetando la ventana y las pausas por límite de uso.
+        Lanza la excepción original si la petición falla (o si se agotan los reintentos tras 429).
+        """
+        cliente = groq_client.with_options(max_retries=0)  # los reintentos los gestiona el ejecutor
+        marca = getattr(self._local, "marca", None)
+
+        for intento in range(self.max_reintentos + 1):
+            # La espera a la ventana (o a la pausa tras un 429) no cuenta para el plazo de la tarea;
+            # el plazo vuelve a empezar al enviar la petición
+            if marca is not None:
+                marca["inicio"] = None
+            self._adquirir()
+            if marca is not None:
+                marca["inicio"] = time.monotonic()
+            try:
+                respuesta = cliente.chat.completions.with_raw_response.create(
+                    timeout=self.timeout_peticion, **kwargs
+                )
+            except RateLimitError as e:
+                self._liberar()
+                self._registrar_429(e.response.headers)
+                if intento == self.max_reintentos:
+                    raise
+                continue
+            except Exception:
+                self._liberar()
+                raise
+
+            self._liberar()
+            self._ajustar_ventana(respuesta.headers)
+            return respuesta.parse()
+
+    def ejecutar_en_orden(self, funcion, argumentos: List[tuple], plazo: Optional[float] = None) -> List:
+        """
+        Ejecuta `funcion(*args)` para cada elemento de `argumentos` en el pool y devuelve los resultados
+        en el mismo orden que los argumentos (resultado determinista).
+
+        Si una tarea lanza una excepción o no termina dentro de `plazo` segundos, su resultado es None,
+        distinto de cualquier respuesta real: cada llamador decide qué hacer con él (por ejemplo, no
+        tomarlo como veredicto ni guardarlo en caché). El plazo empieza cuando la tarea empieza a ejecutarse (no cuando se envía al pool)
+        y, si la tarea llama a `completar`, cuando sale su petición al LLM.
+        """
+        if plazo is None:
+            plazo = self.timeout_peticion * (self.max_reintentos + 1) + 5
+
+        futuros = []
+        for args in argumentos:
+            marca = {"inicio": None}
+            futuros.append((self._pool.submit(self._ejecutar_con_marca, marca, funcion, args), marca))
+
+        resultados = []
+        for futuro, marca in futuros:
+            try:
+                resultados.append(self._esperar(futuro, marca, plazo))
+            except FuturesTimeoutError:
+                futuro.cancel()
+                print(f"Plazo de {plazo:.0f} s agotado en una tarea del LLM")
+                resultados.append(None)
+            except Exception as e:
+                print("Error en una tarea del LLM:", e)
+                resultados.append(None)
+        return resultados
+
+    def _ejecutar_con_marca(self, marca: Dict, funcion, args: tuple):
+        marca["inicio"] = time.monotonic()
+        self._local.marca = marca
+        try:
+            return funcion(*args)
+        finally:
+            self._local.marca = None
+
+    @staticmethod
+    def _esperar(futuro: Future, marca: Dict, plazo: float):
+        # Espera por tramos cortos porque el inicio del plazo puede moverse (cola, ventana, reintentos)
+        while True:
+            inicio = marca["inicio"]
+            restante = None if inicio is None else inicio + plazo - time.monotonic()
+            if restante is not None and restante <= 0 and not futuro.done():
+                raise FuturesTimeoutError()
+            try:
+                return futuro.result(timeout=0.25 if restante is None else max(0.0, min(restante, 0.25)))
+            except FuturesTimeoutError:
+                continue
+
+    def _adquirir(self):
+        with self._cond:
+            while True:
+                espera = self._pausa_hasta - time.monotonic()
+                if espera > 0:
+                    self._cond.wait(espera)
+                elif self._en_vuelo >= self.ventana:
+                    self._cond.wait()
+                else:
+                    break
+            self._en_vuelo += 1
+
+    def _liberar(self):
+        with self._cond:
+            self._en_vuelo -= 1
+            self._cond.notify_all()
+
+    def _ajustar_ventana(self, cabeceras):
+        restantes = _leer_entero(cabeceras.get("x-ratelimit-remaining-requests"))
+        with self._cond:
+            if restantes is not None and restantes < self.ventana:
+                self.ventana = max(1, restantes)
+                if restantes == 0:
+                    reinicio = _leer_duracion(cabeceras.get("x-ratelimit-reset-requests"))
+                    self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + (reinicio or 1.0))
+            else:
+                self.ventana = min(self.max_concurrencia, self.ventana + 1)
+            self._cond.notify_all()
+
+    def _registrar_429(self, cabeceras):
+        espera = _leer_duracion(cabeceras.get("retry-after")) or 1.0
+        with self._cond:
+            self.respuestas_429 += 1
+            self.ventana = max(1, self.ventana // 2)
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + espera)
+            self._cond.notify_all()
+
+
+def _leer_entero(valor) -> Optional[int]:
+    try:
+        return int(float(valor))
+    except (TypeError, ValueError):
+        return None
+
+
+def _leer_duracion(valor) -> Optional[float]:
+    """
+    Convierte una duración de cabecera ("2", "7.66s", "2m59.56s", "120ms") a segundos.
+    """
+    if valor is None:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+
+    partes = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", str(valor))
+    if not partes:
+        return None
+    factores = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(numero) * factores[unidad] for numero, unidad in partes)
+
+
+# Ejecutor compartido por todas las sesiones del proceso
+ejecutor_llm = EjecutorLLM(
+    max_concurrencia=int(os.getenv('LLM_MAX_CONCURRENCIA', 8)),
+    timeout_peticion=float(os.getenv('LLM_TIMEOUT', 20))
+)
+
+
+# Caché de veredictos del LLM por (query, categoría[, nombre])
+cache_veredictos = CachePersistente(
+    "veredictos",
+    ttl_segundos=float(os.getenv('CACHE_VEREDICTOS_TTL', 30 * 24 * 3600)),
+    max_entradas=int(os.getenv('CACHE_VEREDICTOS_MAX', 50000))
+)
+
+# Caché de geocodificación (Nominatim). Las direcciones no encontradas se guardan con un TTL más corto
+cache_geocodificacion = CachePersistente(
+    "geocodificacion",
+    ttl_segundos=float(os.getenv('CACHE_GEOCODIFICACION_TTL', 90 * 24 * 3600)),
+    max_entradas=int(os.getenv('CACHE_GEOCODIFICACION_MAX', 20000))
+)
+CACHE_GEOCODIFICACION_TTL_NEGATIVO = float(os.getenv('CACHE_GEOCODIFICACION_TTL_NEGATIVO', 24 * 3600))
+
+# Caché de tramos de ruta de ORS por (perfil, origen, destino)
+cache_tramos = CachePersistente(
+    "tramos",
+    ttl_segundos=float(os.getenv('CACHE_TRAMOS_TTL', 30 * 24 * 3600)),
+    max_entradas=int(os.getenv('CACHE_TRAMOS_MAX', 50000)),
+    max_bytes=int(os.getenv('CACHE_TRAMOS_MAX_BYTES', 300 * 1024 * 1024))
+)
+
+# Caché de respuestas en bruto de Foursquare por (query, celda geohash) y de los veredictos por (query, ID)
+cache_foursquare = CachePersistente(
+    "foursquare",
+    ttl_segundos=float(os.getenv('CACHE_FOURSQUARE_TTL', 7 * 24 * 3600)),
+    max_entradas=int(os.getenv('CACHE_FOURSQUARE_MAX', 100000)),
+    max_bytes=int(os.getenv('CACHE_FOURSQUARE_MAX_BYTES', 200 * 1024 * 1024))
+)
+
+# Caché de isócronas de ORS por (perfil, punto, tiempo)
+cache_isocronas = CachePersistente(
+    "isocronas",
+    ttl_segundos=float(os.getenv('CACHE_ISOCRONAS_TTL', 30 * 24 * 3600)),
+    max_entradas=int(os.getenv('CACHE_ISOCRONAS_MAX', 2000))
+)
+
+# Caché en memoria de rutas completas por huella de la selección (ver `huella_ruta`)
+cache_rutas = CacheMemoria(max_entradas=int(os.getenv('CACHE_RUTAS_MAX', 256)))
+
+# Caché en memoria del HTML de los mapas ya generados, por huella de la ruta y de los lugares (ver `huella_mapa`)
+cache_mapas = CacheMemoria(
+    max_entradas=int(os.getenv('CACHE_MAPAS_MAX', 64)),
+    max_bytes=int(os.getenv('CACHE_MAPAS_MAX_BYTES', 100 * 1024 * 1024)),
+    tamano=len
+)
+
+# Rutas que las sesiones sacan de memoria por superar su presupuesto (ver `MemoriaRutasSesion`)
+cache_rutas_sesion = CachePersistente(
+    "rutas_sesion",
+    ttl_segundos=float(os.getenv('CACHE_RUTAS_SESION_TTL', 24 * 3600)),
+    max_entradas=int(os.getenv('CACHE_RUTAS_SESION_MAX', 5000)),
+    max_bytes=int(os.getenv('CACHE_RUTAS_SESION_MAX_BYTES', 200 * 1024 * 1024))
+)
+
+# Almacén persistente de las rutas guardadas (historial), compartido por las páginas del historial y del chat
+almacen_rutas = AlmacenRutas(
+    os.getenv('RUTAS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), ".datos", "rutas.sqlite"))
+)
+
+
+def buscar_lugares(
+    query: Union[str, List[str]],
+    radius: int,
+    latitude: float,
+    longitude: float,
+    modo_validacion: Literal["lote", "individual"] = "lote",
+    tamano_lote: int = TAMANO_LOTE_VALIDACION,
+    modo_busqueda: Literal["simple", "teselado"] = "simple",
+    isocrona: Optional[List] = None,
+    usar_categorias: bool = True
+):
+    """
+        Busca lugares específicos en una ubicación determinada usando la API de Foursquare 
+        y valida los resultados con un modelo de lenguaje LLM.
+
+        Parámetros:
+        -----------
+        query : str o List[str]
+            Término de búsqueda que se enviará a la API de Foursquare. 
+            Con una lista de términos, cada uno se busca en paralelo, los candidatos de todos se validan
+            juntos en las mismas peticiones agrupadas y los resultados se fusionan sin duplicados
+            (ver `_buscar_lugares_varias`).
+        
+        radius : int
+            Radio de búsqueda en metros desde las coordenadas indicadas.
+
+        latitude : float
+             Latitud del punto central de búsqueda.
+
+        longitude : float
+             Longitud del punto central de búsqueda.
+
+        modo_validacion : {"lote", "individual"}, opcional
+            - "lote"       : valida los lugares en unas pocas peticiones agrupadas (por defecto).
+            - "individual" : una petición al LLM por cada lugar.
+
+        tamano_lote : int, opcional
+            Número máximo de lugares enviados en cada petición agrupada.
+
+        modo_busqueda : {"simple", "teselado"}, opcional
+            - "simple"   : una única petición a Foursquare (como máximo 50 lugares, los más cercanos al centro).
+            - "teselado" : si la primera petición se satura, cubre el círculo con celdas geohash dimensionadas
+                           según la densidad de lugares y las consulta en paralelo (ver `_buscar_foursquare_teselado`).
+
+        isocrona : list, opcional
+            Polígonos de alcance devueltos por `obtener_isocrona`. Si se indican, los lugares que quedan
+            fuera se descartan antes de validarlos.
+
+        usar_categorias : bool, opcional
+            Si es True (por defecto), traduce la query a categorías de Foursquare (ver `resolver_categorias_foursquare`),
+            las envía como filtro a la API y acepta sin validar los lugares de esas categorías.
+
+        Proceso:
+        --------
+        - Resuelve las categorías de Foursquare que corresponden a la query, si las hay.
+        - Consulta la API de Foursquare para obtener lugares que coincidan con el término (query) y área especificados.  
+        - Extrae información relevante (nombre, dirección, categoría, coordenadas, etc.).
+        - Si se indica una isócrona, descarta los lugares no alcanzables desde el punto de inicio.
+        - Utiliza un modelo LLM (en este caso, Groq con LLaMA 3) para validar si realmente coniciden con la query
+          (ver `validar_lugares`).
+        - Filtra los resultados y descarta los lugares no válidos.
+
+        Devuelve:
+        --------
+        df_filtrado: pd.DataFrame 
+            Un DataFrame con los lugares validados, conteniendo las columnas:
+            'ID', 'Nombre', 'Dirección', 'Categoría', 'Lat', 'Lng', 'Teléfono', 'Web', 'Validado por'
+            (y 'Búsqueda', el término que encontró cada lugar, si se buscaron varios).
+            En `df_filtrado.attrs["validacion"]` se incluye el resumen de la validación (lugares decididos por cada vía).
+    """
+
+    if not isinstance(query, str):
+        return _buscar_lugares_varias(
+            query, radius, latitude, longitude, modo_validacion, tamano_lote, modo_busqueda, isocrona, usar_categorias
+        )
+
+    df, categorias = _obtener_candidatos(query, radius, latitude, longitude, modo_busqueda, usar_categorias)
+
+    if df.empty:
+        return pd.DataFrame()
+
+    # Validación (categoría, caché, embeddings locales y LLM) de los lugares encontrados
+    return _validar_y_filtrar(df, query, modo_validacion, tamano_lote, isocrona, categorias)
+
+
+def _obtener_candidatos(
+    query: str,
+    radius: int,
+    latitude: float,
+    longitude: float,
+    modo_busqueda: Literal["simple", "teselado"],
+    usar_categorias: bool
+) -> tuple:
+    """
+    Búsqueda de `buscar_lugares` sin la validación: devuelve (DataFrame de lugares encontrados,
+    categorías de Foursquare con las que se filtró la búsqueda).
+    """
+    # Categorías de Foursquare equivalentes a la query (filtro en el servidor)
+    categorias = resolver_categorias_foursquare(query) if usar_categorias else []
+
+    # Petición (o peticiones, en modo teselado) a la API de Foursquare
+    def consultar(categorias):
+        if modo_busqueda == "teselado":
+            return _buscar_foursquare_teselado(query, radius, latitude, longitude, categorias=categorias)
+        return _consultar_foursquare(query, {"ll": f"{latitude},{longitude}", "radius": radius}, categorias)
+
+    resultados = consultar(categorias)
+    if categorias and not resultados:
+        # Si el filtro por categorías no devuelve nada, se repite la búsqueda solo por texto
+        categorias = []
+        resultados = consultar(categorias)
+
+    # Procesamiento de resultados obtenidos de la API
+    return _procesar_resultados_foursquare(resultados), categorias
+
+
+def _consultar_foursquare(query: str, params_area: Dict, categorias: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Realiza una petición de búsqueda a Foursquare y devuelve la lista de resultados en bruto.
+
+    `params_area` define el área de búsqueda: {"ll": "lat,lng", "radius": metros}
+    o un rectángulo {"ne": "lat,lng", "sw": "lat,lng"}. Si se indican `categorias`
+    (IDs de categoría de Foursquare), solo se devuelven lugares de esas categorías.
+    """
+    url = "https://places-api.foursquare.com/places/search"
+    params = {"query": query, "limit": LIMITE_FOURSQUARE, **params_area}
+    if categorias:
+        params["fsq_category_ids"] = ",".join(categorias)
+
+    response = obtener_sesion_http("foursquare").get(url, params=params, timeout=(TIMEOUT_CONEXION, TIMEOUT_LECTURA))
+    return response.json().get("results", [])
+
+
+def _procesar_resultados_foursquare(resultados: List[Dict]) -> pd.DataFrame:
+    """
+    Extrae de los resultados en bruto de Foursquare las columnas que usa la aplicación.
+    """
+    lugares = []
+    for lugar in resultados:
+        lugares.append({
+            "ID": lugar.get("fsq_place_id","No disponible"),
+            "Nombre": lugar.get("name", "No disponible"),
+            "Dirección": lugar.get("location", {}).get("formatted_address", "No disponible"),
+            "Categoría": next((c.get("name") for c in lugar.get("categories", []) if c.get("name")), "No disponible"),
+            "Lat": lugar.get("latitude", "No disponible"),
+            "Lng": lugar.get("longitude", "No disponible"),
+            "Teléfono": lugar.get("tel", "No disponible"),
+            "Web": lugar.get("website", "No disponible")
+        })
+
+    # Sin taxonomía completa, las categorías vistas amplían la aprendida (ver `obtener_taxonomia_foursquare`)
+    _aprender_categorias(resultados)
+
+    df = pd.DataFrame(lugares).replace(['', ' ', None], 'No disponible')
+    df.attrs["categorias"] = {
+        lugar.get("fsq_place_id"): [c.get("fsq_category_id") for c in lugar.get("categories", []) if c.get("fsq_category_id")]
+        for lugar in resultados if lugar.get("fsq_place_id")
+    }
+    return df
+
+
+# Taxonomía de categorías de Foursquare ({"version", "categorias": {ID: [nombres]}}), cargada una vez por proceso
+_taxonomia_foursquare: Dict = {}
+_lock_taxonomia = threading.Lock()
+TTL_TAXONOMIA = 365 * 24 * 3600
+# Sin taxonomía completa, la aprendida de las respuestas cambia a menudo: sus resoluciones caducan antes
+VERSION_TAXONOMIA_APRENDIDA = "aprendida"
+TTL_CATEGORIAS_APRENDIDAS = 24 * 3600
+
+
+def _leer_taxonomia(datos) -> Dict:
+    """
+    Normaliza una taxonomía de Foursquare (fichero o respuesta de la API) a {"version", "categorias"}.
+
+    Admite una lista de categorías o un objeto con la lista en "categorias", "categories" o "results"
+    y, opcionalmente, su "version". Cada categoría aporta su ID ("fsq_category_id", "category_id"
+    o "id"), su nombre ("name" o "category_name") y, si los tiene, nombres alternativos en "nombres"
+    (por ejemplo, la traducción al español), que también se usan al resolver las queries.
+    Sin versión explícita, la versión es una huella del contenido.
+    """
+    lista = datos
+    version = None
+    if isinstance(datos, dict):
+        version = datos.get("version")
+        lista = datos.get("categorias") or datos.get("categories") or datos.get("results") or []
+
+    categorias = {}
+    for categoria in lista:
+        identificador = categoria.get("fsq_category_id") or categoria.get("category_id") or categoria.get("id")
+        nombres = [categoria.get("name") or categoria.get("category_name")] + list(categoria.get("nombres") or [])
+        nombres = [n for n in dict.fromkeys(nombres) if n]
+        if identificador and nombres:
+            categorias[identificador] = nombres
+
+    if not version:
+        version = hashlib.sha256(json.dumps(categorias, sort_keys=True).encode()).hexdigest()[:12]
+    return {"version": str(version), "categorias": categorias}
+
+
+def _descargar_taxonomia() -> Optional[Dict]:
+    """
+    Descarga la taxonomía de `URL_TAXONOMIA_FOURSQUARE` (con la sesión de Foursquare y los nombres
+    en español si el servicio los ofrece). Devuelve None si no hay URL o si la descarga falla.
+    """
+    if not URL_TAXONOMIA_FOURSQUARE:
+        return None
+    try:
+        response = obtener_sesion_http("foursquare").get(
+            URL_TAXONOMIA_FOURSQUARE,
+            headers={"Accept-Language": "es"},
+            timeout=(TIMEOUT_CONEXION, TIMEOUT_LECTURA)
+        )
+        response.raise_for_status()
+        taxonomia = _leer_taxonomia(response.json())
+        return taxonomia if taxonomia["categorias"] else None
+    except (requests.RequestException, ValueError, AttributeError) as e:
+        print(f"Error al descargar la taxonomía de Foursquare: {e}")
+        return None
+
+
+def obtener_taxonomia_foursquare() -> Dict:
+    """
+    Devuelve la taxonomía local de categorías de Foursquare como {"version", "categorias": {ID: [nombres]}}.
+
+    Proceso:
+    --------
+    Se resuelve una sola vez por proceso, por este orden:
+    - El fichero `FICHERO_TAXONOMIA_FOURSQUARE`, si está configurado.
+    - La copia descargada guardada en `cache_foursquare` (clave "taxonomia", válida `TTL_TAXONOMIA`)
+      o, si no la hay, una descarga nueva desde `URL_TAXONOMIA_FOURSQUARE`, que se guarda ahí.
+    - En último término, las categorías aprendidas de las respuestas de búsqueda (ver
+      `_aprender_categorias`), con la versión fija `VERSION_TAXONOMIA_APRENDIDA`.
+
+    La versión identifica la taxonomía en la caché de resoluciones (ver `resolver_categorias_foursquare`).
+    """
+    with _lock_taxonomia:
+        if not _taxonomia_foursquare:
+            taxonomia = None
+            if FICHERO_TAXONOMIA_FOURSQUARE and os.path.exists(FICHERO_TAXONOMIA_FOURSQUARE):
+                try:
+                    with open(FICHERO_TAXONOMIA_FOURSQUARE, encoding="utf-8") as f:
+                        taxonomia = _leer_taxonomia(json.load(f))
+                except (OSError, ValueError, AttributeError) as e:
+                    print(f"Error al leer la taxonomía de Foursquare: {e}")
+
+            if not taxonomia or not taxonomia["categorias"]:
+                taxonomia = cache_foursquare.obtener("taxonomia")
+                if not isinstance(taxonomia, dict) or "version" not in taxonomia:
+                    taxonomia = _descargar_taxonomia()
+                    if taxonomia:
+                        cache_foursquare.guardar("taxonomia", taxonomia, ttl_segundos=TTL_TAXONOMIA)
+
+            if not taxonomia:
+                taxonomia = {
+                    "version": VERSION_TAXONOMIA_APRENDIDA,
+                    "categorias": cache_foursquare.obtener("taxonomia_aprendida") or {}
+                }
+            _taxonomia_foursquare.update(taxonomia)
+
+        return {"version": _taxonomia_foursquare["version"], "categorias": dict(_taxonomia_foursquare["categorias"])}
+
+
+def _aprender_categorias(resultados: List[Dict]):
+    """
+    Añade las categorías nuevas de unos resultados en bruto de Foursquare a la taxonomía aprendida.
+    Solo se usa cuando no hay una taxonomía completa (fichero o descarga): esta no se modifica.
+    """
+    taxonomia = obtener_taxonomia_foursquare()
+    if taxonomia["version"] != VERSION_TAXONOMIA_APRENDIDA:
+        return
+
+    nuevas = {
+        c["fsq_category_id"]: [c["name"]]
+        for lugar in resultados for c in lugar.get("categories", [])
+        if c.get("fsq_category_id") and c.get("name") and c["fsq_category_id"] not in taxonomia["categorias"]
+    }
+    if not nuevas:
+        return
+
+    with _lock_taxonomia:
+        _taxonomia_foursquare["categorias"].update(nuevas)
+        copia = dict(_taxonomia_foursquare["categorias"])
+    cache_foursquare.guardar("taxonomia_aprendida", copia, ttl_segundos=TTL_TAXONOMIA)
+
+
+def resolver_categorias_foursquare(
+    query: str,
+    umbral: float = UMBRAL_CATEGORIA,
+    max_categorias: int = MAX_CATEGORIAS_QUERY
+) -> List[str]:
+    """
+    Traduce la query del usuario a IDs de categoría de Foursquare usando la taxonomía local.
+
+    Parámetros:
+    -----------
+    query : str
+        Texto de búsqueda del usuario.
+
+    umbral : float, opcional
+        Similitud mínima (embeddings) entre la query y el nombre de la categoría.
+
+    max_categorias : int, opcional
+        Número máximo de categorías devueltas. Con más, el filtro dejaría de ser específico.
+
+    Proceso:
+    --------
+    - Coincidencia por palabras: alguno de los nombres de la categoría (normalizado) es la query o la
+      contiene como palabras completas (por ejemplo, "bar" -> "Bar" y "Cocktail Bar").
+    - Si no hay coincidencias, similitud por embeddings (ver `similitud_local`) por encima del umbral.
+      El modelo es multilingüe, así que una query en español encuentra también los nombres en inglés.
+    - El resultado se guarda en `cache_foursquare` por versión de la taxonomía y query: se resuelve
+      una sola vez por versión, y al cambiar de taxonomía las resoluciones anteriores dejan de usarse.
+
+    Devuelve:
+    --------
+    List[str]
+        IDs de categoría, de más a menos parecida. Lista vacía si no hay ninguna clara.
+    """
+    taxonomia = obtener_taxonomia_foursquare()
+    categorias = taxonomia["categorias"]
+    if not categorias:
+        return []
+
+    query_normalizada = _normalizar_texto(query)
+    clave = f"categorias|{taxonomia['version']}|{query_normalizada}"
+    guardadas = cache_foursquare.obtener(clave)
+    if guardadas is not None:
+        return guardadas
+
+    # Un par (ID, nombre) por cada nombre de cada categoría
+    pares = [(identificador, nombre) for identificador, nombres in categorias.items() for nombre in nombres]
+
+    # Coincidencia por palabras completas (las categorías más cortas, las más cercanas a la query, primero)
+    resueltas = list(dict.fromkeys(
+        identificador for identificador, nombre in sorted(pares, key=lambda par: len(_normalizar_texto(par[1])))
+        if f" {query_normalizada} " in f" {_normalizar_texto(nombre)} "
+    ))
+
+    if not resueltas:
+        similitudes = similitud_local(query, [nombre for _, nombre in pares])
+        if similitudes is not None:
+            orden = np.argsort(-similitudes)
+            resueltas = list(dict.fromkeys(pares[k][0] for k in orden if similitudes[k] >= umbral))
+
+    resueltas = resueltas[:max_categorias]
+    ttl = TTL_CATEGORIAS_APRENDIDAS if taxonomia["version"] == VERSION_TAXONOMIA_APRENDIDA else TTL_TAXONOMIA
+    cache_foursquare.guardar(clave, resueltas, ttl_segundos=ttl)
+    return resueltas
+
+
+def _buscar_foursquare_teselado(
+    query: str,
+    radius: int,
+    latitude: float,
+    longitude: float,
+    max_peticiones: int = MAX_PETICIONES_TESELADO,
+    max_profundidad: int = 3,
+    categorias: Optional[List[str]] = None
+) -> List[Dict]:
+    """
+    Cubre el círculo de búsqueda con celdas geohash, consulta las celdas en paralelo y
+    fusiona los resultados, de modo que la cobertura crece con el radio en lugar de quedar
+    limitada a los primeros `LIMITE_FOURSQUARE` lugares (ver `_iterar_foursquare_teselado`).
+
+    Devuelve:
+    --------
+    List[Dict]
+        Resultados en bruto de Foursquare, ordenados por distancia al centro.
+    """
+    lugares = [
+        lugar
+        for grupo in _iterar_foursquare_teselado(
+            query, radius, latitude, longitude, max_peticiones, max_profundidad, categorias=categorias
+        )
+        for lugar in grupo
+    ]
+    return sorted(lugares, key=lambda lugar: _distancia_m(latitude, longitude, lugar["latitude"], lugar["longitude"]))
+
+
+def _iterar_foursquare_teselado(
+    query: str,
+    radius: int,
+    latitude: float,
+    longitude: float,
+    max_peticiones: int = MAX_PETICIONES_TESELADO,
+    max_profundidad: int = 3,
+    usar_cache: bool = True,
+    categorias: Optional[List[str]] = None
+):
+    """
+    Generador de la búsqueda teselada: devuelve, por niveles, los lugares nuevos (ya sin duplicados).
+
+    Proceso:
+    --------
+    - Se elige la precisión geohash de las celdas. Si `cache_foursquare` ya conoce la precisión
+      adecuada para esa query y zona, se usa directamente; si no, se hace una petición de sondeo
+      en el centro. Si el sondeo no se satura (menos resultados que el límite) y cubre todo el radio,
+      no hace falta teselar: sus resultados se guardan en las celdas que cubre y se termina.
+    - Con el sondeo se estima la densidad de lugares y se elige la precisión cuyas celdas
+      contendrían aproximadamente la mitad del límite, sin superar `max_peticiones` celdas.
+    - Las celdas ya guardadas en caché que cubren la zona pedida se devuelven sin consultar a Foursquare.
+    - El resto de celdas se consulta como rectángulos (ne/sw). Las que vuelven saturadas se dividen
+      en cuatro y se consultan de nuevo, hasta `max_profundidad` niveles. Cada celda completa se
+      guarda en caché con todos sus resultados.
+    - Se descartan los lugares fuera del radio y los duplicados (por `fsq_place_id` y por proximidad).
+    - Si se indican `categorias`, todas las peticiones las usan como filtro y las entradas de caché
+      se guardan aparte de las de la búsqueda solo por texto.
+    """
+
+    fusionador = _FusionadorResultados(latitude, longitude, radius)
+    query_normalizada = _normalizar_texto(query)
+    if categorias:
+        query_normalizada += "#" + ",".join(sorted(categorias))
+    clave_precision = f"precision|{query_normalizada}|{_codificar_geohash(latitude, longitude, 4)}"
+    peticiones = 0
+
+    precision = cache_foursquare.obtener(clave_precision) if usar_cache else None
+    if precision is None:
+        radio_sondeo = min(radius, RADIO_MAX_FOURSQUARE)
+        sondeo = _consultar_foursquare(query, {"ll": f"{latitude},{longitude}", "radius": radio_sondeo}, categorias)
+        peticiones += 1
+        yield fusionador.anadir(sondeo)
+
+        if len(sondeo) < LIMITE_FOURSQUARE and radio_sondeo >= radius:
+            # Sin saturar: celdas del tamaño del círculo, guardadas con la cobertura del sondeo
+            if usar_cache:
+                precision = _precision_geohash_para_area(np.pi * radius ** 2, latitude)
+                celdas = _celdas_geohash_circulo(latitude, longitude, radius, precision)
+                cache_foursquare.guardar(clave_precision, precision)
+                cache_foursquare.guardar_varios({
+                    _clave_celda(query_normalizada, celda): {
+                        "resultados": [lugar for lugar in sondeo if _en_caja(lugar, _caja_geohash(celda))],
+                        "cobertura": [latitude, longitude, radius]
+                    }
+                    for celda in celdas
+                })
+            return
+
+        # Estimación de la densidad de lugares (lugares/m²) a partir del sondeo
+        distancias = [
+            _distancia_m(latitude, longitude, lugar["latitude"], lugar["longitude"])
+            for lugar in sondeo if "latitude" in lugar and "longitude" in lugar
+        ]
+        if len(sondeo) >= LIMITE_FOURSQUARE and distancias:
+            radio_saturado = max(max(distancias), 100.0)
+            densidad = len(sondeo) / (np.pi * radio_saturado ** 2)
+        else:
+            densidad = max(len(sondeo), 1) / (np.pi * radio_sondeo ** 2)
+
+        area_objetivo = (LIMITE_FOURSQUARE / 2) / densidad
+        precision = _precision_geohash_para_area(area_objetivo, latitude)
+        if usar_cache:
+            cache_foursquare.guardar(clave_precision, precision)
+
+    celdas = _celdas_geohash_circulo(latitude, longitude, radius, precision)
+    while len(celdas) > max_peticiones and precision > 1:
+        precision -= 1
+        celdas = _celdas_geohash_circulo(latitude, longitude, radius, precision)
+
+    # Celdas reutilizables desde la caché: solo se consulta a Foursquare la zona no cubierta
+    if usar_cache:
+        en_cache = cache_foursquare.obtener_varios([_clave_celda(query_normalizada, celda) for celda in celdas])
+        reutilizadas = [
+            celda for celda in celdas
+            if _celda_cubre_busqueda(en_cache.get(_clave_celda(query_normalizada, celda)), celda, latitude, longitude, radius)
+        ]
+        yield fusionador.anadir([
+            lugar for celda in reutilizadas for lugar in en_cache[_clave_celda(query_normalizada, celda)]["resultados"]
+        ])
+        reutilizadas = set(reutilizadas)
+        celdas = [celda for celda in celdas if celda not in reutilizadas]
+
+    # Cada caja se consulta junto con la celda geohash de la que procede
+    cajas = [(_caja_geohash(celda), celda) for celda in celdas]
+    contenido = {celda: [] for celda in celdas}
+    incompletas = set()
+
+    # Consulta por niveles: las celdas saturadas se dividen en cuatro para el nivel siguiente
+    with ThreadPoolExecutor(max_workers=8, thread_name_prefix="foursquare") as pool:
+        for profundidad in range(max_profundidad + 1):
+            restantes = max(0, max_peticiones - peticiones)
+            incompletas.update(celda for _, celda in cajas[restantes:])
+            cajas = cajas[:restantes]
+            if not cajas:
+                break
+
+            respuestas = list(pool.map(lambda caja: _consultar_caja_foursquare(query, caja[0], categorias), cajas))
+            peticiones += len(cajas)
+
+            siguientes = []
+            nuevos = []
+            for (caja, celda), resultados in zip(cajas, respuestas):
+                if resultados is None:  # petición fallida: la celda no se guarda en caché
+                    incompletas.add(celda)
+                    continue
+                contenido[celda].extend(resultados)
+                nuevos.extend(fusionador.anadir(resultados))
+                if len(resultados) >= LIMITE_FOURSQUARE:
+                    if profundidad < max_profundidad:
+                        siguientes.extend((subcaja, celda) for subcaja in _dividir_caja(caja))
+                    else:
+                        incompletas.add(celda)
+            cajas = siguientes
+            yield nuevos
+
+    if usar_cache:
+        cache_foursquare.guardar_varios({
+            _clave_celda(query_normalizada, celda): {"resultados": resultados, "cobertura": None}
+            for celda, resultados in contenido.items() if celda not in incompletas
+        })
+
+
+def _consultar_caja_foursquare(query: str, caja: tuple, categorias: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Consulta un rectángulo (lat_min, lat_max, lng_min, lng_max) y devuelve solo los lugares dentro de él.
+    Si la petición falla, devuelve None para no interrumpir el resto de celdas.
+    """
+    lat_min, lat_max, lng_min, lng_max = caja
+    try:
+        resultados = _consultar_foursquare(query, {"ne": f"{lat_max},{lng_max}", "sw": f"{lat_min},{lng_min}"}, categorias)
+    except Exception as e:
+        print(f"Error al consultar la celda {caja} en Foursquare:", e)
+        return None
+
+    return [lugar for lugar in resultados if _en_caja(lugar, caja)]
+
+
+def _clave_celda(query_normalizada: str, celda: str) -> str:
+    return f"celda|{query_normalizada}|{celda}"
+
+
+def _en_caja(lugar: Dict, caja: tuple) -> bool:
+    lat_min, lat_max, lng_min, lng_max = caja
+    return (
+        lat_min <= lugar.get("latitude", np.nan) <= lat_max
+        and lng_min <= lugar.get("longitude", np.nan) <= lng_max
+    )
+
+
+def _celda_cubre_busqueda(entrada: Optional[Dict], celda: str, latitude: float, longitude: float, radius: float) -> bool:
+    """
+    Indica si una entrada de caché de una celda sirve para la búsqueda actual: o bien la celda se
+    consultó completa, o bien la zona que cubrió (círculo del sondeo) contiene la parte de la celda
+    que se necesita ahora (el círculo actual completo o la celda completa).
+    """
+    if entrada is None:
+        return False
+    if entrada.get("cobertura") is None:
+        return True
+
+    lat_c, lng_c, radio_c = entrada["cobertura"]
+    if _distancia_m(lat_c, lng_c, latitude, longitude) + radius <= radio_c:
+        return True
+
+    lat_min, lat_max, lng_min, lng_max = _caja_geohash(celda)
+    esquinas_lat = np.array([lat_min, lat_min, lat_max, lat_max])
+    esquinas_lng = np.array([lng_min, lng_max, lng_min, lng_max])
+    return bool(np.all(_distancia_m(lat_c, lng_c, esquinas_lat, esquinas_lng) <= radio_c))
+
+
+def _iterar_foursquare_paginado(
+    query: str,
+    radius: int,
+    latitude: float,
+    longitude: float,
+    categorias: Optional[List[str]] = None
+):
+    """
+    Generador que sigue el cursor de paginación de Foursquare (cabecera `Link` con rel="next")
+    y devuelve los lugares nuevos de cada página, sin duplicados y dentro del radio.
+    """
+    fusionador = _FusionadorResultados(latitude, longitude, radius)
+    sesion = obtener_sesion_http("foursquare")
+
+    url = "https://places-api.foursquare.com/places/search"
+    params = {"query": query, "ll": f"{latitude},{longitude}", "radius": radius, "limit": LIMITE_FOURSQUARE}
+    if categorias:
+        params["fsq_category_ids"] = ",".join(categorias)
+
+    while url:
+        response = sesion.get(url, params=params, timeout=(TIMEOUT_CONEXION, TIMEOUT_LECTURA))
+        resultados = response.json().get("results", [])
+        yield fusionador.anadir(resultados)
+
+        # La URL de la página siguiente ya incluye todos los parámetros y el cursor
+        url = response.links.get("next", {}).get("url") if resultados else None
+        params = None
+
+
+def _iterar_en_segundo_plano(iterador, margen: int = 2):
+    """
+    Consume `iterador` en un hilo aparte, manteniendo hasta `margen` elementos adelantados, para que
+    la descarga de la página siguiente se solape con el procesado de la actual.
+    Las excepciones del iterador se relanzan en el consumidor.
+    """
+    for _, elemento in _intercalar_en_segundo_plano([iterador], margen):
+        yield elemento
+
+
+def _intercalar_en_segundo_plano(iteradores: List, margen: int = 2, agrupar: bool = False):
+    """
+    Consume varios iteradores a la vez, cada uno en su propio hilo, y devuelve sus elementos según
+    van llegando como tuplas (índice del iterador, elemento). La cola compartida admite hasta
+    `margen` elementos adelantados por iterador. Las excepciones se relanzan en el consumidor.
+
+    Con `agrupar=True` devuelve listas de tuplas: el primer elemento que llega junto con todos los
+    que ya esperaban en la cola, para procesarlos de una vez.
+    """
+    cola = queue.Queue(maxsize=margen * max(1, len(iteradores)))
+    parar = threading.Event()
+    fin = object()
+
+    def poner(elemento):
+        while not parar.is_set():
+            try:
+                cola.put(elemento, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def productor(indice, iterador):
+        try:
+            for elemento in iterador:
+                if not poner((indice, elemento)):
+                    return
+        except Exception as e:
+            poner((indice, e))
+        poner((indice, fin))
+
+    for indice, iterador in enumerate(iteradores):
+        threading.Thread(target=productor, args=(indice, iterador), daemon=True, name="foursquare-productor").start()
+
+    try:
+        pendientes = len(iteradores)
+        while pendientes:
+            recibidos = [cola.get()]
+            while agrupar:
+                try:
+                    recibidos.append(cola.get_nowait())
+                except queue.Empty:
+                    break
+
+            grupo = []
+            for indice, elemento in recibidos:
+                if elemento is fin:
+                    pendientes -= 1
+                    continue
+                if isinstance(elemento, Exception):
+                    raise elemento
+                grupo.append((indice, elemento))
+
+            if not agrupar:
+                yield from grupo
+            elif grupo:
+                yield grupo
+    finally:
+        parar.set()
+
+
+def buscar_lugares_por_lotes(
+    query: Union[str, List[str]],
+    radius: int,
+    latitude: float,
+    longitude: float,
+    max_resultados: Optional[int] = None,
+    plazo_segundos: Optional[float] = None,
+    modo_busqueda: Literal["paginado", "teselado"] = "paginado",
+    modo_validacion: Literal["lote", "individual"] = "lote",
+    tamano_lote: int = TAMANO_LOTE_VALIDACION,
+    isocrona: Optional[List] = None,
+    usar_categorias: bool = True
+):
+    """
+    Versión incremental de `buscar_lugares`: generador que devuelve los lugares validados por lotes
+    a medida que están listos, en lugar de esperar a tener todos los resultados.
+
+    Parámetros:
+    -----------
+    query, radius, latitude, longitude :
+        Igual que en `buscar_lugares`.
+
+    max_resultados : int, opcional
+        Número máximo de lugares validados a devolver. Al alcanzarlo se detiene la búsqueda.
+
+    plazo_segundos : float, opcional
+        Tiempo máximo de búsqueda. Una vez agotado no se piden ni se validan más páginas.
+
+    modo_busqueda : {"paginado", "teselado"}
+        - "paginado" : sigue el cursor de paginación de Foursquare más allá de los primeros 50 resultados.
+        - "teselado" : búsqueda por celdas geohash (ver `_iterar_foursquare_teselado`), un lote por nivel.
+
+    modo_validacion, tamano_lote, isocrona, usar_categorias :
+        Igual que en `buscar_lugares`.
+
+    Proceso:
+    --------
+    - Con varios términos de búsqueda, las páginas de cada uno se descargan en su propio hilo y las que
+      llegan a la vez se validan juntas; los lotes llevan la columna 'Búsqueda' y no repiten los lugares
+      ya devueltos por otro término.
+    - La descarga de la página (o nivel) siguiente se hace en segundo plano mientras se valida la actual.
+    - Cada lote se valida con `validar_lugares` y se devuelve en cuanto termina.
+
+    Devuelve (yield):
+    --------
+    pd.DataFrame
+        Lotes no vacíos de lugares validados, con las mismas columnas que `buscar_lugares`.
+    """
+
+    if not isinstance(query, str):
+        yield from _buscar_lugares_varias_por_lotes(
+            query, radius, latitude, longitude, max_resultados, plazo_segundos,
+            modo_busqueda, modo_validacion, tamano_lote, isocrona, usar_categorias
+        )
+        return
+
+    inicio = time.monotonic()
+    devueltos = 0
+
+    categorias = resolver_categorias_foursquare(query) if usar_categorias else []
+    paginas = _iterar_paginas_foursquare(query, radius, latitude, longitude, modo_busqueda, categorias)
+
+    for resultados in _iterar_en_segundo_plano(paginas):
+        df = _procesar_resultados_foursquare(resultados)
+        if not df.empty:
+            df_filtrado = _validar_y_filtrar(df, query, modo_validacion, tamano_lote, isocrona, categorias)
+
+            if max_resultados is not None:
+                df_filtrado = df_filtrado.head(max_resultados - devueltos)
+            if not df_filtrado.empty:
+                devueltos += len(df_filtrado)
+                yield df_filtrado
+
+        if max_resultados is not None and devueltos >= max_resultados:
+            return
+        if plazo_segundos is not None and time.monotonic() - inicio >= plazo_segundos:
+            return
+
+
+def _iterar_paginas_foursquare(
+    query: str,
+    radius: int,
+    latitude: float,
+    longitude: float,
+    modo_busqueda: Literal["paginado", "teselado"],
+    categorias: List[str]
+):
+    """
+    Iterador de páginas (o niveles, en modo teselado) de resultados en bruto de Foursquare.
+    """
+    if modo_busqueda == "teselado":
+        return _iterar_foursquare_teselado(query, radius, latitude, longitude, categorias=categorias)
+    return _iterar_foursquare_paginado(query, radius, latitude, longitude, categorias)
+
+
+def _buscar_lugares_varias(
+    queries: List[str],
+    radius: int,
+    latitude: float,
+    longitude: float,
+    modo_validacion: Literal["lote", "individual"],
+    tamano_lote: int,
+    modo_busqueda: Literal["simple", "teselado"],
+    isocrona: Optional[List],
+    usar_categorias: bool
+) -> pd.DataFrame:
+    """
+    `buscar_lugares` con varios términos: cada término se busca en un hilo, los candidatos de todos
+    (cada uno con su término en la columna 'Búsqueda') se validan en una única pasada, de modo que
+    comparten las peticiones agrupadas al LLM, y los válidos se fusionan en un único DataFrame.
+
+    Un lugar encontrado por varios términos (mismo ID, o mismo nombre a menos de 30 m) se queda con
+    el primero de la lista para el que es válido.
+    """
+    queries = _limpiar_queries(queries)
+    if not queries:
+        return pd.DataFrame()
+
+    with ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="busquedas") as pool:
+        candidatos = list(pool.map(
+            lambda q: _obtener_candidatos(q, radius, latitude, longitude, modo_busqueda, usar_categorias),
+            queries
+        ))
+
+    df = _unir_candidatos([(q, df) for q, (df, _) in zip(queries, candidatos)])
+    if df.empty:
+        return pd.DataFrame()
+
+    categorias = {q: categorias_q for q, (_, categorias_q) in zip(queries, candidatos)}
+    df_validado = _validar_y_filtrar(df, df["Búsqueda"], modo_validacion, tamano_lote, isocrona, categorias)
+
+    fusionador = _FusionadorResultados(latitude, longitude, float("inf"))
+    df_final = _ordenar_busqueda_al_final(_descartar_ya_encontrados(df_validado, fusionador).reset_index(drop=True))
+    if df_final.empty:
+        return pd.DataFrame()
+
+    df_final.attrs = {"validacion": {
+        **df_validado.attrs["validacion"],
+        "por_busqueda": df_final["Búsqueda"].value_counts().reindex(queries, fill_value=0).to_dict()
+    }}
+    return df_final
+
+
+def _buscar_lugares_varias_por_lotes(
+    queries: List[str],
+    radius: int,
+    latitude: float,
+    longitude: float,
+    max_resultados: Optional[int],
+    plazo_segundos: Optional[float],
+    modo_busqueda: Literal["paginado", "teselado"],
+    modo_validacion: Literal["lote", "individual"],
+    tamano_lote: int,
+    isocrona: Optional[List],
+    usar_categorias: bool
+):
+    """
+    `buscar_lugares_por_lotes` con varios términos: las páginas de cada término se descargan en paralelo
+    y las que llegan a la vez se validan juntas (en las mismas peticiones agrupadas al LLM). Los lotes se
+    devuelven con la columna 'Búsqueda' y sin duplicados entre términos. El máximo de resultados y el
+    plazo se aplican al conjunto de la búsqueda.
+    """
+    queries = _limpiar_queries(queries)
+    if not queries:
+        return
+    inicio = time.monotonic()
+    devueltos = 0
+
+    with ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="busquedas") as pool:
+        categorias = dict(zip(queries, pool.map(
+            lambda q: resolver_categorias_foursquare(q) if usar_categorias else [], queries
+        )))
+
+    paginas = [
+        _iterar_paginas_foursquare(q, radius, latitude, longitude, modo_busqueda, categorias[q])
+        for q in queries
+    ]
+
+    fusionador = _FusionadorResultados(latitude, longitude, float("inf"))
+    for grupo in _intercalar_en_segundo_plano(paginas, margen=1, agrupar=True):
+        df = _unir_candidatos([
+            (queries[indice], _procesar_resultados_foursquare(resultados))
+            for indice, resultados in sorted(grupo, key=lambda elemento: elemento[0])
+        ])
+        if not df.empty:
+            df_validado = _validar_y_filtrar(df, df["Búsqueda"], modo_validacion, tamano_lote, isocrona, categorias)
+            df_nuevo = _ordenar_busqueda_al_final(_descartar_ya_encontrados(df_validado, fusionador))
+
+            if max_resultados is not None:
+                df_nuevo = df_nuevo.head(max_resultados - devueltos)
+            if not df_nuevo.empty:
+                devueltos += len(df_nuevo)
+                yield df_nuevo.reset_index(drop=True)
+
+        if max_resultados is not None and devueltos >= max_resultados:
+            return
+        if plazo_segundos is not None and time.monotonic() - inicio >= plazo_segundos:
+            return
+
+
+def _unir_candidatos(partes: List[tuple]) -> pd.DataFrame:
+    """
+    Une los lugares encontrados por varios términos [(término, DataFrame), ...] en un único DataFrame
+    con la columna 'Búsqueda', conservando las categorías de Foursquare de cada lugar (`attrs["categorias"]`).
+    """
+    partes = [(q, df) for q, df in partes if not df.empty]
+    if not partes:
+        return pd.DataFrame()
+
+    categorias = {}
+    for _, df in partes:
+        categorias.update(df.attrs.get("categorias", {}))
+    df = pd.concat([df.assign(**{"Búsqueda": q}) for q, df in partes], ignore_index=True)
+    df.attrs = {"categorias": categorias}
+    return df
+
+
+def _ordenar_busqueda_al_final(df: pd.DataFrame) -> pd.DataFrame:
+    # La columna 'Búsqueda' va detrás de 'Validado por', como en los resultados de un único término
+    return df[[c for c in df.columns if c != "Búsqueda"] + ["Búsqueda"]]
+
+
+def _limpiar_queries(queries: List[str]) -> List[str]:
+    """
+    Quita los términos vacíos y los repetidos (tras normalizarlos), conservando el orden.
+    """
+    vistas, limpias = set(), []
+    for q in queries:
+        if q and q.strip() and _normalizar_texto(q) not in vistas:
+            vistas.add(_normalizar_texto(q))
+            limpias.append(q.strip())
+    return limpias
+
+
+def _descartar_ya_encontrados(df: pd.DataFrame, fusionador: "_FusionadorResultados") -> pd.DataFrame:
+    """
+    Devuelve las filas de `df` que no estaban ya en `fusionador` (mismo ID de Foursquare o mismo nombre
+    muy cerca) y las añade a él, conservando el orden original.
+    """
+    lugares = [
+        {
+            "fsq_place_id": fila["ID"] if fila["ID"] != "No disponible" else None,
+            "name": fila["Nombre"],
+            "latitude": fila["Lat"],
+            "longitude": fila["Lng"],
+            "fila": indice
+        }
+        for indice, fila in df.iterrows()
+        if isinstance(fila["Lat"], (int, float)) and isinstance(fila["Lng"], (int, float))
+    ]
+    nuevos = {lugar["fila"] for lugar in fusionador.anadir(lugares)}
+    return df.loc[[i for i in df.index if i in nuevos]]
+
+
+def _validar_y_filtrar(
+    df: pd.DataFrame,
+    query: Union[str, pd.Series],
+    modo_validacion: Literal["lote", "individual"],
+    tamano_lote: int,
+    isocrona: Optional[List] = None,
+    categorias: Optional[Union[List[str], Dict[str, List[str]]]] = None
+) -> pd.DataFrame:
+    """
+    Valida los lugares de `df` y devuelve solo los confirmados, con la columna 'Validado por'.
+
+    Los veredictos se guardan por (query, ID de Foursquare) junto a las respuestas en bruto en
+    `cache_foursquare`, de modo que los lugares servidos desde la caché no se vuelven a validar.
+    Si se indica una isócrona, los lugares fuera de ella se descartan antes de validar nada.
+    Los lugares de alguna de las `categorias` resueltas para la query se aceptan sin validar.
+
+    Para validar juntos los lugares de varias búsquedas, `query` puede ser una serie con el término de
+    cada lugar (alineada con `df`) y `categorias` un diccionario {término: categorías}.
+    """
+    fuera_de_alcance = 0
+    if isocrona is not None:
+        alcanzables = dentro_de_isocrona(df["Lng"].to_numpy(dtype=float), df["Lat"].to_numpy(dtype=float), isocrona)
+        fuera_de_alcance = int((~alcanzables).sum())
+        df = df[alcanzables]
+
+    # Término de búsqueda de cada lugar y categorías resueltas para cada término
+    consultas = query.loc[df.index] if isinstance(query, pd.Series) else pd.Series(query, index=df.index, dtype=object)
+    if not isinstance(categorias, dict):
+        categorias = {consulta: categorias or [] for consulta in set(consultas)}
+    categorias = {consulta: set(ids) for consulta, ids in categorias.items()}
+
+    # Lugares cuya categoría de Foursquare es una de las resueltas para su query
+    categorias_lugar = df.attrs.get("categorias", {})
+    por_categoria = [
+        i for i in df.index
+        if categorias.get(consultas[i], set()).intersection(categorias_lugar.get(df.at[i, "ID"], []))
+    ]
+    por_categoria_set = set(por_categoria)
+
+    normalizadas = {consulta: _normalizar_texto(consulta) for consulta in set(consultas)}
+    claves = {
+        i: f"veredicto|{normalizadas[consultas[i]]}|{df.at[i, 'ID']}"
+        for i in df.index if df.at[i, "ID"] != "No disponible" and i not in por_categoria_set
+    }
+    en_cache = cache_foursquare.obtener_varios(list(claves.values()))
+    conocidos = [i for i in df.index if claves.get(i) in en_cache]
+    nuevos = [i for i in df.index if claves.get(i) not in en_cache and i not in por_categoria_set]
+
+    validacion = validar_lugares(
+        df.loc[nuevos],
+        query if isinstance(query, str) else consultas.loc[nuevos],
+        modo=modo_validacion,
+        tamano_lote=tamano_lote
+    )
+    # Los descartes por error o plazo agotado del LLM ("error_llm") no son veredictos: no se guardan
+    cache_foursquare.guardar_varios({
+        claves[i]: bool(validacion.at[i, "Válido"])
+        for i in nuevos if i in claves and validacion.at[i, "Validado por"] != "error_llm"
+    })
+
+    # Los lugares con veredicto guardado se añaden como validados por la caché
+    resumen = validacion.attrs["validacion"]
+    for indice in conocidos:
+        validacion.loc[indice] = [bool(en_cache[claves[indice]]), "caché", np.nan]
+    for indice in por_categoria:
+        validacion.loc[indice] = [True, "categoría", np.nan]
+    validacion = validacion.loc[df.index]
+    validacion["Válido"] = validacion["Válido"].astype(bool)
+    if conocidos:
+        resumen["por_origen"]["caché"] = resumen["por_origen"].get("caché", 0) + len(conocidos)
+    if por_categoria:
+        resumen["por_origen"]["categoría"] = len(por_categoria)
+    if isocrona is not None:
+        resumen["fuera_de_alcance"] = fuera_de_alcance
+    validacion.attrs["validacion"] = resumen
+
+    df = df.assign(**{"Validado por": validacion["Validado por"]})
+
+    # Crear DataFrame final con los lugares confirmados
+    df_filtrado = df[validacion["Válido"]].reset_index(drop=True)
+    df_filtrado.attrs.pop("categorias", None)
+    df_filtrado.attrs["validacion"] = validacion.attrs["validacion"]
+    return df_filtrado
+
+
+def obtener_isocrona(
+    punto: List[float],
+    profile: Literal["driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"],
+    tiempo_s: float,
+    usar_cache: bool = True
+) -> Optional[List]:
+    """
+    Obtiene de ORS la isócrona (zona alcanzable en `tiempo_s` segundos) desde un punto con un perfil de transporte.
+
+    Parámetros:
+    -----------
+    punto : list [lng, lat]
+        Punto de salida (normalmente el inicio de la ruta).
+
+    profile : str
+        Perfil de transporte de ORS.
+
+    tiempo_s : float
+        Tiempo máximo de viaje en segundos.
+
+    usar_cache : bool, opcional
+        Si es True (por defecto), reutiliza la isócrona guardada en `cache_isocronas` para el mismo
+        (punto, perfil, tiempo).
+
+    Devuelve:
+    --------
+    list o None
+        Lista de polígonos, cada uno como lista de anillos [[lng, lat], ...] (el primero es el exterior
+        y el resto huecos), o None si no se pudo obtener.
+    """
+    clave = f"{profile}|{punto[0]:.5f},{punto[1]:.5f}|{int(tiempo_s)}"
+    if usar_cache:
+        guardada = cache_isocronas.obtener(clave)
+        if guardada is not None:
+            return guardada
+
+    try:
+        respuesta = obtener_cliente_ors().isochrones(
+            locations=[list(punto)],
+            profile=profile,
+            range_type="time",
+            range=[int(tiempo_s)]
+        )
+    except Exception as e:
+        print(f"Error al obtener la isócrona: {e}")
+        return None
+
+    poligonos = []
+    for feature in respuesta.get("features", []):
+        geometria = feature.get("geometry", {})
+        if geometria.get("type") == "Polygon":
+            poligonos.append(geometria["coordinates"])
+        elif geometria.get("type") == "MultiPolygon":
+            poligonos.extend(geometria["coordinates"])
+
+    if usar_cache and poligonos:
+        cache_isocronas.guardar(clave, poligonos)
+    return poligonos
+
+
+def dentro_de_isocrona(lng: np.ndarray, lat: np.ndarray, poligonos: List) -> np.ndarray:
+    """
+    Indica qué puntos caen dentro de alguno de los polígonos (regla par-impar, con huecos),
+    evaluando todos los puntos a la vez con NumPy.
+
+    Devuelve:
+    --------
+    np.ndarray de bool
+        Una posición por punto.
+    """
+    lng, lat = np.asarray(lng, dtype=float), np.asarray(lat, dtype=float)
+    dentro = np.zeros(len(lng), dtype=bool)
+
+    for anillos in poligonos:
+        exterior = np.asarray(anillos[0], dtype=float)
+        # Descarte rápido por la caja que envuelve el polígono
+        candidatos = (
+            (lng >= exterior[:, 0].min()) & (lng <= exterior[:, 0].max()) &
+            (lat >= exterior[:, 1].min()) & (lat <= exterior[:, 1].max()) & ~dentro
+        )
+        if not candidatos.any():
+            continue
+
+        x, y = lng[candidatos][:, None], lat[candidatos][:, None]
+        cruces = np.zeros(len(x), dtype=int)
+        for anillo in anillos:
+            anillo = np.asarray(anillo, dtype=float)
+            xi, yi = anillo[:-1, 0][None, :], anillo[:-1, 1][None, :]
+            xj, yj = anillo[1:, 0][None, :], anillo[1:, 1][None, :]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                corta = ((yi > y) != (yj > y)) & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+            cruces += corta.sum(axis=1)
+
+        dentro[np.flatnonzero(candidatos)] = cruces % 2 == 1
+
+    return dentro
+
+
+class _FusionadorResultados:
+    """
+    Fusiona incrementalmente resultados de Foursquare: descarta los que quedan fuera del radio y
+    los duplicados por `fsq_place_id` o por proximidad (mismo nombre a menos de `distancia_duplicado` m)
+    respecto a todo lo añadido anteriormente.
+    """
+
+    def __init__(self, latitude: float, longitude: float, radius: float, distancia_duplicado: float = 30.0):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius
+        self.distancia_duplicado = distancia_duplicado
+        self._vistos_id = set()
+        self._rejilla = {}
+        self._paso = distancia_duplicado / 111320
+
+    def anadir(self, resultados: List[Dict]) -> List[Dict]:
+        """
+        Añade un grupo de resultados y devuelve solo los nuevos, ordenados por distancia al centro.
+        """
+        candidatos = []
+        for lugar in resultados:
+            id_lugar = lugar.get("fsq_place_id")
+            if id_lugar and id_lugar in self._vistos_id:
+                continue
+            if id_lugar:
+                self._vistos_id.add(id_lugar)
+            if "latitude" not in lugar or "longitude" not in lugar:
+                continue
+            distancia = _distancia_m(self.latitude, self.longitude, lugar["latitude"], lugar["longitude"])
+            if distancia <= self.radius:
+                candidatos.append((distancia, lugar))
+
+        candidatos.sort(key=lambda x: x[0])
+
+        # Duplicados por proximidad: rejilla de celdas de `distancia_duplicado` metros por nombre normalizado
+        nuevos = []
+        for _, lugar in candidatos:
+            nombre = _normalizar_texto(lugar.get("name", ""))
+            fila, columna = int(lugar["latitude"] // self._paso), int(lugar["longitude"] // self._paso)
+            vecinos = (
+                self._rejilla.get((nombre, fila + d_fila, columna + d_columna), [])
+                for d_fila in (-1, 0, 1) for d_columna in (-1, 0, 1)
+            )
+            if any(
+                _distancia_m(lugar["latitude"], lugar["longitude"], otro["latitude"], otro["longitude"]) <= self.distancia_duplicado
+                for grupo in vecinos for otro in grupo
+            ):
+                continue
+            self._rejilla.setdefault((nombre, fila, columna), []).append(lugar)
+            nuevos.append(lugar)
+
+        return nuevos
+
+
+def _distancia_m(lat1, lng1, lat2, lng2):
+    """
+    Distancia de haversine en metros. Acepta escalares o arrays de NumPy.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * np.arcsin(np.sqrt(a))
+
+
+_BASE32_GEOHASH = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def _codificar_geohash(lat: float, lng: float, precision: int) -> str:
+    """
+    Codifica unas coordenadas como geohash de `precision` caracteres.
+    """
+    lat_int, lng_int = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, valor, es_lng = [], 0, 0, True
+    while len(geohash) < precision:
+        intervalo, coordenada = (lng_int, lng) if es_lng else (lat_int, lat)
+        medio = (intervalo[0] + intervalo[1]) / 2
+        if coordenada >= medio:
+            valor = (valor << 1) | 1
+            intervalo[0] = medio
+        else:
+            valor <<= 1
+            intervalo[1] = medio
+        es_lng = not es_lng
+        bits += 1
+        if bits == 5:
+            geohash.append(_BASE32_GEOHASH[valor])
+            bits, valor = 0, 0
+    return "".join(geohash)
+
+
+def _caja_geohash(geohash: str) -> tuple:
+    """
+    Devuelve el rectángulo (lat_min, lat_max, lng_min, lng_max) de una celda geohash.
+    """
+    lat_int, lng_int = [-90.0, 90.0], [-180.0, 180.0]
+    es_lng = True
+    for caracter in geohash:
+        valor = _BASE32_GEOHASH.index(caracter)
+        for desplazamiento in range(4, -1, -1):
+            intervalo = lng_int if es_lng else lat_int
+            medio = (intervalo[0] + intervalo[1]) / 2
+            if (valor >> desplazamiento) & 1:
+                intervalo[0] = medio
+            else:
+                intervalo[1] = medio
+            es_lng = not es_lng
+    return lat_int[0], lat_int[1], lng_int[0], lng_int[1]
+
+
+def _tamano_celda_geohash(precision: int) -> tuple:
+    """
+    Tamaño (alto, ancho) en grados de una celda geohash de la precisión indicada.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _precision_geohash_para_area(area_m2: float, latitud: float) -> int:
+    """
+    Mayor precisión geohash (celdas más pequeñas) cuyas celdas tienen al menos `area_m2` metros cuadrados.
+    """
+    for precision in range(9, 0, -1):
+        alto, ancho = _tamano_celda_geohash(precision)
+        area = (alto * 111320) * (ancho * 111320 * np.cos(np.radians(latitud)))
+        if area >= area_m2:
+            return precision
+    return 1
+
+
+def _celdas_geohash_circulo(lat: float, lng: float, radio_m: float, precision: int) -> List[str]:
+    """
+    Devuelve las celdas geohash de la precisión indicada que intersectan el círculo de centro (lat, lng) y radio `radio_m`.
+    """
+    alto, ancho = _tamano_celda_geohash(precision)
+    d_lat = radio_m / 111320
+    d_lng = radio_m / (111320 * max(np.cos(np.radians(lat)), 1e-6))
+
+    celdas = []
+    vistas = set()
+    for lat_celda in np.arange(lat - d_lat, lat + d_lat + alto, alto):
+        for lng_celda in np.arange(lng - d_lng, lng + d_lng + ancho, ancho):
+            lat_c = float(np.clip(lat_celda, -90, 90))
+            geohash = _codificar_geohash(lat_c, float((lng_celda + 180) % 360 - 180), precision)
+            if geohash in vistas:
+                continue
+            vistas.add(geohash)
+
+            # Punto de la celda más cercano al centro
+            lat_min, lat_max, lng_min, lng_max = _caja_geohash(geohash)
+            cercano_lat = min(max(lat, lat_min), lat_max)
+            cercano_lng = min(max(lng, lng_min), lng_max)
+            if _distancia_m(lat, lng, cercano_lat, cercano_lng) <= radio_m:
+                celdas.append(geohash)
+    return celdas
+
+
+def _dividir_caja(caja: tuple) -> List[tuple]:
+    """
+    Divide un rectángulo (lat_min, lat_max, lng_min, lng_max) en sus cuatro cuadrantes.
+    """
+    lat_min, lat_max, lng_min, lng_max = caja
+    lat_medio, lng_medio = (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+    return [
+        (lat_min, lat_medio, lng_min, lng_medio),
+        (lat_min, lat_medio, lng_medio, lng_max),
+        (lat_medio, lat_max, lng_min, lng_medio),
+        (lat_medio, lat_max, lng_medio, lng_max)
+    ]
+
+
+def validar_lugares(
+    df: pd.DataFrame,
+    query: Union[str, pd.Series],
+    modo: Literal["lote", "individual"] = "lote",
+    tamano_lote: int = TAMANO_LOTE_VALIDACION,
+    groq_client: Optional[Groq] = None,
+    ejecutor: Optional[EjecutorLLM] = None,
+    usar_cache: bool = True,
+    cache_por_nombre: bool = False,
+    validacion_local: bool = True,
+    umbral_aceptar: float = UMBRAL_LOCAL_ACEPTAR,
+    umbral_rechazar: float = UMBRAL_LOCAL_RECHAZAR,
+    muestra_auditoria: float = 0.0
+) -> pd.DataFrame:
+    """
+    Valida si cada lugar del DataFrame corresponde realmente al tipo buscado, combinando
+    una caché de veredictos, un clasificador local por embeddings y un modelo LLM.
+
+    Parámetros:
+    -----------
+    df : pd.DataFrame
+        DataFrame con al menos las columnas 'Nombre' y 'Categoría'.
+
+    query : str o pd.Series
+        Tipo de lugar buscado por el usuario. Con una serie (alineada con el índice de `df`) cada lugar
+        se valida contra su propio término, de modo que los lugares de varias búsquedas se validan
+        juntos en las mismas peticiones agrupadas.
+
+    modo : {"lote", "individual"}
+        - "lote"       : envía los lugares en trozos de `tamano_lote` y pide un veredicto JSON por ID,
+                         de modo que el número de peticiones depende del número de trozos y no de lugares.
+        - "individual" : una petición por lugar (comportamiento original).
+
+    tamano_lote : int
+        Número máximo de lugares por petición en el modo "lote".
+
+    groq_client : Groq, opcional
+        Cliente Groq a usar. Por defecto, el cliente compartido (`obtener_cliente_groq`).
+
+    ejecutor : EjecutorLLM, opcional
+        Ejecutor con el que se lanzan en paralelo las peticiones al LLM. Por defecto, `ejecutor_llm`.
+
+    usar_cache : bool
+        Si es True, consulta primero la caché persistente de veredictos (`cache_veredictos`)
+        y solo envía al LLM los lugares que no están en ella.
+
+    cache_por_nombre : bool
+        Si es True, la clave de caché incluye también el nombre del lugar. Si es False, la clave es
+        (query, categoría), salvo para los lugares sin categoría, que siempre incluyen el nombre.
+
+    validacion_local : bool
+        Si es True (y `sentence-transformers` está instalado), calcula en CPU la similitud entre la query
+        y el nombre y categoría de cada lugar. Los lugares con similitud >= `umbral_aceptar` se aceptan
+        y los que tienen similitud <= `umbral_rechazar` se descartan sin consultar al LLM.
+
+    umbral_aceptar, umbral_rechazar : float
+        Umbrales de similitud coseno de la validación local. Solo la franja intermedia llega al LLM.
+
+    muestra_auditoria : float
+        Fracción (0-1) de los lugares decididos localmente que también se envían al LLM para medir
+        cuántas veces coinciden ambos veredictos. El veredicto final sigue siendo el local.
+
+    Proceso:
+    --------
+    - Orden de decisión: caché -> validación local -> LLM.
+    - Los veredictos nuevos del LLM se guardan en la caché. Si lugares con la misma clave reciben
+      veredictos distintos, esa clave no se guarda (la categoría no basta para decidir).
+    - En modo "lote", cada ID que el modelo omita o conteste con un valor no reconocible
+      se vuelve a comprobar individualmente (solo ese ID).
+    - Las peticiones al LLM (trozos y revisiones individuales) se ejecutan en paralelo con `ejecutor`,
+      y los resultados se asignan siempre en el orden del DataFrame.
+    - Si una validación individual falla o agota su plazo, el lugar se descarta por seguridad con la vía
+      "error_llm". Esos descartes no son veredictos: no se guardan en la caché ni cuentan en la auditoría.
+
+    Devuelve:
+    --------
+    pd.DataFrame
+        DataFrame con el mismo índice que `df` y las columnas:
+        - 'Válido'        : True si el lugar corresponde a la query.
+        - 'Validado por'  : vía que decidió ("caché", "local", "llm_lote", "llm_individual" o "error_llm"
+                            si el LLM no respondió y el lugar se descartó sin veredicto).
+        - 'Similitud'     : similitud local calculada (NaN si no se calculó).
+        En `attrs["validacion"]` se guarda un resumen con el número de lugares decididos por cada vía
+        y, si se pidió, el resultado de la auditoría de la validación local.
+    """
+
+    resultado = pd.DataFrame(
+        {"Válido": False, "Validado por": "", "Similitud": np.nan},
+        index=df.index
+    )
+    auditoria = {"evaluados": 0, "coincidencias": 0}
+
+    # Término de búsqueda de cada lugar
+    consultas = query if isinstance(query, pd.Series) else pd.Series(query, index=df.index, dtype=object)
+    pendientes = list(df.index)
+
+    # 1. Consulta de la caché de veredictos: solo los fallos de caché siguen adelante
+    if usar_cache and pendientes:
+        claves = {
+            i: _clave_veredicto(consultas[i], df.at[i, "Categoría"], df.at[i, "Nombre"], cache_por_nombre)
+            for i in pendientes
+        }
+        en_cache = cache_veredictos.obtener_varios(list(claves.values()))
+        for indice, clave in claves.items():
+            if clave in en_cache:
+                resultado.loc[indice, ["Válido", "Validado por"]] = [bool(en_cache[clave]), "caché"]
+        pendientes = [i for i in pendientes if claves[i] not in en_cache]
+
+    # 2. Validación local por embeddings (por término de búsqueda): solo la franja dudosa sigue adelante
+    auditar = []
+    if validacion_local and pendientes:
+        decididos = []
+        for consulta in dict.fromkeys(consultas[pendientes]):
+            grupo = [i for i in pendientes if consultas[i] == consulta]
+            textos = [f'{df.at[i, "Nombre"]} ({df.at[i, "Categoría"]})' for i in grupo]
+            similitudes = similitud_local(consulta, textos)
+            if similitudes is None:
+                continue
+
+            resultado.loc[grupo, "Similitud"] = similitudes
+            for indice, similitud in zip(grupo, similitudes):
+                if similitud >= umbral_aceptar:
+                    resultado.loc[indice, ["Válido", "Validado por"]] = [True, "local"]
+                    decididos.append(indice)
+                elif similitud <= umbral_rechazar:
+                    resultado.loc[indice, ["Válido", "Validado por"]] = [False, "local"]
+                    decididos.append(indice)
+
+        set_decididos = set(decididos)
+        decididos = [i for i in pendientes if i in set_decididos]
+        if muestra_auditoria > 0 and decididos:
+            n_auditoria = min(len(decididos), max(1, round(len(decididos) * muestra_auditoria)))
+            auditar = list(pd.Series(decididos).sample(n=n_auditoria, random_state=0))
+        pendientes = [i for i in pendientes if i not in set_decididos]
+
+    # 3. Validación LLM de los lugares restantes (y de la muestra de auditoría)
+    if pendientes or auditar:
+        if groq_client is None:
+            groq_client = obtener_cliente_groq()
+
+        veredictos_llm = _validar_con_llm(
+            groq_client, ejecutor or ejecutor_llm, df, pendientes + auditar, consultas, modo, tamano_lote
+        )
+
+        for indice in pendientes:
+            resultado.loc[indice, ["Válido", "Validado por"]] = list(veredictos_llm[indice])
+
+        for indice in auditar:
+            if veredictos_llm[indice][1] == "error_llm":
+                continue
+            auditoria["evaluados"] += 1
+            auditoria["coincidencias"] += int(veredictos_llm[indice][0] == resultado.at[indice, "Válido"])
+
+        # Guardar en caché los veredictos nuevos (solo las claves con un veredicto unánime); los errores no son veredictos
+        if usar_cache:
+            nuevos = {}
+            for indice in pendientes + auditar:
+                if veredictos_llm[indice][1] == "error_llm":
+                    continue
+                nuevos.setdefault(claves[indice], set()).add(veredictos_llm[indice][0])
+            cache_veredictos.guardar_varios({
+                clave: valores.pop() for clave, valores in nuevos.items() if len(valores) == 1
+            })
+
+    resultado["Válido"] = resultado["Válido"].astype(bool)
+    resultado.attrs["validacion"] = {
+        "por_origen": resultado["Validado por"].value_counts().to_dict(),
+        "auditoria_local": auditoria
+    }
+    return resultado
+
+
+def _validar_con_llm(
+    groq_client: Groq,
+    ejecutor: EjecutorLLM,
+    df: pd.DataFrame,
+    indices: List,
+    consultas: pd.Series,
+    modo: Literal["lote", "individual"],
+    tamano_lote: int
+) -> Dict[object, tuple]:
+    """
+    Valida con el LLM los lugares `indices` de `df`, cada uno contra su término de `consultas`,
+    lanzando las peticiones en paralelo. Los trozos pueden mezclar lugares de varios términos.
+    Devuelve {índice: (veredicto, vía)} con vía "llm_lote", "llm_individual" o "error_llm"
+    (sin respuesta del LLM: veredicto False por seguridad, que no debe guardarse en caché).
+    """
+
+    veredictos = {}
+    pendientes = list(indices)
+
+    if modo == "lote":
+        tamano_lote = max(1, int(tamano_lote))
+        trozos = [pendientes[inicio:inicio + tamano_lote] for inicio in range(0, len(pendientes), tamano_lote)]
+        respuestas = ejecutor.ejecutar_en_orden(
+            _validar_lote_llm,
+            [
+                (groq_client, ejecutor, [(df.at[i, "Nombre"], df.at[i, "Categoría"], consultas[i]) for i in trozo])
+                for trozo in trozos
+            ]
+        )
+
+        sin_veredicto = []
+        for trozo, respuesta_lote in zip(trozos, respuestas):
+            for posicion, indice in enumerate(trozo):
+                # Trozo fallido o fuera de plazo (None): todos sus lugares se revisan individualmente
+                veredicto = (respuesta_lote or {}).get(posicion + 1)
+                if veredicto is None:
+                    sin_veredicto.append(indice)  # omitido o mal formado: se revisa individualmente
+                else:
+                    veredictos[indice] = (veredicto, "llm_lote")
+
+        pendientes = sin_veredicto
+
+    respuestas = ejecutor.ejecutar_en_orden(
+        _validar_lugar_individual,
+        [(groq_client, ejecutor, df.at[i, "Nombre"], df.at[i, "Categoría"], consultas[i]) for i in pendientes]
+    )
+    for indice, veredicto in zip(pendientes, respuestas):
+        if veredicto is None:
+            # Sin respuesta (error o plazo agotado): se descarta por seguridad, pero no es un veredicto
+            veredictos[indice] = (False, "error_llm")
+        else:
+            veredictos[indice] = (veredicto, "llm_individual")
+
+    return veredictos
+
+
+def _clave_veredicto(query: str, categoria: str, nombre: str, incluir_nombre: bool = False) -> str:
+    """
+    Construye la clave normalizada de la caché de veredictos.
+    """
+    partes = [_normalizar_texto(query), _normalizar_texto(categoria)]
+    if incluir_nombre or categoria == "No disponible":
+        partes.append(_normalizar_texto(nombre))
+    return "|".join(partes)
+
+
+def _validar_lugar_individual(groq_client: Groq, ejecutor: EjecutorLLM, nombre: str, categoria: str, query: str) -> Optional[bool]:
+    """
+    Pregunta al LLM si un único lugar es del tipo buscado. Devuelve None si la llamada falla.
+    """
+
+    # Prompt de validación al LLM
+    prompt = f"""
+    El lugar tiene el nombre "{nombre}" y la categoría "{categoria}".
+    ¿Este lugar es un/a {query}? Responde solo "sí" o "no".
+    """
+    try:
+        completion = ejecutor.completar(
+            groq_client,
+            model=MODELO_LLM,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            max_tokens=5
+        )
+        respuesta = completion.choices[0].message.content.strip().lower()
+        return "sí" in respuesta
+
+    except Exception as e:
+        print(f"Error al validar '{nombre}':", e)
+        return None  # Sin veredicto: quien llama lo descarta por seguridad sin guardarlo en caché
+
+
+def _validar_lote_llm(groq_client: Groq, ejecutor: EjecutorLLM, lote: List[tuple]) -> Dict[int, bool]:
+    """
+    Valida un trozo de lugares [(nombre, categoría, query), ...] en una sola petición al LLM.
+    Si el trozo mezcla varios términos de búsqueda, cada línea del prompt lleva el suyo.
+
+    Devuelve un diccionario {id: veredicto} con los IDs (1..n) que el modelo ha contestado de forma válida.
+    Si la petición falla o la respuesta no es JSON, devuelve un diccionario vacío para que
+    todos los lugares del trozo se revisen individualmente.
+    """
+
+    queries = list(dict.fromkeys(query for _, _, query in lote))
+    if len(queries) == 1:
+        listado = "\n".join(
+            f'{i}. nombre: "{nombre}" | categoría: "{categoria}"'
+            for i, (nombre, categoria, _) in enumerate(lote, start=1)
+        )
+        descripcion = "con su nombre y su categoría"
+        pregunta = f"Para cada lugar indica si es un/a {queries[0]}."
+    else:
+        listado = "\n".join(
+            f'{i}. nombre: "{nombre}" | categoría: "{categoria}" | buscado: "{query}"'
+            for i, (nombre, categoria, query) in enumerate(lote, start=1)
+        )
+        descripcion = "con su nombre, su categoría y el tipo de lugar buscado"
+        pregunta = "Para cada lugar indica si es del tipo de lugar buscado indicado en su línea."
+    prompt = f"""
+    Tienes una lista de lugares numerados {descripcion}:
+    {listado}
+
+    {pregunta}
+    Responde solo con un objeto JSON cuyas claves sean los números de la lista
+    y cuyos valores sean "sí" o "no". Ejemplo: {{"1": "sí", "2": "no"}}
+    """
+    try:
+        completion = ejecutor.completar(
+            groq_client,
+            model=MODELO_LLM,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            max_tokens=10 * len(lote) + 20,
+            response_format={"type": "json_object"}
+        )
+        datos = json.loads(completion.choices[0].message.content)
+
+    except Exception as e:
+        print(f"Error al validar el lote de {len(lote)} lugares:", e)
+        return {}
+
+    if not isinstance(datos, dict):
+        return {}
+
+    veredictos = {}
+    for clave, valor in datos.items():
+        try:
+            id_lugar = int(str(clave).strip())
+        except ValueError:
+            continue
+        veredicto = _interpretar_veredicto(valor)
+        if 1 <= id_lugar <= len(lote) and veredicto is not None:
+            veredictos[id_lugar] = veredicto
+
+    return veredictos
+
+
+def _interpretar_veredicto(valor) -> Optional[bool]:
+    """
+    Convierte la respuesta del LLM para un lugar ("sí", "no", true, false...) en booleano.
+    Devuelve None si la respuesta no es reconocible.
+    """
+    if isinstance(valor, bool):
+        return valor
+    if not isinstance(valor, str):
+        return None
+
+    respuesta = valor.strip().lower().strip('."\' ')
+    if respuesta in ("sí", "si", "yes", "true"):
+        return True
+    if respuesta in ("no", "false"):
+        return False
+    return None
+
+
+def obtener_ruta_optimizada(
+    df: pd.DataFrame, 
+    profile: Literal["driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"],
+    punto_inicio: List[float], 
+    punto_final: Optional[List[float]] = None,
+    motor: Literal["ors", "local"] = "ors",
+    tiempo_maximo_s: float = 2.0,
+    usar_cache: bool = True
+):
+    """
+    Calcula una ruta optimizada para visitar múltiples ubicaciones usando la API de OpenRouteService.
+    Permite definir puntos de inicio y fin personalizados. 
+    El punto de inicio es obligatorio y el punto de fin es opcional.
+
+    Parámetros:
+    -----------
+    df : pd.DataFrame
+        DataFrame que debe contener al menos las columnas 'Lat' y 'Lng',
+        correspondientes a la latitud y longitud de cada lugar a visitar.
+
+    profile: {"driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"}
+        Perfil de transporte usado por ORS. Cada perfil aplica reglas distintas:
+        - "driving-car"     : coche particular (carreteras normales).
+        - "foot-walking"    : caminando (calles peatonales, accesos).
+        - "cycling-regular" : bicicleta (evita autopistas, prioriza carriles bici).
+        - "driving-hgv"     : camión (considera restricciones de peso, altura).
+        - "wheelchair"      : accesible en silla de ruedas (pendientes y superficies adaptadas).
+    
+    punto_inicio : list [lng, lat]
+        Coordenadas del punto desde donde debe comenzar la ruta. Parámetro obligatorio.
+
+    punto_final : list [lng, lat], opcional
+        Coordenadas donde debe finalizar la ruta.
+        Si no se proporciona, ORS optimizará libremente el punto final.
+
+    motor : {"ors", "local"}, opcional
+        - "ors"   : servicio de optimización de OpenRouteService (por defecto).
+        - "local" : descarga una vez la matriz de duraciones (por bloques, ver `obtener_matriz_ors`)
+                    y resuelve el orden de visita localmente (ver `resolver_ruta_local`). No depende
+                    de los límites de trabajos del servicio de optimización.
+
+    tiempo_maximo_s : float, opcional
+        Presupuesto de tiempo de la fase de mejora del motor "local".
+
+    usar_cache : bool, opcional
+        Si es True (por defecto), reutiliza la ruta calculada antes para la misma selección
+        (ver `huella_ruta`), en cualquier sesión del proceso, y agrupa las peticiones simultáneas
+        de la misma selección en un único cálculo. La ruta devuelta es compartida: no debe modificarse.
+
+    Proceso:
+    --------
+    - Busca la ruta en la caché de rutas por la huella de la selección.
+    - Define las ubicaciones a visitar como "jobs".
+    - Crea un "vehicle" desde el punto de inicio indicado.
+    - Llama al servicio de optimización de OpenRouteService (o al motor local).
+    - Obtiene el orden óptimo de visitas.
+    - Calcula la ruta final con instrucciones paso a paso (ver `obtener_direcciones`).
+    - Añade a `ruta["metadata"]["optimizacion"]` el motor usado, el tiempo de resolución y el coste del recorrido.
+
+    Devuelve:
+    --------
+    tuple:
+        ruta : geojson (dict)
+            Ruta en formato GeoJSON con información detallada del recorrido.
+        coordenadas_ordenadas : List[List[float]]
+            Lista de coordenadas [lng, lat] en orden de visita.
+        instrucciones: List[str] 
+            Lista de instrucciones legibles paso a paso para seguir la ruta.
+    """
+
+    # Cliente compartido de la API ORS
+    client = obtener_cliente_ors()
+
+    # Verificación de puntos mínimos
+    if len(df) < 1:
+        raise ValueError("Se necesita al menos un lugar para calcular una ruta.")
+    
+    # Extraer lista de coordenadas desde el DataFrame
+    coords_lugares = df[["Lng", "Lat"]].values.tolist()
+
+    def calcular():
+        # Obtener el orden de visitas con el motor elegido
+        if motor == "local":
+            orden, informe = _ordenar_localmente(
+                client, coords_lugares, profile, punto_inicio, punto_final, tiempo_maximo_s
+            )
+        else:
+            orden, informe = _ordenar_con_ors(client, coords_lugares, profile, punto_inicio, punto_final)
+
+        # Obtener coordenadas optimizadas: inicio + coordenadas de los lugares en orden
+        coords_ordenadas = [punto_inicio] + [coords_lugares[i] for i in orden]
+
+        if punto_final:
+            coords_ordenadas.append(punto_final)
+
+        # Obtener la ruta completa con instrucciones en GeoJSON (por tramos en paralelo si hay muchos puntos)
+        ruta = obtener_direcciones(client, coords_ordenadas, profile)
+
+        ruta.setdefault("metadata", {})["optimizacion"] = informe
+
+        return ruta, coords_ordenadas, _extraer_instrucciones(ruta)
+
+    if not usar_cache:
+        return calcular()
+    return cache_rutas.obtener_o_calcular(huella_ruta(profile, punto_inicio, punto_final, coords_lugares), calcular)
+
+
+def huella_ruta(
+    profile: str,
+    punto_inicio: List[float],
+    punto_final: Optional[List[float]],
+    coords_lugares: List[List[float]]
+) -> str:
+    """
+    Huella canónica (SHA-256) de una selección de ruta: perfil, inicio, fin y paradas.
+
+    Las coordenadas se redondean a 6 decimales y las paradas se ordenan, de modo que la huella
+    no depende del orden de selección ni del orden de visita. La usan la caché de rutas y la
+    detección de rutas duplicadas al guardarlas en el historial.
+    """
+    seleccion = {
+        "perfil": profile,
+        "inicio": list(_clave_punto(punto_inicio)),
+        "fin": list(_clave_punto(punto_final)) if punto_final else None,
+        "paradas": sorted(list(_clave_punto(c)) for c in coords_lugares)
+    }
+    return hashlib.sha256(json.dumps(seleccion, separators=(",", ":")).encode()).hexdigest()
+
+
+def invalidar_cache_rutas(huella: Optional[str] = None):
+    """
+    Elimina de la caché de rutas la ruta con esa huella (ver `huella_ruta`) o, si no se indica, todas.
+    """
+    cache_rutas.invalidar(huella)
+
+
+def comparar_perfiles(
+    df: pd.DataFrame,
+    profiles: List[Literal["driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"]],
+    punto_inicio: List[float],
+    punto_final: Optional[List[float]] = None,
+    motor: Literal["ors", "local"] = "ors",
+    tiempo_maximo_s: float = 2.0
+):
+    """
+    Calcula en paralelo la ruta optimizada de la misma selección para varios perfiles de transporte
+    y los compara.
+
+    Parámetros:
+    -----------
+    df : pd.DataFrame
+        Lugares a visitar (columnas 'Lat' y 'Lng'), como en `obtener_ruta_optimizada`.
+
+    profiles : List[str]
+        Perfiles de ORS a comparar (sin repetir).
+
+    punto_inicio, punto_final : list [lng, lat]
+        Puntos de inicio (obligatorio) y fin (opcional), ya geocodificados una sola vez para todos los perfiles.
+
+    motor, tiempo_maximo_s :
+        Igual que en `obtener_ruta_optimizada`.
+
+    Proceso:
+    --------
+    - Lanza `obtener_ruta_optimizada` para cada perfil en un hilo, de modo que la espera total es
+      la del perfil más lento y no la suma de todos. Cada perfil usa la caché de rutas.
+    - Si un perfil falla, se anota el error en la tabla y se sigue con el resto.
+
+    Devuelve:
+    --------
+    tuple:
+        comparacion : pd.DataFrame
+            Una fila por perfil con las columnas 'Perfil', 'Distancia (km)', 'Duración (min)' y 'Error'.
+        rutas : Dict[str, tuple]
+            Para cada perfil calculado con éxito, la tupla (ruta, coordenadas_ordenadas, instrucciones).
+    """
+    if len(df) < 1:
+        raise ValueError("Se necesita al menos un lugar para calcular una ruta.")
+
+    profiles = list(dict.fromkeys(profiles))
+
+    def calcular(profile):
+        return obtener_ruta_optimizada(
+            df, profile, punto_inicio, punto_final, motor=motor, tiempo_maximo_s=tiempo_maximo_s
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, len(profiles)), thread_name_prefix="ors-perfiles") as pool:
+        futuros = {profile: pool.submit(calcular, profile) for profile in profiles}
+
+    filas, rutas = [], {}
+    for profile, futuro in futuros.items():
+        try:
+            rutas[profile] = futuro.result()
+        except Exception as e:
+            print(f"Error al calcular la ruta con el perfil {profile}: {e}")
+            filas.append({"Perfil": profile, "Distancia (km)": None, "Duración (min)": None, "Error": str(e)})
+            continue
+        resumen = rutas[profile][0]["features"][0]["properties"]["summary"]
+        filas.append({
+            "Perfil": profile,
+            "Distancia (km)": resumen["distance"] / 1000,
+            "Duración (min)": resumen["duration"] / 60,
+            "Error": None
+        })
+
+    return pd.DataFrame(filas, columns=["Perfil", "Distancia (km)", "Duración (min)", "Error"]), rutas
+
+
+def actualizar_ruta_incremental(
+    coords_previas: List[List[float]],
+    profile: Literal["driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"],
+    punto_inicio: List[float],
+    punto_final: Optional[List[float]] = None,
+    anadidos: Optional[List[List[float]]] = None,
+    eliminados: Optional[List[List[float]]] = None,
+    radio_ventana: int = 3,
+    tiempo_maximo_s: float = 0.05
+):
+    """
+    Actualiza una ruta ya optimizada cuando se añaden o se quitan paradas, sin recalcularla desde cero.
+
+    Parámetros:
+    -----------
+    coords_previas : List[List[float]]
+        `coordenadas_ordenadas` devueltas por `obtener_ruta_optimizada` (o por esta misma función)
+        para la ruta anterior: inicio, paradas en orden y, si lo había, fin.
+
+    profile : str
+        Perfil de transporte de ORS (el mismo que el de la ruta anterior).
+
+    punto_inicio, punto_final : list [lng, lat]
+        Puntos de inicio y fin de la ruta. Deben coincidir con los de `coords_previas`.
+
+    anadidos : List[List[float]], opcional
+        Coordenadas [lng, lat] de las paradas nuevas.
+
+    eliminados : List[List[float]], opcional
+        Coordenadas [lng, lat] de las paradas que se quitan de la ruta.
+
+    radio_ventana : int, opcional
+        Número de paradas a cada lado de cada cambio que se pueden reordenar.
+
+    tiempo_maximo_s : float, opcional
+        Presupuesto de tiempo de la fase de mejora local.
+
+    Proceso:
+    --------
+    - Quita las paradas eliminadas manteniendo el orden del resto.
+    - Estima con distancias en línea recta el tramo en el que encaja cada parada nueva.
+    - Alrededor de cada cambio abre una ventana de `radio_ventana` paradas y pide a ORS, en una
+      sola llamada a la matriz, las duraciones entre los puntos de las ventanas y las paradas nuevas.
+    - En cada ventana inserta las paradas nuevas por inserción más barata y la mejora con
+      movimientos 2-opt y Or-opt, dejando fijos sus extremos (salvo el final de una ruta sin fin).
+    - Obtiene las direcciones con `obtener_direcciones` en una sola petición: los tramos nuevos de
+      todas las ventanas se piden juntos, incluidos los tramos intermedios sin cambios (que se renuevan
+      en caché), y los tramos de fuera de ese rango salen de la caché de tramos. Solo si ese rango
+      supera `MAX_PUNTOS_DIRECCIONES_ORS` puntos se reparte en más peticiones.
+      En total, una llamada a la matriz y normalmente una a las direcciones.
+    - El resultado no se guarda en la caché de rutas (`cache_rutas`): es una aproximación y
+      `obtener_ruta_optimizada` debe seguir devolviendo la optimización completa de la selección.
+
+    Devuelve:
+    --------
+    tuple:
+        Lo mismo que `obtener_ruta_optimizada`: (ruta, coordenadas_ordenadas, instrucciones).
+        `ruta["metadata"]["optimizacion"]` indica motor "incremental".
+    """
+    if not coords_previas or _clave_punto(coords_previas[0]) != _clave_punto(punto_inicio):
+        raise ValueError("La ruta anterior no empieza en el punto de inicio indicado; usa obtener_ruta_optimizada.")
+    if punto_final and _clave_punto(coords_previas[-1]) != _clave_punto(punto_final):
+        raise ValueError("La ruta anterior no termina en el punto final indicado; usa obtener_ruta_optimizada.")
+
+    client = obtener_cliente_ors()
+    inicio = time.perf_counter()
+    fin_fijo = 1 if punto_final else 0
+    a_eliminar = {_clave_punto(c) for c in (eliminados or [])}
+
+    # Quitar las paradas eliminadas; cada hueco se recuerda en la posición de su predecesor
+    camino = [list(punto_inicio)]
+    sitios = []
+    for coord in coords_previas[1:len(coords_previas) - fin_fijo]:
+        if _clave_punto(coord) in a_eliminar:
+            sitios.append(len(camino) - 1)
+        else:
+            camino.append(list(coord))
+    if punto_final:
+        camino.append(list(punto_final))
+
+    # Paradas nuevas (sin repetir las que ya están en la ruta)
+    presentes = {_clave_punto(c) for c in camino}
+    nuevos = []
+    for coord in anadidos or []:
+        if _clave_punto(coord) not in presentes:
+            presentes.add(_clave_punto(coord))
+            nuevos.append(list(coord))
+
+    if len(camino) - 1 - fin_fijo + len(nuevos) < 1:
+        raise ValueError("Se necesita al menos un lugar para calcular una ruta.")
+
+    # Tramo estimado para cada parada nueva: menor rodeo en línea recta (o al final si la ruta es abierta)
+    n = len(camino)
+    lng_camino, lat_camino = np.array(camino, dtype=float).T
+    directo = _distancia_m(lat_camino[:-1], lng_camino[:-1], lat_camino[1:], lng_camino[1:])
+    sitio_nuevo = []
+    for lng, lat in nuevos:
+        hasta = _distancia_m(lat_camino, lng_camino, lat, lng)
+        rodeo = hasta[:-1] + hasta[1:] - directo
+        if not punto_final:
+            rodeo = np.append(rodeo, hasta[-1])
+        sitio_nuevo.append(int(np.argmin(rodeo)) if len(rodeo) else 0)
+
+    # Ventanas contiguas [a, b] alrededor de cada cambio, fusionadas si se solapan
+    ventanas = []
+    for sitio in sorted(sitios + sitio_nuevo):
+        a, b = max(0, sitio - radio_ventana), min(n - 1, sitio + 1 + radio_ventana)
+        if ventanas and a <= ventanas[-1][1]:
+            ventanas[-1][1] = max(ventanas[-1][1], b)
+        else:
+            ventanas.append([a, b])
+
+    # Una sola llamada a la matriz con los puntos de todas las ventanas y las paradas nuevas
+    puntos, indice = [], {}
+    for coord in [c for a, b in ventanas for c in camino[a:b + 1]] + nuevos:
+        if _clave_punto(coord) not in indice:
+            indice[_clave_punto(coord)] = len(puntos)
+            puntos.append(coord)
+    if len(puntos) > 1:
+        duraciones, _ = obtener_matriz_ors(client, puntos, profile)
+    else:
+        duraciones = np.zeros((len(puntos), len(puntos)))
+
+    # Reoptimizar cada ventana de derecha a izquierda para no desplazar las posiciones pendientes
+    limite = time.perf_counter() + tiempo_maximo_s
+    for a, b in reversed(ventanas):
+        tramo = camino[a:b + 1]
+        pendientes = [c for c, sitio in zip(nuevos, sitio_nuevo) if a <= sitio < b or (sitio == b == n - 1)]
+        candidatos = tramo + pendientes
+        nodos = [indice[_clave_punto(c)] for c in candidatos]
+        coste = duraciones[np.ix_(nodos, nodos)]
+
+        base = list(range(len(tramo)))
+        if not punto_final and b == n - 1:
+            # Nodo ficticio de fin: la ruta abierta puede terminar en cualquier parada de la ventana
+            coste = np.pad(coste, ((0, 1), (0, 1)))
+            coste[-1, :] = 0
+            base.append(len(candidatos))
+
+        recorrido = _insercion_mas_barata(coste, base, list(range(len(tramo), len(candidatos))))
+        while time.perf_counter() < limite:
+            if _mejorar_2opt(coste, recorrido) or _mejorar_or_opt(coste, recorrido):
+                continue
+            break
+
+        camino[a:b + 1] = [candidatos[k] for k in recorrido if k < len(candidatos)]
+
+    tiempo_resolucion = time.perf_counter() - inicio
+    coords_ordenadas = [list(punto_inicio)] + camino[1:]
+
+    ruta = obtener_direcciones(client, coords_ordenadas, profile, max_peticiones=1)
+
+    resumen = ruta["features"][0]["properties"].get("summary", {}) if ruta.get("features") else {}
+    ruta.setdefault("metadata", {})["optimizacion"] = {
+        "motor": "incremental",
+        "tiempo_resolucion_s": tiempo_resolucion,
+        "coste": resumen.get("duration"),
+        "duracion_s": resumen.get("duration"),
+        "distancia_m": resumen.get("distance"),
+        "anadidos": len(nuevos),
+        "eliminados": len(sitios),
+        "puntos_matriz": len(puntos)
+    }
+
+    # No se guarda en la caché de rutas: es una aproximación y esa caché solo contiene optimizaciones completas
+    return ruta, coords_ordenadas, _extraer_instrucciones(ruta)
+
+
+def _clave_punto(coord: List[float]) -> tuple:
+    return (round(float(coord[0]), 6), round(float(coord[1]), 6))
+
+
+def _extraer_instrucciones(ruta: Dict) -> List[str]:
+    """
+    Extrae las instrucciones legibles paso a paso de una ruta GeoJSON de ORS.
+    """
+    instrucciones = []
+    for feature in ruta["features"]:
+        steps = feature["properties"].get("segments", [])[0].get("steps", [])
+        for i, step in enumerate(steps):
+            instrucciones.append(f"{i+1}. {step['instruction']} ({step['distance']:.0f} m)")
+    return instrucciones
+
+
+def obtener_direcciones(
+    client: openrouteservice.Client,
+    coords: List[List[float]],
+    profile: str,
+    max_puntos: int = MAX_PUNTOS_DIRECCIONES_ORS,
+    usar_cache: bool = True,
+    max_peticiones: Optional[int] = None
+) -> Dict:
     """
-        Busca lugares específicos en una ubicación determinada usando la API de Foursquare 
-        y valida los resultados con un modelo de lenguaje LLM.
+    Obtiene de ORS la ruta (GeoJSON con instrucciones) que recorre `coords` en orden.
 
-        Parámetros:
-        -----------
-        query : str
-            Término de búsqueda que se enviará a la API de Foursquare. 
-        
-        radius : int
-            Radio de búsqueda en metros desde las coordenadas indicadas.
+    Parámetros:
+    -----------
+    client : openrouteservice.Client
+        Cliente de ORS.
 
-        latitude : float
-             Latitud del punto central de búsqueda.
+    coords : list of [lng, lat]
+        Puntos de la ruta en orden de visita.
 
-        longitude : float
-             Longitud del punto central de búsqueda.
+    profile : str
+        Perfil de transporte de ORS.
 
-        Proceso:
-        --------
-        - Consulta la API de Foursquare para obtener lugares que coincidan con el término (query) y área especificados.  
-        - Extrae información relevante (nombre, dirección, categoría, coordenadas, etc.).
-        - Utiliza un modelo LLM (en este caso, Groq con LLaMA 3) para validar si realmente coniciden con la query.
-        - Filtra los resultados y descarta los lugares no válidos.
+    max_puntos : int
+        Número máximo de puntos por petición de direcciones.
 
-        Devuelve:
-        --------
-        df_filtrado: pd.DataFrame 
-            Un DataFrame con los lugares validados, conteniendo las columnas:
-            'ID', 'Nombre', 'Dirección', 'Categoría', 'Lat', 'Lng', 'Teléfono', 'Web'.
-    """
+    usar_cache : bool
+        Si es True, cada tramo entre dos puntos consecutivos se busca primero en la caché persistente
+        `cache_tramos` (clave: perfil y coordenadas de origen y destino redondeadas a 1e-6) y solo se
+        piden a ORS los tramos que faltan.
 
-    # Configuración de la API de Foursquare
-    url = "https://places-api.foursquare.com/places/search"
-    headers = {
-        "accept": "application/json",
-        "X-Places-Api-Version": "2025-06-17",
-        "authorization": f"Bearer {FOURSQUARE_API_KEY}"
-    }
-    params = {
-        "query": query,
-        "ll": f"{latitude},{longitude}",
-        "radius": radius,
-        "limit": 50
-    }
-    
-    # Petición a la API de Foursquare
-    response = requests.get(url, headers=headers, params=params)
-    data = response.json()
+    max_peticiones : int, opcional
+        Si se indica, las secuencias de tramos pendientes separadas por tramos en caché se fusionan
+        (empezando por las más próximas) hasta quedar como mucho en ese número de peticiones, siempre
+        que cada una siga sin superar `max_puntos`. Los tramos intermedios se vuelven a pedir y se
+        renuevan en caché; a cambio, se ahorran llamadas a ORS.
 
-    # Procesamiento de resultados obtenidos de la API
-    lugares = []
-    for lugar in data.get("results", []):
-        lugares.append({
-            "ID": lugar.get("fsq_place_id","No disponible"),
-            "Nombre": lugar.get("name", "No disponible"),
-            "Dirección": lugar.get("location", {}).get("formatted_address", "No disponible"),
-            "Categoría": next((c.get("name") for c in lugar.get("categories", []) if c.get("name")), "No disponible"),
-            "Lat": lugar.get("latitude", "No disponible"),
-            "Lng": lugar.get("longitude", "No disponible"),
-            "Teléfono": lugar.get("tel", "No disponible"),
-            "Web": lugar.get("website", "No disponible")
-        })
+    Proceso:
+    --------
+    - Los tramos que faltan se agrupan en secuencias consecutivas de como máximo `max_puntos` puntos,
+      que se piden en paralelo. Cada respuesta se divide en tramos (uno por segmento) y se guarda en caché.
+    - La ruta final se compone uniendo los tramos en un único FeatureCollection con el mismo formato
+      que devuelve ORS (ver `_unir_rutas_geojson`).
+    """
+    max_puntos = max(2, max_puntos)
+    n_tramos = len(coords) - 1
+    claves = [_clave_tramo(profile, coords[k], coords[k + 1]) for k in range(n_tramos)]
 
-    df = pd.DataFrame(lugares).replace(['', ' ', None], 'No disponible')
+    tramos = cache_tramos.obtener_varios(claves) if usar_cache else {}
+    pendientes = [k for k in range(n_tramos) if claves[k] not in tramos]
 
-    # Inicializa el cliente Groq para validación LLM
-    groq_client = Groq()
+    # Secuencias de tramos pendientes consecutivos, de como máximo max_puntos - 1 tramos cada una
+    secuencias = []
+    for k in pendientes:
+        if secuencias and secuencias[-1][-1] == k - 1 and len(secuencias[-1]) < max_puntos - 1:
+            secuencias[-1].append(k)
+        else:
+            secuencias.append([k])
 
-    # Almacenamos los lugares validados 
-    lugares_confirmados = []
+    # Fusionar las secuencias más próximas (cubriendo los tramos intermedios) hasta max_peticiones
+    while max_peticiones and len(secuencias) > max_peticiones:
+        huecos = [
+            (secuencias[j + 1][0] - secuencias[j][-1], j) for j in range(len(secuencias) - 1)
+            if secuencias[j + 1][-1] - secuencias[j][0] + 1 <= max_puntos - 1
+        ]
+        if not huecos:
+            break
+        _, j = min(huecos)
+        secuencias[j:j + 2] = [list(range(secuencias[j][0], secuencias[j + 1][-1] + 1))]
 
-    for _, row in df.iterrows():
-        nombre = row["Nombre"]
-        categoria = row["Categoría"]
+    def pedir_secuencia(secuencia):
+        return client.directions(
+            coordinates=coords[secuencia[0]:secuencia[-1] + 2],
+            profile=profile,
+            format='geojson',
+            instructions=True
+        )
 
-        # Prompt de validación al LLM
-        prompt = f"""
-        El lugar tiene el nombre "{nombre}" y la categoría "{categoria}".
-        ¿Este lugar es un/a {query}? Responde solo "sí" o "no".
-        """
-        try:
-            completion = groq_client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-                max_tokens=5
-            )
-            respuesta = completion.choices[0].message.content.strip().lower()
-            es_lugar = "sí" in respuesta
+    metadata = {}
+    if secuencias:
+        with ThreadPoolExecutor(max_workers=4, thread_name_prefix="ors-direcciones") as pool:
+            respuestas = list(pool.map(pedir_secuencia, secuencias))
 
-        except Exception as e:
-            print(f"Error al validar '{nombre}':", e)
-            es_lugar = False  # Por seguridad, descartar si falla
+        nuevos = {}
+        for secuencia, respuesta in zip(secuencias, respuestas):
+            for k, tramo in zip(secuencia, _dividir_en_tramos(respuesta)):
+                nuevos[claves[k]] = tramo
+        tramos.update(nuevos)
+        if usar_cache:
+            cache_tramos.guardar_varios(nuevos)
+        metadata = respuestas[0].get("metadata", {})
 
-        if es_lugar:
-            lugares_confirmados.append(row)
+    ruta = _unir_rutas_geojson([_tramo_a_geojson(tramos[clave]) for clave in claves])
+    pedidos = sum(len(secuencia) for secuencia in secuencias)
+    ruta["metadata"] = {**metadata, "tramos": {"total": n_tramos, "desde_cache": n_tramos - pedidos}}
+    return ruta
 
-    # Crear DataFrame final con los lugares confirmados
-    df_filtrado = pd.DataFrame(lugares_confirmados).reset_index(drop=True)
 
-    return df_filtrado
+def _clave_tramo(profile: str, origen: List[float], destino: List[float]) -> str:
+    return f"{profile}|{origen[0]:.6f},{origen[1]:.6f}|{destino[0]:.6f},{destino[1]:.6f}"
 
 
-def obtener_ruta_optimizada(
-    df: pd.DataFrame, 
-    profile: Literal["driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"],
-    punto_inicio: List[float], 
-    punto_final: Optional[List[float]] = None
-):
+def _dividir_en_tramos(ruta: Dict) -> List[Dict]:
     """
-    Calcula una ruta optimizada para visitar múltiples ubicaciones usando la API de OpenRouteService.
-    Permite definir puntos de inicio y fin personalizados. 
-    El punto de inicio es obligatorio y el punto de fin es opcional.
+    Divide una ruta GeoJSON de ORS en sus tramos (uno por segmento), cada uno con su geometría
+    y su segmento con los índices `way_points` de los pasos relativos al inicio del tramo.
+    """
+    feature = ruta["features"][0]
+    geometria = feature["geometry"]["coordinates"]
+    way_points = feature["properties"]["way_points"]
 
-    Parámetros:
-    -----------
-    df : pd.DataFrame
-        DataFrame que debe contener al menos las columnas 'Lat' y 'Lng',
-        correspondientes a la latitud y longitud de cada lugar a visitar.
+    tramos = []
+    for k, segmento in enumerate(feature["properties"].get("segments", [])):
+        inicio, fin = way_points[k], way_points[k + 1]
+        segmento = dict(segmento)
+        segmento["steps"] = [
+            {**paso, "way_points": [w - inicio for w in paso.get("way_points", [])]}
+            for paso in segmento.get("steps", [])
+        ]
+        tramos.append({"geometria": geometria[inicio:fin + 1], "segmento": segmento})
+    return tramos
 
-    profile: {"driving-car", "foot-walking", "cycling-regular", "driving-hgv", "wheelchair"}
-        Perfil de transporte usado por ORS. Cada perfil aplica reglas distintas:
-        - "driving-car"     : coche particular (carreteras normales).
-        - "foot-walking"    : caminando (calles peatonales, accesos).
-        - "cycling-regular" : bicicleta (evita autopistas, prioriza carriles bici).
-        - "driving-hgv"     : camión (considera restricciones de peso, altura).
-        - "wheelchair"      : accesible en silla de ruedas (pendientes y superficies adaptadas).
-    
-    punto_inicio : list [lng, lat]
-        Coordenadas del punto desde donde debe comenzar la ruta. Parámetro obligatorio.
 
-    punto_final : list [lng, lat], opcional
-        Coordenadas donde debe finalizar la ruta.
-        Si no se proporciona, ORS optimizará libremente el punto final.
+def _tramo_a_geojson(tramo: Dict) -> Dict:
+    """
+    Convierte un tramo guardado en caché en una ruta GeoJSON de ORS de un solo segmento.
+    """
+    geometria = tramo["geometria"]
+    lngs = [c[0] for c in geometria]
+    lats = [c[1] for c in geometria]
+    bbox = [min(lngs), min(lats), max(lngs), max(lats)]
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "bbox": bbox,
+            "properties": {
+                "segments": [tramo["segmento"]],
+                "way_points": [0, len(geometria) - 1],
+                "summary": {
+                    "distance": tramo["segmento"].get("distance", 0.0),
+                    "duration": tramo["segmento"].get("duration", 0.0)
+                }
+            },
+            "geometry": {"type": "LineString", "coordinates": geometria}
+        }],
+        "bbox": bbox
+    }
 
-    Proceso:
-    --------
-    - Define las ubicaciones a visitar como "jobs".
-    - Crea un "vehicle" desde el punto de inicio indicado.
-    - Llama al servicio de optimización de OpenRouteService.
-    - Obtiene el orden óptimo de visitas.
-    - Calcula la ruta final con instrucciones paso a paso.
 
-    Devuelve:
-    --------
-    tuple:
-        ruta : geojson (dict)
-            Ruta en formato GeoJSON con información detallada del recorrido.
-        coordenadas_ordenadas : List[List[float]]
-            Lista de coordenadas [lng, lat] en orden de visita.
-        instrucciones: List[str] 
-            Lista de instrucciones legibles paso a paso para seguir la ruta.
+def _unir_rutas_geojson(rutas: List[Dict]) -> Dict:
+    """
+    Une varias rutas GeoJSON de ORS consecutivas (el último punto de cada una es el primero de la
+    siguiente) en una sola: concatena la geometría sin repetir el punto de unión, los segmentos
+    (desplazando los índices `way_points` de cada paso), los `way_points` de la ruta, y suma el resumen.
     """
+    coordenadas = []
+    segmentos = []
+    way_points = []
+    distancia = duracion = 0.0
+    cajas = []
 
-    # Inicializar el cliente de la API ORS
-    client = openrouteservice.Client(key=ORS_API_KEY)
+    for numero, ruta in enumerate(rutas):
+        feature = ruta["features"][0]
+        propiedades = feature["properties"]
+        geometria = feature["geometry"]["coordinates"]
 
-    # Verificación de puntos mínimos
-    if len(df) < 1:
-        raise ValueError("Se necesita al menos un lugar para calcular una ruta.")
-    
-    # Extraer lista de coordenadas desde el DataFrame
-    coords_lugares = df[["Lng", "Lat"]].values.tolist()
+        # Desplazamiento de índices: el primer vértice de cada tramo coincide con el último del anterior
+        desplazamiento = len(coordenadas) - 1 if numero > 0 else 0
+        coordenadas.extend(geometria if numero == 0 else geometria[1:])
+
+        for segmento in propiedades.get("segments", []):
+            segmento = dict(segmento)
+            segmento["steps"] = [
+                {**paso, "way_points": [w + desplazamiento for w in paso.get("way_points", [])]}
+                for paso in segmento.get("steps", [])
+            ]
+            segmentos.append(segmento)
+
+        puntos = [w + desplazamiento for w in propiedades.get("way_points", [])]
+        way_points.extend(puntos if numero == 0 else puntos[1:])
+
+        distancia += propiedades.get("summary", {}).get("distance", 0.0)
+        duracion += propiedades.get("summary", {}).get("duration", 0.0)
+        if "bbox" in feature:
+            cajas.append(feature["bbox"])
+
+    bbox = [
+        min(c[0] for c in cajas), min(c[1] for c in cajas),
+        max(c[2] for c in cajas), max(c[3] for c in cajas)
+    ] if cajas else None
+
+    feature = {
+        "type": "Feature",
+        "properties": {
+            "segments": segmentos,
+            "way_points": way_points,
+            "summary": {"distance": distancia, "duration": duracion}
+        },
+        "geometry": {"type": "LineString", "coordinates": coordenadas}
+    }
+    ruta = {"type": "FeatureCollection", "features": [feature], "metadata": dict(rutas[0].get("metadata", {}))}
+    if bbox:
+        feature["bbox"] = bbox
+        ruta["bbox"] = bbox
+    return ruta
+
+
+def _ordenar_con_ors(
+    client: openrouteservice.Client,
+    coords_lugares: List[List[float]],
+    profile: str,
+    punto_inicio: List[float],
+    punto_final: Optional[List[float]]
+) -> tuple:
+    """
+    Obtiene el orden de visita con el servicio de optimización de ORS.
+    Devuelve (índices de `coords_lugares` en orden de visita, informe de la optimización).
+    """
+    inicio = time.perf_counter()
 
     # Definir vehículo con punto de inicio
     vehicle_kwargs = {
@@ -201,7 +3579,6 @@ def obtener_ruta_optimizada(
         vehicle_kwargs['end'] = punto_final
 
     vehicle = Vehicle(**vehicle_kwargs)
-        
 
     # Crear 'jobs' (puntos a visitar) excepto el primero y el último
     jobs = [
@@ -215,43 +3592,250 @@ def obtener_ruta_optimizada(
         vehicles=[vehicle]
     )
 
-    # Extraer orden de visitas (IDs de los jobs)
-    orden_ids = [step["job"] for step in result["routes"][0]["steps"] if step["type"] == "job"]
+    # Extraer orden de visitas (IDs de los jobs); i - 1 porque job.id = i+1
+    orden = [step["job"] - 1 for step in result["routes"][0]["steps"] if step["type"] == "job"]
+
+    informe = {
+        "motor": "ors",
+        "tiempo_resolucion_s": time.perf_counter() - inicio,
+        "coste": result.get("summary", {}).get("cost"),
+        "duracion_s": result.get("summary", {}).get("duration")
+    }
+    return orden, informe
 
-    # Obtener coordenadas optimizadas: inicio + coordenadas de los lugares en orden
-    coords_ordenadas = [punto_inicio] + [coords_lugares[i - 1] for i in orden_ids]  # i - 1 porque job.id = i+1
 
-    if punto_final:
-        coords_ordenadas.append(punto_final)
-
-    # Obtener la ruta completa con instrucciones en GeoJSON
-    ruta = client.directions(
-        coordinates=coords_ordenadas,
-        profile=profile,
-        format='geojson',
-        instructions=True
+def _ordenar_localmente(
+    client: openrouteservice.Client,
+    coords_lugares: List[List[float]],
+    profile: str,
+    punto_inicio: List[float],
+    punto_final: Optional[List[float]],
+    tiempo_maximo_s: float
+) -> tuple:
+    """
+    Obtiene el orden de visita resolviendo el problema localmente sobre la matriz de duraciones de ORS.
+    Devuelve (índices de `coords_lugares` en orden de visita, informe de la optimización).
+    """
+    puntos = [punto_inicio] + list(coords_lugares) + ([punto_final] if punto_final else [])
+    duraciones, distancias = obtener_matriz_ors(client, puntos, profile)
+
+    inicio = time.perf_counter()
+    coste = duraciones.copy()
+    if not punto_final:
+        # Nodo ficticio de fin, alcanzable sin coste desde cualquier punto: la ruta termina donde convenga
+        coste = np.pad(coste, ((0, 1), (0, 1)))
+        coste[-1, :] = 0
+
+    camino = resolver_ruta_local(coste, tiempo_maximo_s=tiempo_maximo_s)
+    orden = [nodo - 1 for nodo in camino[1:-1]]  # sin inicio ni fin; nodo i -> lugar i - 1
+
+    nodos = [0] + [i + 1 for i in orden] + ([len(puntos) - 1] if punto_final else [])
+    informe = {
+        "motor": "local",
+        "tiempo_resolucion_s": time.perf_counter() - inicio,
+        "coste": float(duraciones[nodos[:-1], nodos[1:]].sum()),
+        "duracion_s": float(duraciones[nodos[:-1], nodos[1:]].sum()),
+        "distancia_m": float(distancias[nodos[:-1], nodos[1:]].sum())
+    }
+    return orden, informe
+
+
+def obtener_matriz_ors(
+    client: openrouteservice.Client,
+    coords: List[List[float]],
+    profile: str,
+    max_elementos: int = MAX_ELEMENTOS_MATRIZ_ORS
+) -> tuple:
+    """
+    Obtiene las matrices de duraciones (s) y distancias (m) entre todos los puntos usando el
+    endpoint de matrices de ORS, dividiendo la petición en bloques de origen x destino de como
+    máximo `max_elementos` celdas y lanzando los bloques en paralelo.
+
+    Los pares sin ruta posible (null en ORS) se rellenan con un valor muy alto.
+
+    Devuelve:
+    --------
+    tuple (np.ndarray, np.ndarray)
+        Matrices n x n de duraciones y distancias.
+    """
+    n = len(coords)
+    tamano_bloque = max(1, int(np.sqrt(max_elementos)))
+    bloques = [list(range(i, min(i + tamano_bloque, n))) for i in range(0, n, tamano_bloque)]
+
+    def pedir_bloque(origenes, destinos):
+        locations = [coords[i] for i in origenes] + [coords[j] for j in destinos]
+        return client.distance_matrix(
+            locations=locations,
+            profile=profile,
+            sources=list(range(len(origenes))),
+            destinations=list(range(len(origenes), len(locations))),
+            metrics=["duration", "distance"]
+        )
+
+    pares = [(origenes, destinos) for origenes in bloques for destinos in bloques]
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix="ors-matriz") as pool:
+        respuestas = list(pool.map(lambda par: pedir_bloque(*par), pares))
+
+    duraciones = np.full((n, n), np.nan)
+    distancias = np.full((n, n), np.nan)
+    for (origenes, destinos), respuesta in zip(pares, respuestas):
+        bloque = np.ix_(origenes, destinos)
+        duraciones[bloque] = np.array(respuesta["durations"], dtype=float)
+        distancias[bloque] = np.array(respuesta["distances"], dtype=float)
+
+    inalcanzable = 1e9
+    return np.nan_to_num(duraciones, nan=inalcanzable), np.nan_to_num(distancias, nan=inalcanzable)
+
+
+def resolver_ruta_local(coste: np.ndarray, tiempo_maximo_s: float = 2.0) -> List[int]:
+    """
+    Resuelve un problema de camino más corto que visita todos los nodos (TSP abierto) con
+    el nodo 0 como inicio fijo y el último nodo como fin fijo.
+
+    Parámetros:
+    -----------
+    coste : np.ndarray
+        Matriz n x n (no necesariamente simétrica) con el coste de ir de cada nodo a cada otro.
+
+    tiempo_maximo_s : float
+        Presupuesto de tiempo de la fase de mejora.
+
+    Proceso:
+    --------
+    - Construye un camino inicial por inserción más barata.
+    - Lo mejora con movimientos 2-opt y Or-opt (segmentos de 1 a 3 nodos) evaluados de forma
+      vectorizada con NumPy, aplicando en cada iteración el mejor movimiento, hasta que no haya
+      mejora o se agote el tiempo.
+
+    Devuelve:
+    --------
+    List[int]
+        Orden de visita de los nodos, empezando en 0 y terminando en n - 1.
+    """
+    limite = time.perf_counter() + tiempo_maximo_s
+    n = len(coste)
+    if n <= 3:
+        return list(range(n))
+
+    camino = _insercion_mas_barata(coste, [0, n - 1], list(range(1, n - 1)))
+
+    while time.perf_counter() < limite:
+        if _mejorar_2opt(coste, camino) or _mejorar_or_opt(coste, camino):
+            continue
+        break
+
+    return camino
+
+
+def _insercion_mas_barata(coste: np.ndarray, camino: List[int], pendientes: List[int]) -> List[int]:
+    """
+    Inserta los nodos `pendientes` en `camino` eligiendo en cada paso el nodo y la posición de menor coste añadido.
+    """
+    camino = list(camino)
+    pendientes = np.array(pendientes, dtype=int)
+    while len(pendientes):
+        origen, destino = np.array(camino[:-1]), np.array(camino[1:])
+        # incremento[k, p]: coste de insertar el nodo pendiente k entre camino[p] y camino[p + 1]
+        incremento = coste[origen][:, pendientes].T + coste[pendientes][:, destino] - coste[origen, destino]
+        k, p = np.unravel_index(np.argmin(incremento), incremento.shape)
+        camino.insert(p + 1, int(pendientes[k]))
+        pendientes = np.delete(pendientes, k)
+    return camino
+
+
+def _mejorar_2opt(coste: np.ndarray, camino: List[int]) -> bool:
+    """
+    Aplica el mejor movimiento 2-opt (invertir camino[i..j]) si reduce el coste. Tiene en cuenta
+    la asimetría de la matriz al invertir el tramo. Devuelve True si ha mejorado el camino.
+    """
+    p = np.array(camino)
+    m = len(p)
+    if m < 4:
+        return False
+
+    # Costes acumulados del camino en sentido directo e inverso
+    directo = np.concatenate(([0.0], np.cumsum(coste[p[:-1], p[1:]])))
+    inverso = np.concatenate(([0.0], np.cumsum(coste[p[1:], p[:-1]])))
+
+    i = np.arange(1, m - 1)[:, None]
+    j = np.arange(1, m - 1)[None, :]
+    validos = j > i
+    i_b, j_b = np.broadcast_arrays(i, j)
+    i_v, j_v = i_b[validos], j_b[validos]
+
+    delta = (
+        coste[p[i_v - 1], p[j_v]] + coste[p[i_v], p[j_v + 1]]
+        - coste[p[i_v - 1], p[i_v]] - coste[p[j_v], p[j_v + 1]]
+        + (inverso[j_v] - inverso[i_v]) - (directo[j_v] - directo[i_v])
     )
+    if not len(delta):
+        return False
 
-    # Extraer instrucciones legibles
-    instrucciones = []
-    for feature in ruta["features"]:
-        steps = feature["properties"].get("segments", [])[0].get("steps", [])
-        for i, step in enumerate(steps):
-            instrucciones.append(f"{i+1}. {step['instruction']} ({step['distance']:.0f} m)")
+    mejor = np.argmin(delta)
+    if delta[mejor] >= -1e-9:
+        return False
+
+    a, b = int(i_v[mejor]), int(j_v[mejor])
+    camino[a:b + 1] = camino[a:b + 1][::-1]
+    return True
+
+
+def _mejorar_or_opt(coste: np.ndarray, camino: List[int], max_segmento: int = 3) -> bool:
+    """
+    Aplica el mejor movimiento Or-opt (mover un tramo de 1 a `max_segmento` nodos a otra posición)
+    si reduce el coste. Devuelve True si ha mejorado el camino.
+    """
+    p = np.array(camino)
+    m = len(p)
+    mejor = (-1e-9, None)
+
+    for longitud in range(1, max_segmento + 1):
+        for i in range(1, m - longitud):
+            fin = i + longitud - 1
+            if fin >= m - 1:
+                break
+            ahorro = coste[p[i - 1], p[i]] + coste[p[fin], p[fin + 1]] - coste[p[i - 1], p[fin + 1]]
+
+            # Posiciones de inserción: entre p[j] y p[j + 1], fuera del tramo y de sus extremos
+            j = np.arange(m - 1)
+            j = j[(j < i - 1) | (j > fin)]
+            if not len(j):
+                continue
+            incremento = coste[p[j], p[i]] + coste[p[fin], p[j + 1]] - coste[p[j], p[j + 1]]
+            k = np.argmin(incremento)
+            delta = incremento[k] - ahorro
+            if delta < mejor[0]:
+                mejor = (delta, (i, fin, int(j[k])))
+
+    if mejor[1] is None:
+        return False
 
-    return ruta, coords_ordenadas, instrucciones
+    i, fin, j = mejor[1]
+    tramo = camino[i:fin + 1]
+    resto = camino[:i] + camino[fin + 1:]
+    posicion = j + 1 if j < i else j + 1 - len(tramo)
+    camino[:] = resto[:posicion] + tramo + resto[posicion:]
+    return True
 
 
-def obtener_coordenadas_desde_nombre(nombre_lugar: str):
+def obtener_coordenadas_desde_nombre(nombre_lugar: str, usar_cache: bool = True):
     """
     Obtiene las coordenadas [longitud, latitud] de un lugar a partir de su dirección,
     usando el servicio de geocodificación de OpenStreetMap (Nominatim).
 
+    Los resultados se guardan en una caché persistente (`cache_geocodificacion`) compartida entre
+    sesiones y procesos, con la dirección normalizada (mayúsculas, espacios, tildes y signos de
+    puntuación) como clave. Las direcciones no encontradas también se guardan, con un TTL más corto;
+    los errores de red no se guardan.
+
     Parámetros
     ----------
     nombre_lugar : str
         Dirección del lugar (Calle, Número, Ciudad, Provincia, País).
 
+    usar_cache : bool
+        Si es False, se consulta siempre a Nominatim (y se actualiza la caché).
+
     Devuelve
     -------
     list [lng, lat] o None
@@ -259,38 +3843,85 @@ def obtener_coordenadas_desde_nombre(nombre_lugar: str):
         o None si no se encuentra el lugar.
     """
 
+    clave = _normalizar_direccion(nombre_lugar)
+    if usar_cache:
+        en_cache = cache_geocodificacion.obtener(clave)
+        if en_cache is not None:
+            return en_cache["coords"]
+
     url = "https://nominatim.openstreetmap.org/search"
     params = {
         "q": nombre_lugar,
         "format": "json",
         "limit": 1
     }
-    headers = {
-        "User-Agent": "PlanificadorDeRutasApp/1.0 (maria.martinez135@alu.uclm.es)"  # requerido por Nominatim
-    }
 
     try:
-        response = requests.get(url, params=params, headers=headers)
+        limitador_nominatim.esperar()  # máximo 1 petición/s entre todos los hilos del proceso
+        response = obtener_sesion_http("nominatim").get(
+            url, params=params, timeout=(TIMEOUT_CONEXION, TIMEOUT_LECTURA)
+        )
         response.raise_for_status()
         data = response.json()
 
         if not data:
+            cache_geocodificacion.guardar(clave, {"coords": None}, ttl_segundos=CACHE_GEOCODIFICACION_TTL_NEGATIVO)
             return None
 
         lat = float(data[0]["lat"])
         lon = float(data[0]["lon"])
+        cache_geocodificacion.guardar(clave, {"coords": [lon, lat]})
         return [lon, lat]
 
     except Exception as e:
         print(f"Error al obtener coordenadas para '{nombre_lugar}': {e}")
         return None
-    
+
+
+def _normalizar_direccion(direccion: str) -> str:
+    """
+    Normaliza una dirección para la caché de geocodificación ("C/ Mayor,  5" y "c/ mayor 5" dan la misma clave).
+    """
+    return " ".join(re.sub(r"[^\w]+", " ", _normalizar_texto(direccion)).split())
+
+
+# Callback de `FastMarkerCluster`: crea en el navegador el marcador numerado de cada fila
+# [lat, lng, número, color, nombre, dirección]. Los textos se insertan como texto, no como HTML.
+_CALLBACK_MARCADOR_JS = """
+function (row) {
+    var icono = L.divIcon({
+        className: 'empty',
+        iconSize: [30, 30],
+        iconAnchor: [15, 15],
+        html: '<div style="font-size:12pt;color:white;background:' + row[3] + ';border-radius:50%;'
+            + 'width:30px;height:30px;text-align:center;line-height:30px;">' + row[2] + '</div>'
+    });
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icono});
+
+    var titulo = document.createElement('b');
+    titulo.textContent = row[2] + '. ' + row[4];
+    var popup = document.createElement('div');
+    popup.appendChild(titulo);
+    popup.appendChild(document.createElement('br'));
+    popup.appendChild(document.createTextNode(row[5]));
+    marker.bindPopup(popup);
+
+    var tooltip = document.createElement('span');
+    tooltip.textContent = row[2] + '. ' + row[4];
+    marker.bindTooltip(tooltip);
+    return marker;
+}
+"""
 
 
 def generar_mapa_ruta(
     ruta: Dict,
     coords_ordenadas: List[List[float]],
-    df_lugares: pd.DataFrame
+    df_lugares: pd.DataFrame,
+    simplificar: bool = True,
+    capa_detalle: bool = False,
+    pixeles_tolerancia: float = 1.0,
+    modo_marcadores: Literal["auto", "individual", "ligero"] = "auto"
 ):
     """
     Genera un mapa interactivo con la ruta optimizada entre varios lugares,
@@ -310,10 +3941,29 @@ def generar_mapa_ruta(
         DataFrame con los lugares validados a visitar, que debe contener al menos las columnas:
          'Nombre', 'Dirección', 'Lat', 'Lng'.
 
+    simplificar : bool, opcional
+        Si es True (por defecto), la línea de la ruta se simplifica antes de dibujarla
+        (ver `simplificar_geometria_ruta`), lo que reduce mucho el tamaño del HTML en rutas largas.
+
+    capa_detalle : bool, opcional
+        Si es True, añade además la ruta a resolución completa en una capa oculta que puede
+        activarse desde el control de capas para ver el trazado exacto con mucho zoom.
+
+    pixeles_tolerancia : float, opcional
+        Desviación máxima, en píxeles de pantalla, de la línea simplificada respecto a la original.
+
+    modo_marcadores : {"auto", "individual", "ligero"}, opcional
+        - "individual" : un `folium.Marker` con su icono, popup y tooltip HTML por parada.
+        - "ligero"     : todas las paradas como una única lista de datos que un callback JavaScript
+                         convierte en marcadores agrupados (`FastMarkerCluster`) en el navegador.
+        - "auto"       : "ligero" a partir de `MAX_MARCADORES_INDIVIDUALES` puntos (por defecto).
+
     Comportamiento:
     ---------------
     - El mapa se centra en el primer punto del recorrido.
-    - Dibuja la ruta en rojo usando geometría GeoJSON.
+    - Dibuja la ruta en rojo usando geometría GeoJSON (simplificada, salvo que se indique lo contrario).
+      El objeto `ruta` no se modifica: las instrucciones, las distancias y el chat siguen usando la original.
+    - En `mapa.informe_simplificacion` deja el número de vértices y los bytes de la ruta dibujada antes y después.
     - Coloca marcadores numerados en todos los puntos de la ruta.
     - Usa colores diferenciados según el tipo de punto:
         * Rosa (#FF69B4) → Inicio y fin son el mismo punto.
@@ -322,7 +3972,8 @@ def generar_mapa_ruta(
         * Azul  (#007BFF) → Puntos intermedios.
     - Muestra información contextual (nombre y dirección) si el punto se encuentra en el DataFrame de lugares.
     - Incluye un control de capas para alternar la visibilidad de los marcadores y la ruta.
-    - No usa agrupadores de marcadores (`MarkerCluster`).
+    - Con muchas paradas, los marcadores se agrupan y se dibujan en el navegador (ver `modo_marcadores`),
+      de modo que el tamaño del HTML y el tiempo de construcción crecen poco con el número de paradas.
 
     Devuelve:
     --------
@@ -347,12 +3998,19 @@ def generar_mapa_ruta(
     capa_ruta = FeatureGroup(name="Ruta (línea roja)", show=True)
     capa_marcadores = FeatureGroup(name="Lugares a visitar", show=True)
 
-    # Decidir si usar MarkerCluster según número de puntos
-    if len(coords_ordenadas) > 30:
-        marker_container = folium.plugins.MarkerCluster() 
-        marker_container.add_to(capa_marcadores)  # añadir el cluster a la capa
-    else:             
-        marker_container = capa_marcadores
+    # Índice de los lugares por coordenadas redondeadas: cada punto de la ruta se busca en O(1)
+    lat_lugares = pd.to_numeric(df_lugares["Lat"], errors="coerce").round(6)
+    lng_lugares = pd.to_numeric(df_lugares["Lng"], errors="coerce").round(6)
+    indice_lugares = {}
+    for clave, nombre_lugar, direccion_lugar in zip(
+        zip(lat_lugares.tolist(), lng_lugares.tolist()), df_lugares["Nombre"].tolist(), df_lugares["Dirección"].tolist()
+    ):
+        indice_lugares.setdefault(clave, (nombre_lugar, direccion_lugar))  # como antes, gana el primero
+
+    # Decidir el tipo de capa de marcadores según número de puntos
+    if modo_marcadores == "auto":
+        modo_marcadores = "ligero" if len(coords_ordenadas) > MAX_MARCADORES_INDIVIDUALES else "individual"
+    filas_marcadores = []  # modo ligero: [lat, lng, número, color, nombre, dirección] por parada
 
     # Iterar por cada punto de la ruta
     for i, (lon, lat) in enumerate(coords_ordenadas):
@@ -364,10 +4022,7 @@ def generar_mapa_ruta(
             continue
 
         # Buscar si el punto está en los lugares reconocidos
-        lugar = df_lugares[
-            (df_lugares["Lat"].round(6) == round(lat, 6)) &
-            (df_lugares["Lng"].round(6) == round(lon, 6))
-        ]
+        lugar = indice_lugares.get((float(np.round(lat, 6)), float(np.round(lon, 6))))  # mismo redondeo que el índice
 
         # Determinar color del marcador
         if mismo_punto and es_inicio:
@@ -388,9 +4043,12 @@ def generar_mapa_ruta(
             direccion = ""
 
         # Si hay lugar reconocido, actualizar info
-        if not lugar.empty:
-            nombre = lugar.iloc[0]["Nombre"]
-            direccion = lugar.iloc[0]["Dirección"]
+        if lugar is not None:
+            nombre, direccion = lugar
+
+        if modo_marcadores == "ligero":
+            filas_marcadores.append([lat, lon, i + 1, color, str(nombre), str(direccion)])
+            continue
 
         # Crear marcador con número circular
         folium.Marker(
@@ -411,11 +4069,28 @@ def generar_mapa_ruta(
             ),
             popup=f"<b>{i+1}. {nombre}</b><br>{direccion}",
             tooltip=f"{i+1}. {nombre}"
-        ).add_to(marker_container)
+        ).add_to(capa_marcadores)
+
+    # Modo ligero: los marcadores (mismo aspecto) los crea el navegador a partir de los datos
+    if modo_marcadores == "ligero":
+        FastMarkerCluster(
+            filas_marcadores,
+            callback=_CALLBACK_MARCADOR_JS,
+            control=False,
+            disableClusteringAtZoom=16
+        ).add_to(capa_marcadores)
+
+    # Dibujar la ruta en color rojo usando GeoJSON (simplificada para el nivel de zoom)
+    if simplificar:
+        ruta_dibujo, informe = simplificar_geometria_ruta(ruta, pixeles_tolerancia=pixeles_tolerancia, zoom_minimo=13)
+    else:
+        ruta_dibujo = ruta
+        bytes_ruta = len(json.dumps(ruta, separators=(",", ":")))
+        informe = {"bytes_antes": bytes_ruta, "bytes_despues": bytes_ruta}
+    mapa.informe_simplificacion = informe
 
-    # Dibujar la ruta en color rojo usando GeoJSON
     folium.GeoJson(
-        ruta,
+        ruta_dibujo,
         name="Ruta",
         style_function=lambda x: {"color": "red", "weight": 4, "opacity": 0.8}
     ).add_to(capa_ruta)
@@ -424,7 +4099,201 @@ def generar_mapa_ruta(
     capa_ruta.add_to(mapa)
     capa_marcadores.add_to(mapa)
 
+    if simplificar and capa_detalle:
+        capa_completa = FeatureGroup(name="Ruta (resolución completa)", show=False)
+        folium.GeoJson(
+            ruta,
+            name="Ruta completa",
+            style_function=lambda x: {"color": "darkred", "weight": 3, "opacity": 0.8}
+        ).add_to(capa_completa)
+        capa_completa.add_to(mapa)
+
     # Añadir control de capas para visibilidad
     folium.LayerControl(collapsed=False).add_to(mapa)
 
     return mapa
+
+
+def simplificar_geometria_ruta(
+    ruta: Dict,
+    pixeles_tolerancia: float = 1.0,
+    zoom: Optional[int] = None,
+    zoom_minimo: int = 0,
+    zoom_maximo: int = 18,
+    ancho_px: int = 1000,
+    alto_px: int = 600
+) -> tuple:
+    """
+    Devuelve una copia de la ruta GeoJSON con las líneas simplificadas (Douglas-Peucker) para dibujarla.
+
+    Parámetros:
+    -----------
+    ruta : Dict
+        Ruta GeoJSON de ORS. No se modifica.
+
+    pixeles_tolerancia : float, opcional
+        Desviación máxima permitida, en píxeles, al nivel de zoom elegido.
+
+    zoom : int, opcional
+        Nivel de zoom para el que se simplifica. Si no se indica, el que encuadra toda la ruta
+        (su bbox) en un mapa de `ancho_px` x `alto_px`, limitado a [`zoom_minimo`, `zoom_maximo`].
+        Con `zoom_minimo` igual al zoom inicial del mapa, la línea es exacta (a `pixeles_tolerancia`)
+        en la vista inicial aunque la ruta no quepa en ella.
+
+    Proceso:
+    --------
+    - Calcula la tolerancia en grados a partir del tamaño de un píxel (Web Mercator) en ese zoom.
+    - Simplifica cada LineString con `_simplificar_linea` en coordenadas locales (longitud escalada
+      por el coseno de la latitud, para que la tolerancia sea la misma en ambos ejes).
+    - La copia solo conserva de las propiedades el resumen (distancia y duración): los pasos de las
+      instrucciones no se dibujan y solo aumentarían el tamaño del mapa.
+
+    Devuelve:
+    --------
+    tuple:
+        ruta_simplificada : Dict
+            FeatureCollection lista para `folium.GeoJson`.
+        informe : Dict
+            'zoom', 'tolerancia_m', 'vertices_antes', 'vertices_despues', 'bytes_antes' y 'bytes_despues'.
+    """
+    lineas = [
+        np.asarray(feature["geometry"]["coordinates"], dtype=float)
+        for feature in ruta.get("features", [])
+        if feature.get("geometry", {}).get("type") == "LineString" and feature["geometry"].get("coordinates")
+    ]
+    bytes_antes = len(json.dumps(ruta, separators=(",", ":")))
+    if not lineas:
+        return ruta, {"zoom": zoom, "tolerancia_m": 0.0, "vertices_antes": 0, "vertices_despues": 0,
+                      "bytes_antes": bytes_antes, "bytes_despues": bytes_antes}
+
+    todos = np.concatenate([linea[:, :2] for linea in lineas])
+    lng_min, lat_min = todos.min(axis=0)
+    lng_max, lat_max = todos.max(axis=0)
+    coseno = np.cos(np.radians((lat_min + lat_max) / 2))
+
+    # Zoom que encuadra la ruta: en Web Mercator, un grado de longitud ocupa 256 * 2^z / 360 píxeles
+    if zoom is None:
+        zoom_x = np.log2(ancho_px * 360 / (256 * max(lng_max - lng_min, 1e-9)))
+        zoom_y = np.log2(alto_px * 360 * coseno / (256 * max(lat_max - lat_min, 1e-9)))
+        zoom = int(np.clip(np.floor(min(zoom_x, zoom_y)), zoom_minimo, zoom_maximo))
+
+    # Tamaño de un píxel en grados de latitud (y de longitud escalada por el coseno)
+    tolerancia = pixeles_tolerancia * 360 / (256 * 2 ** zoom) * coseno
+
+    features = []
+    vertices_despues = 0
+    for feature in ruta.get("features", []):
+        geometria = feature.get("geometry", {})
+        if geometria.get("type") == "LineString" and geometria.get("coordinates"):
+            linea = np.asarray(geometria["coordinates"], dtype=float)
+            locales = np.column_stack([linea[:, 0] * coseno, linea[:, 1]])
+            conservar = _simplificar_linea(locales, tolerancia)
+            geometria = {"type": "LineString", "coordinates": linea[conservar, :2].tolist()}
+            vertices_despues += int(conservar.sum())
+        features.append({
+            "type": "Feature",
+            "properties": {"summary": feature.get("properties", {}).get("summary", {})},
+            "geometry": geometria
+        })
+
+    ruta_simplificada = {"type": "FeatureCollection", "features": features}
+    return ruta_simplificada, {
+        "zoom": zoom,
+        "tolerancia_m": float(tolerancia * 111320),
+        "vertices_antes": int(sum(len(linea) for linea in lineas)),
+        "vertices_despues": vertices_despues,
+        "bytes_antes": bytes_antes,
+        "bytes_despues": len(json.dumps(ruta_simplificada, separators=(",", ":")))
+    }
+
+
+def _simplificar_linea(puntos: np.ndarray, tolerancia: float) -> np.ndarray:
+    """
+    Douglas-Peucker iterativo: devuelve la máscara de los vértices que se conservan. Las distancias de
+    todos los puntos de cada tramo a su segmento se calculan de una vez con NumPy.
+    """
+    n = len(puntos)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[[0, n - 1]] = True
+
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j - i < 2:
+            continue
+        a, b = puntos[i], puntos[j]
+        tramo = puntos[i + 1:j]
+        ab = b - a
+        longitud2 = ab @ ab
+        if longitud2 == 0:
+            distancias = np.hypot(*(tramo - a).T)
+        else:
+            t = np.clip((tramo - a) @ ab / longitud2, 0.0, 1.0)
+            distancias = np.hypot(*(tramo - a - t[:, None] * ab).T)
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            m = i + 1 + k
+            conservar[m] = True
+            pila.append((i, m))
+            pila.append((m, j))
+
+    return conservar
+
+
+def generar_mapa_ruta_html(
+    ruta: Union[Dict, Callable[[], Dict]],
+    coords_ordenadas: List[List[float]],
+    df_lugares: pd.DataFrame,
+    clave_ruta: Optional[str] = None
+) -> str:
+    """
+    Devuelve el HTML completo del mapa de `generar_mapa_ruta`, reutilizando el ya generado para la
+    misma ruta y los mismos lugares.
+
+    `ruta` puede ser el GeoJSON o una función que lo devuelva (por ejemplo, `RutaCompacta.a_geojson`).
+    Si además se indica `clave_ruta` (por ejemplo, `RutaCompacta.huella`), la ruta no se hashea y la
+    función solo se llama cuando el mapa no está en caché.
+
+    Pensado para las páginas de Streamlit: en cada rerun que no cambia la ruta el mapa no se vuelve
+    a construir ni a serializar. La caché (`cache_mapas`) es del proceso, compartida entre sesiones,
+    y está limitada en número de mapas y en bytes. Cualquier cambio en la ruta, en el orden de visita
+    o en el nombre, la dirección o las coordenadas de los lugares produce otra huella (ver `huella_mapa`).
+
+    Devuelve:
+    --------
+    str
+        Documento HTML del mapa, listo para `streamlit.components.v1.html`.
+    """
+    if callable(ruta) and clave_ruta is None:
+        ruta = ruta()
+    obtener_ruta = ruta if callable(ruta) else (lambda: ruta)
+
+    return cache_mapas.obtener_o_calcular(
+        huella_mapa(ruta, coords_ordenadas, df_lugares, clave_ruta),
+        lambda: generar_mapa_ruta(obtener_ruta(), coords_ordenadas, df_lugares).get_root().render()
+    )
+
+
+def huella_mapa(
+    ruta: Optional[Dict],
+    coords_ordenadas: List[List[float]],
+    df_lugares: pd.DataFrame,
+    clave_ruta: Optional[str] = None
+) -> str:
+    """
+    Huella barata de todo lo que se dibuja en el mapa: la geometría de la ruta, el orden de visita y
+    el nombre, la dirección y las coordenadas de los lugares.
+
+    Si se indica `clave_ruta` (una huella ya calculada de la geometría y las paradas, como
+    `RutaCompacta.huella`), se usa en lugar de recorrer la geometría y `ruta` no se consulta.
+    """
+    huella = hashlib.sha256()
+    if clave_ruta is not None:
+        huella.update(f"ruta|{clave_ruta}".encode())
+    else:
+        huella.update(json.dumps(coords_ordenadas, separators=(",", ":")).encode())
+        for feature in ruta.get("features", []):
+            huella.update(np.asarray(feature.get("geometry", {}).get("coordinates", []), dtype=float).tobytes())
+    columnas = [c for c in ["Nombre", "Dirección", "Lat", "Lng"] if c in df_lugares.columns]
+    huella.update(pd.util.hash_pandas_object(df_lugares[columnas].astype(str), index=False).values.tobytes())
+    return huella.hexdigest()
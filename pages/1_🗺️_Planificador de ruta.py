@@ -1,37 +1,67 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from streamlit_folium import st_folium
+import streamlit.components.v1 as components
 import hashlib
 from functions import (
-    buscar_lugares,
+    buscar_lugares_por_lotes,
     obtener_ruta_optimizada,
+    comparar_perfiles,
+    actualizar_ruta_incremental,
+    huella_ruta,
     obtener_coordenadas_desde_nombre,
-    generar_mapa_ruta
+    obtener_isocrona,
+    generar_mapa_ruta_html,
+    almacen_rutas,
+    resolver_propietario,
+    RutaCompacta,
+    MemoriaRutasSesion
 )
 
+# Tiempo máximo (en segundos) que se dedica a buscar y validar lugares
+PLAZO_BUSQUEDA_SEGUNDOS = 60
+
+# A partir de este número de paradas la ruta se optimiza con el motor local en lugar del servicio de ORS
+MAX_PARADAS_OPTIMIZACION_ORS = 50
+
+# Si al reeditar la selección cambian como mucho estas paradas (o este porcentaje), la ruta anterior se actualiza
+# de forma incremental en lugar de optimizarse de nuevo desde cero
+MIN_CAMBIOS_INCREMENTAL = 3
+PORCENTAJE_CAMBIOS_INCREMENTAL = 0.2
+
 st.set_page_config(page_title="Planificador de Ruta", layout="wide")
 st.title("🗓️ Planificador de Ruta")
 
 # ----------- Inicialización de estado  -----------
 for key in ["df_lugares", "df_filtrado", "df_editado",
-            "ruta", "coords_ordenadas", "instrucciones", 
             "seleccion_confirmada", "busqueda_realizada", 
-            "tipo_lugar", "direccion_central", "origen", "destino"]:
+            "tipo_lugar", "direccion_central", "origen", "destino",
+            "ruta_anterior", "comparacion_perfiles"]:
     if key not in st.session_state:
         st.session_state[key] = None  #si no exite lo inicializa como None
 
 st.session_state.seleccion_confirmada = st.session_state.seleccion_confirmada or False  #si es True, se mantiene; si era None (o cualquier valor falsy), pasa a False
 st.session_state.busqueda_realizada = st.session_state.busqueda_realizada or False      #si es True, se mantiene; si era None (o cualquier valor falsy), pasa a False
 
+# La ruta calculada se guarda compactada (RutaCompacta) en la memoria de rutas de la sesión, con presupuesto propio
+if "rutas_sesion" not in st.session_state:
+    st.session_state.rutas_sesion = MemoriaRutasSesion()
+
+# Identificador del navegador: cada usuario solo ve su propio historial (se conserva en la URL al recargar)
+st.session_state.propietario = resolver_propietario(
+    st.session_state.get("propietario"), st.query_params.get("usuario")
+)
+st.query_params["usuario"] = st.session_state.propietario
+
 # ----------- Formulario de búsqueda -----------
 with st.form("form_planificador"):
     st.subheader("🔍 Parámetros de búsqueda")
 
     st.text_input(
         "**¿Qué tipo de lugar deseas visitar?** (obligatorio)",
-        placeholder="Ej: taller de chapa o mecánica de automóviles",
+        placeholder="Ej: taller de chapa o mecánica de automóviles; gasolinera; recambios",
         key="tipo_lugar",
+        help="Para buscar varios tipos de lugar a la vez, sepáralos con punto y coma (;).",
     )
 
     st.text_input(
@@ -43,6 +73,20 @@ with st.form("form_planificador"):
     st.slider("**Radio de búsqueda (en km)**", 1, 500, 10, step=5, key="radio_km")
     radio_busqueda = st.session_state.get("radio_km", 10) * 1000
 
+    st.number_input(
+        "**Número máximo de lugares**",
+        min_value=10, max_value=500, value=100, step=10,
+        key="max_lugares",
+        help="La búsqueda se detiene al encontrar este número de lugares válidos.",
+    )
+
+    st.number_input(
+        "**Tiempo máximo desde el punto de inicio (en minutos)** (opcional)",
+        min_value=0, max_value=60, value=0, step=5,
+        key="tiempo_alcance_min",
+        help="Descarta antes de validarlos los lugares a los que no se llega en este tiempo con el modo de transporte elegido. 0 = sin límite.",
+    )
+
     col1, col2 = st.columns(2)
     with col1:
         st.text_input(
@@ -79,17 +123,25 @@ with st.form("form_planificador"):
         st.session_state.get("modo_seleccionado", list(opciones_transporte.keys())[0])
     ]
 
+    st.multiselect(
+        "**Comparar con otros modos de transporte** (opcional)",
+        list(opciones_transporte.keys()),
+        key="modos_comparar",
+        help="Calcula a la vez la ruta con los modos elegidos y muestra una tabla comparativa de distancia y tiempo.",
+    )
+    perfiles_comparar = [opciones_transporte[m] for m in st.session_state.get("modos_comparar", [])]
+
     submitted = st.form_submit_button("🔍 Buscar lugares y continuar")
 
 # ----------- Botón para limpiar búsqueda -----------
 if st.button("🧹 Limpiar búsqueda"):
     # Borrar los valores de los widgets del formulario de búsqueda
-    for k in ["tipo_lugar", "direccion_central", "radio_km", "origen", "destino", "fecha", "hora", "modo_seleccionado"]:
+    for k in ["tipo_lugar", "direccion_central", "radio_km", "max_lugares", "tiempo_alcance_min", "origen", "destino", "fecha", "hora", "modo_seleccionado", "modos_comparar"]:
         if k in st.session_state:
             del st.session_state[k]
 
     # Borrar datos de resultados asociados
-    for k in ["df_lugares", "df_filtrado", "ruta", "coords_ordenadas", "instrucciones", "busqueda_realizada", "seleccion_confirmada", "editor_lugares"]:
+    for k in ["df_lugares", "df_filtrado", "ruta", "coords_ordenadas", "instrucciones", "busqueda_realizada", "seleccion_confirmada", "editor_lugares", "ruta_anterior", "comparacion_perfiles"]:
         if k in st.session_state:
             del st.session_state[k]
 
@@ -108,15 +160,40 @@ if submitted:
         with st.spinner("Buscando lugares..."):
             coords_centro = obtener_coordenadas_desde_nombre(st.session_state.direccion_central) #obtine las coordenadas (lat, lng) de la dirección de búsqueda
 
+            # Zona alcanzable desde el inicio en el tiempo indicado (se pide una sola vez y queda en caché)
+            isocrona = None
+            if st.session_state.tiempo_alcance_min:
+                coords_origen = obtener_coordenadas_desde_nombre(st.session_state.origen)
+                if coords_origen:
+                    isocrona = obtener_isocrona(coords_origen, modo_transporte, st.session_state.tiempo_alcance_min * 60)
+                if not isocrona:
+                    st.warning("⚠️ No se pudo calcular la zona alcanzable desde el punto de inicio; se buscará sin límite de tiempo.")
+                    isocrona = None
+
             if not coords_centro:
                 st.error("❌ No se pudo obtener las coordenadas de la dirección de búsqueda proporcionada.")
             else:
-                df_lugares = buscar_lugares(
-                    query=st.session_state.tipo_lugar,
+                # Los lugares validados se muestran a medida que llegan los lotes
+                tabla_progreso = st.empty()
+                lotes = []
+                for lote in buscar_lugares_por_lotes(
+                    query=[q.strip() for q in st.session_state.tipo_lugar.split(";") if q.strip()],  # uno o varios tipos de lugar
                     radius=radio_busqueda,
                     latitude=coords_centro[1],
-                    longitude=coords_centro[0]
-                )
+                    longitude=coords_centro[0],
+                    max_resultados=st.session_state.max_lugares,
+                    plazo_segundos=PLAZO_BUSQUEDA_SEGUNDOS,
+                    modo_busqueda="teselado",  # cubre todo el radio aunque haya más de 50 lugares
+                    isocrona=isocrona
+                ):
+                    lotes.append(lote)
+                    tabla_progreso.dataframe(
+                        pd.concat(lotes, ignore_index=True).drop(columns=["ID", "Web", "Validado por"], errors="ignore"),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+                tabla_progreso.empty()
+                df_lugares = pd.concat(lotes, ignore_index=True) if lotes else pd.DataFrame()
 
                 if df_lugares.empty:
                     st.warning("⚠️ No se encontraron lugares válidos.")
@@ -125,7 +202,8 @@ if submitted:
                     st.session_state.df_lugares = df_lugares
                     st.session_state.df_lugares["Seleccionado"] = False  #añade columna inicializada a False
                     st.session_state.df_filtrado = None
-                    st.session_state.ruta = None
+                    st.session_state.rutas_sesion.eliminar("actual")
+                    st.session_state.ruta_anterior = None
                     st.session_state.seleccion_confirmada = False
                     st.session_state.busqueda_realizada = True
 
@@ -136,9 +214,7 @@ if st.session_state.busqueda_realizada:
     if st.session_state.seleccion_confirmada:   
         if st.button("🔁 Volver a editar selección"):
             st.session_state.seleccion_confirmada = False
-            st.session_state.ruta = None
-            st.session_state.instrucciones = None
-            st.session_state.coords_ordenadas = None
+            st.session_state.rutas_sesion.eliminar("actual")
 
     # --- Muestra la interfaz de selección si hay un DataFrame de lugares cargado (df_lugares) y el usuario aún no ha confirmado su selección ---
     if (
@@ -159,11 +235,11 @@ if st.session_state.busqueda_realizada:
             st.session_state.df_lugares,
             use_container_width=True,
             key="editor_lugares",
-            column_order=[c for c in df_lugares.columns if c not in ["ID", "Web"]], #"ID" y "Web" se ocultan para simplificar la vista
+            column_order=[c for c in df_lugares.columns if c not in ["ID", "Web", "Validado por"]], #"ID", "Web" y "Validado por" se ocultan para simplificar la vista
             column_config={
                 "Seleccionado": st.column_config.CheckboxColumn(label="¿Incluir?", default=False)
             },
-            disabled=["Nombre", "Dirección", "Categoría", "Lat", "Lng", "Teléfono"],
+            disabled=["Nombre", "Dirección", "Categoría", "Lat", "Lng", "Teléfono", "Búsqueda"],
             hide_index=True
         )
 
@@ -206,6 +282,8 @@ if st.session_state.busqueda_realizada:
                             "Lng": nueva_lng,
                             "Teléfono": nuevo_tel or "No disponible",
                             "Web": nueva_web or "No disponible",
+                            "Validado por": "manual",
+                            "Búsqueda": "manual",
                             "Seleccionado": True
                         }
                         df_nuevo = pd.DataFrame([nuevo])
@@ -240,17 +318,70 @@ if st.session_state.busqueda_realizada:
                 if destino_guardado and not punto_final:
                     st.warning("⚠️ No se pudo obtener coordenadas del punto de fin.")
 
+                # Diferencias con la última ruta calculada (mismo perfil, inicio y fin) para poder actualizarla sin recalcularla
+                anterior = st.session_state.ruta_anterior
+                anadidos, eliminados = None, None
+                if anterior and (anterior["perfil"], anterior["inicio"], anterior["fin"]) == (modo_transporte, punto_inicio, punto_final):
+                    paradas_previas = anterior["coords"][1:len(anterior["coords"]) - (1 if punto_final else 0)]
+                    claves_previas = {(round(lng, 6), round(lat, 6)) for lng, lat in paradas_previas}
+                    coords_lugares = st.session_state.df_filtrado[["Lng", "Lat"]].values.tolist()
+                    claves_actuales = {(round(lng, 6), round(lat, 6)) for lng, lat in coords_lugares}
+                    anadidos = [c for c in coords_lugares if (round(c[0], 6), round(c[1], 6)) not in claves_previas]
+                    eliminados = [c for c in paradas_previas if (round(c[0], 6), round(c[1], 6)) not in claves_actuales]
+                    max_cambios = max(MIN_CAMBIOS_INCREMENTAL, PORCENTAJE_CAMBIOS_INCREMENTAL * len(paradas_previas))
+                    if len(anadidos) + len(eliminados) > max_cambios:
+                        anadidos, eliminados = None, None
+
+                # Con otros modos que comparar, todas las rutas se calculan a la vez (la principal incluida)
+                perfiles_extra = [p for p in perfiles_comparar if p != modo_transporte]
+                if perfiles_extra:
+                    anadidos, eliminados = None, None
+
                 with st.spinner("Calculando ruta optimizada..."):
                     try:
-                        ruta, coords_ordenadas, instrucciones = obtener_ruta_optimizada(
-                            st.session_state.df_filtrado,
-                            punto_inicio=punto_inicio,
-                            punto_final=punto_final,
-                            profile=modo_transporte
+                        st.session_state.comparacion_perfiles = None
+                        if perfiles_extra:
+                            comparacion, rutas = comparar_perfiles(
+                                st.session_state.df_filtrado,
+                                [modo_transporte] + perfiles_extra,
+                                punto_inicio=punto_inicio,
+                                punto_final=punto_final,
+                                motor="local" if len(st.session_state.df_filtrado) > MAX_PARADAS_OPTIMIZACION_ORS else "ors"
+                            )
+                            if modo_transporte not in rutas:
+                                raise RuntimeError(comparacion.set_index("Perfil").loc[modo_transporte, "Error"])
+                            ruta, coords_ordenadas, instrucciones = rutas[modo_transporte]
+                            nombres_modos = {v: k for k, v in opciones_transporte.items()}
+                            comparacion["Perfil"] = comparacion["Perfil"].map(nombres_modos)
+                            st.session_state.comparacion_perfiles = comparacion
+                        elif anadidos is not None:
+                            ruta, coords_ordenadas, instrucciones = actualizar_ruta_incremental(
+                                anterior["coords"],
+                                profile=modo_transporte,
+                                punto_inicio=punto_inicio,
+                                punto_final=punto_final,
+                                anadidos=anadidos,
+                                eliminados=eliminados
+                            )
+                        else:
+                            ruta, coords_ordenadas, instrucciones = obtener_ruta_optimizada(
+                                st.session_state.df_filtrado,
+                                punto_inicio=punto_inicio,
+                                punto_final=punto_final,
+                                profile=modo_transporte,
+                                # El servicio de optimización de ORS limita el número de trabajos: con muchas paradas se resuelve localmente
+                                motor="local" if len(st.session_state.df_filtrado) > MAX_PARADAS_OPTIMIZACION_ORS else "ors"
+                            )
+                        st.session_state.rutas_sesion.guardar(
+                            "actual",
+                            RutaCompacta.crear(ruta, coords_ordenadas, instrucciones, perfil=modo_transporte)
                         )
-                        st.session_state.ruta = ruta
-                        st.session_state.coords_ordenadas = coords_ordenadas
-                        st.session_state.instrucciones = instrucciones
+                        st.session_state.ruta_anterior = {
+                            "coords": coords_ordenadas,
+                            "perfil": modo_transporte,
+                            "inicio": punto_inicio,
+                            "fin": punto_final
+                        }
                         st.session_state.seleccion_confirmada = True
                         st.success("✅ Ruta optimizada generada correctamente.")
                     except Exception as e:
@@ -259,61 +390,81 @@ if st.session_state.busqueda_realizada:
             st.info("Selecciona al menos un lugar para continuar.")
 
 # ----------- Mostrar mapa e instrucciones si hay ruta confirmada -----------
+ruta_actual = st.session_state.rutas_sesion.obtener("actual")
 if (
     st.session_state.seleccion_confirmada
-    and st.session_state.ruta is not None
-    and st.session_state.coords_ordenadas is not None
+    and ruta_actual is not None
     and st.session_state.df_filtrado is not None
     and not st.session_state.df_filtrado.empty
 ):
     st.markdown("## 🗺️ Mapa de la ruta optimizada")
-    mapa = generar_mapa_ruta(
-        st.session_state.ruta,
-        st.session_state.coords_ordenadas,
-        st.session_state.df_filtrado
+    # El HTML del mapa se reutiliza entre reruns mientras no cambien la ruta ni los lugares;
+    # la clave es la huella de la ruta compacta, y el GeoJSON solo se reconstruye si hay que dibujar el mapa
+    mapa_html = generar_mapa_ruta_html(
+        ruta_actual.a_geojson,
+        ruta_actual.coords,
+        st.session_state.df_filtrado,
+        clave_ruta=ruta_actual.huella
     )
-    st_folium(mapa, width=1000, height=600)
+    components.html(mapa_html, width=1000, height=600)
       
-    resumen = st.session_state.ruta['features'][0]['properties']['summary']# viene del resultado de OpenRouteService
-    distancia_km = resumen["distance"] / 1000   # metros -> km
-    duracion_min = resumen["duration"] / 60 # segundos -> min
+    distancia_km = ruta_actual.distancia_km  # del resumen de OpenRouteService
+    duracion_min = ruta_actual.duracion_min
     st.metric("Distancia total", f"{distancia_km:.2f} km")
     st.metric("Tiempo estimado", f"{duracion_min:.1f} min")
 
+    if st.session_state.comparacion_perfiles is not None:
+        st.markdown("## ⚖️ Comparativa de modos de transporte")
+        st.dataframe(
+            st.session_state.comparacion_perfiles.dropna(axis=1, how="all"),
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Distancia (km)": st.column_config.NumberColumn(format="%.2f"),
+                "Duración (min)": st.column_config.NumberColumn(format="%.1f"),
+            }
+        )
+
     st.markdown("## 🧭 Instrucciones de la ruta")
-    for paso in st.session_state.instrucciones:
+    for paso in ruta_actual.instrucciones:
         st.markdown(f"- {paso}")
 
     # ----------- Guardar ruta -----------
     st.markdown("### 💾 Guardar esta ruta")
     if st.button("💾 Guardar ruta en historial"):
-        if "rutas_guardadas" not in st.session_state:
-            st.session_state.rutas_guardadas = []
-
         nueva_ruta = {
             "lugares": st.session_state.df_filtrado.to_dict(orient="records"),
-            "coords": st.session_state.coords_ordenadas,
-            "instrucciones": st.session_state.instrucciones,
-            "ruta_geojson": st.session_state.ruta,
+            "coords": ruta_actual.coords,
+            "instrucciones": list(ruta_actual.instrucciones),
+            "ruta_geojson": ruta_actual.a_geojson(),
             "fecha_hora": f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
             "origen": st.session_state.get("origen", "No especificado"),
             "destino": st.session_state.get("destino", "No especificado"),
+            "perfil": st.session_state.ruta_anterior["perfil"],
             "distancia_km": distancia_km, 
             "duracion_min": duracion_min   
         }
 
-        # Crear un hash único para detectar duplicados (dos rutas que contienen exactamente los mismos lugares y coordenadas producirán el mismo hash)
-        ruta_str = str(nueva_ruta["lugares"]) + str(nueva_ruta["coords"])   #texto único que representa esa ruta
-        ruta_hash = hashlib.sha256(ruta_str.encode()).hexdigest()           #genera un hash único de 64 caracteres (hexadecimal) usando el algoritmo SHA-256
+        # Huella de la selección para detectar duplicados (mismo perfil, inicio, fin y paradas); es la misma clave que usa la caché de rutas
+        parametros = st.session_state.ruta_anterior
+        ruta_hash = huella_ruta(
+            parametros["perfil"],
+            parametros["inicio"],
+            parametros["fin"],
+            st.session_state.df_filtrado[["Lng", "Lat"]].values.tolist()
+        )
         nueva_ruta["hash"] = ruta_hash
 
-        # Verificar si ya existe una ruta con ese hash
-        hashes_existentes = [ruta.get("hash") for ruta in st.session_state.rutas_guardadas]
-        if ruta_hash in hashes_existentes:
+        # El almacén rechaza la ruta si ya hay otra guardada con ese hash (índice único)
+        if almacen_rutas.guardar(st.session_state.propietario, nueva_ruta) is None:
             st.warning("⚠️ Esta ruta ya ha sido guardada previamente.")
         else:
-            st.session_state.rutas_guardadas.append(nueva_ruta)
             st.success("✅ Ruta guardada correctamente. Puedes consultarla en el Historial.")
 
-
-
+# ----------- Memoria de rutas de la sesión -----------
+memoria = st.session_state.rutas_sesion.estadisticas()
+st.sidebar.caption(
+    f"🧠 Rutas en memoria de la sesión: {memoria['rutas_en_memoria']} "
+    f"({memoria['bytes_en_memoria'] / 1024:.0f} KB de {memoria['max_bytes'] / 1024:.0f} KB) · "
+    f"volcadas a disco: {memoria['rutas_en_disco']}"
+)
@@ -1,41 +1,57 @@
 import streamlit as st
 import pandas as pd
-import os
-from groq import Groq
-from functions import generar_mapa_ruta
+from functions import obtener_cliente_groq, almacen_rutas, MemoriaRutasSesion, resolver_propietario
+
+# Número máximo de rutas (las más recientes) que se ofrecen en el selector
+MAX_RUTAS_SELECTOR = 200
 
 st.set_page_config(page_title="Asistente de Rutas", layout="wide")
 st.title("💬 Chat con el Asistente de Rutas")
 
-if "rutas_guardadas" not in st.session_state or not st.session_state.rutas_guardadas:
+if "rutas_sesion" not in st.session_state:
+    st.session_state.rutas_sesion = MemoriaRutasSesion()
+
+# Identificador del navegador: cada usuario solo ve su propio historial (se conserva en la URL al recargar)
+st.session_state.propietario = resolver_propietario(
+    st.session_state.get("propietario"), st.query_params.get("usuario")
+)
+st.query_params["usuario"] = st.session_state.propietario
+
+# El selector solo necesita el resumen de cada ruta; la ruta completa se carga después por su ID
+resumenes = almacen_rutas.listar_resumen(st.session_state.propietario, limite=MAX_RUTAS_SELECTOR)
+if not resumenes:
     st.info("ℹ️ No tienes rutas guardadas.")
     st.stop()
 
 # -------- Selección de ruta --------
-opciones = [
-    f"Ruta {i+1} - guardada el {ruta['fecha_hora']} ({len(ruta['lugares'])} lugares a visitar)"
-    for i, ruta in enumerate(st.session_state.rutas_guardadas)
-]
-sel_index = st.selectbox("Selecciona una ruta del historial", range(len(opciones)), format_func=lambda i: opciones[i])
+opciones = {
+    ruta["id"]: f"Ruta {ruta['id']} - guardada el {ruta['fecha_hora']} ({ruta['n_lugares']} lugares a visitar)"
+    for ruta in resumenes
+}
+sel_id = st.selectbox("Selecciona una ruta del historial", list(opciones), format_func=lambda i: opciones[i])
 
 # Detectar cambio de ruta seleccionada
-if "ruta_index_actual" not in st.session_state:
-    st.session_state.ruta_index_actual = sel_index
+if "ruta_id_actual" not in st.session_state:
+    st.session_state.ruta_id_actual = sel_id
 
-if sel_index != st.session_state.ruta_index_actual:
+if sel_id != st.session_state.ruta_id_actual:
     st.session_state.chat_messages = []  # Reinicia el chat si cambió de ruta
-    st.session_state.ruta_index_actual = sel_index
+    st.session_state.ruta_id_actual = sel_id
 
-ruta_sel = st.session_state.rutas_guardadas[sel_index]
+ruta_sel = st.session_state.rutas_sesion.cargar_guardada(st.session_state.propietario, sel_id)
+if ruta_sel is None:
+    st.warning("⚠️ La ruta seleccionada ya no existe en el historial.")
+    st.stop()
 
 # -------- Mostrar info de la ruta --------
 st.markdown("### Información de la ruta seleccionada")
-st.markdown(f"**🟢 Inicio:** {ruta_sel.get('origen', 'No especificado')}")
-st.markdown(f"**🔴 Fin:** {ruta_sel.get('destino', 'No especificado')}")
-st.markdown(f"**Distancia total {ruta_sel['distancia_km']:.2f} km**")
-st.markdown(f"**Tiempo estimado {ruta_sel['distancia_km']:.2f} min**")
+st.markdown(f"**🟢 Inicio:** {ruta_sel.origen or 'No especificado'}")
+st.markdown(f"**🔴 Fin:** {ruta_sel.destino or 'No especificado'}")
+st.markdown(f"**Distancia total {ruta_sel.distancia_km:.2f} km**")
+st.markdown(f"**Tiempo estimado {ruta_sel.duracion_min:.2f} min**")
 st.markdown("##### 📍 Lugares a visitar en la ruta")
-df = pd.DataFrame(ruta_sel["lugares"]).drop(columns=["ID", "Web"], errors="ignore")
+df = ruta_sel.lugares_df()
+df = (pd.DataFrame() if df is None else df).drop(columns=["ID", "Web", "Validado por"], errors="ignore")
 st.dataframe(df, use_container_width=True)
 st.markdown("##### Chat")
 
@@ -57,17 +73,17 @@ if prompt := st.chat_input("¿Qué quieres saber sobre esta ruta?"):
     # Contexto
     contexto = (
         "Aquí tienes los datos de la ruta seleccionada:\n"
-        f"- Punto de inicio: {ruta_sel.get('origen', 'No especificado')}\n"
-        f"- Punto de fin: {ruta_sel.get('destino', 'No especificado')}\n"
+        f"- Punto de inicio: {ruta_sel.origen or 'No especificado'}\n"
+        f"- Punto de fin: {ruta_sel.destino or 'No especificado'}\n"
         f"- Información de los lugares a visitar (no incluye inicio y fin): {df.to_dict(orient='records')}\n"
-        f"- Instrucciones: {ruta_sel['instrucciones']}\n"
-        f"- Coordenadas ordenadas de los lugares (incluyendo inicio y fin): {ruta_sel['coords']}\n"
-        f"- Distancia total: {ruta_sel['distancia_km']:.2f} km \n"
-        f"- Tiempo estimado: {ruta_sel['duracion_min']:.2f} min \n"
+        f"- Instrucciones: {list(ruta_sel.instrucciones)}\n"
+        f"- Coordenadas ordenadas de los lugares (incluyendo inicio y fin): {ruta_sel.coords}\n"
+        f"- Distancia total: {ruta_sel.distancia_km:.2f} km \n"
+        f"- Tiempo estimado: {ruta_sel.duracion_min:.2f} min \n"
     )
 
-    # Conexión con Groq
-    client = Groq(api_key=os.environ["GROQ_API_KEY"])
+    # Conexión con Groq (cliente compartido entre turnos y sesiones)
+    client = obtener_cliente_groq()
     response = client.chat.completions.create(
         model="llama-3.3-70b-versatile",
         messages=[
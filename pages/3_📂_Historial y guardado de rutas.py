@@ -1,57 +1,115 @@
 import streamlit as st
-from streamlit_folium import st_folium
+import streamlit.components.v1 as components
 import pandas as pd
-from functions import generar_mapa_ruta
+from functions import generar_mapa_ruta_html, almacen_rutas, MemoriaRutasSesion, resolver_propietario
+
+# Número de rutas por página en la lista del historial
+RUTAS_POR_PAGINA = 10
 
 
 st.set_page_config(page_title="Historial de Rutas", layout="wide")
 st.title("📚 Historial y rutas guardadas")
 
-# Inicializa el historial si no existe
-if "rutas_guardadas" not in st.session_state:
-    st.session_state.rutas_guardadas = []
+# Las rutas se leen del almacén persistente (`almacen_rutas`); en la sesión solo se guarda la navegación
+if "pagina_historial" not in st.session_state:
+    st.session_state.pagina_historial = 1
+if "ruta_detalle" not in st.session_state:
+    st.session_state.ruta_detalle = None  # ID en el almacén de la ruta abierta en detalle
+if "rutas_sesion" not in st.session_state:
+    st.session_state.rutas_sesion = MemoriaRutasSesion()
+
+# Identificador del navegador: cada usuario solo ve su propio historial (se conserva en la URL al recargar)
+st.session_state.propietario = resolver_propietario(
+    st.session_state.get("propietario"), st.query_params.get("usuario")
+)
+st.query_params["usuario"] = st.session_state.propietario
+
+
+# ----------- Acciones (callbacks: se aplican antes del rerun, sin volver a pintar la página dos veces) -----------
+def borrar_historial():
+    almacen_rutas.borrar_todo(st.session_state.propietario)
+    st.session_state.pagina_historial = 1
+    st.session_state.ruta_detalle = None
+
+
+def eliminar_ruta(id_ruta):
+    almacen_rutas.eliminar(st.session_state.propietario, id_ruta)
+    if st.session_state.ruta_detalle == id_ruta:
+        st.session_state.ruta_detalle = None
+
+
+def abrir_ruta(id_ruta):
+    st.session_state.ruta_detalle = id_ruta
+
 
 # Mostrar historial si hay rutas
-if not st.session_state.rutas_guardadas:
+total_rutas = almacen_rutas.contar(st.session_state.propietario)
+if total_rutas == 0:
     st.info("ℹ️ Aún no has guardado ninguna ruta.")
-else:
-    # Botón para borrar todo el historial
-    if st.button("🗑️ Borrar todo el historial de rutas"):
-        st.session_state.rutas_guardadas = []
-        st.success("✅ Historial borrado correctamente.")
-        st.stop()
-
-    # Mostrar rutas una por una con opción de eliminar
-    for idx, ruta in enumerate(reversed(st.session_state.rutas_guardadas)):
-        ruta_index = len(st.session_state.rutas_guardadas) - idx - 1
-        with st.container():
-            st.markdown(f"### 🗓️ Ruta {ruta_index + 1} (guardada el {ruta['fecha_hora']})")
-
-            # Botón para eliminar solo esta ruta
-            if st.button("🗑️ Eliminar", key=f"borrar_ruta_{ruta_index}"):
-                del st.session_state.rutas_guardadas[ruta_index]
-                st.success("✅ Ruta eliminada.")
-                st.rerun()
-
-            st.markdown(f"**🟢 Inicio:** {ruta.get('origen', 'No especificado')}")
-            st.markdown(f"**🔴 Fin:** {ruta.get('destino', 'No especificado')}")
-            st.markdown(f"**Distancia total {ruta['distancia_km']:.2f} km**")
-            st.markdown(f"**Tiempo estimado {ruta['duracion_min']:.2f} min**")
-
-            st.markdown("**📍 Lugares visitados en la ruta**")
-            df_lugares = pd.DataFrame(ruta["lugares"]).drop(columns=["ID", "Web"], errors="ignore")
-            st.dataframe(df_lugares, use_container_width=True)
-
-            st.markdown("**🗺️ Mapa de la ruta optimizada**")
-            mapa = generar_mapa_ruta(
-                ruta["ruta_geojson"],
-                ruta["coords"],
-                pd.DataFrame(ruta["lugares"])
-            )
-            st_folium(mapa, width=1000, height=600, key=f"mapa_{ruta_index}")
-
-            st.markdown("**🧭 Instrucciones de la ruta**")
-            for paso in ruta["instrucciones"]:
-                st.markdown(f"- {paso}")
-    
-            st.markdown("---")
\ No newline at end of file
+    st.stop()
+
+# Botón para borrar todo el historial
+st.button("🗑️ Borrar todo el historial de rutas", on_click=borrar_historial)
+
+# ----------- Lista resumida y paginada (solo metadatos ya calculados al guardar) -----------
+total_paginas = (total_rutas - 1) // RUTAS_POR_PAGINA + 1
+st.session_state.pagina_historial = min(st.session_state.pagina_historial, total_paginas)
+
+if total_paginas > 1:
+    st.number_input(
+        f"Página (de {total_paginas})",
+        min_value=1, max_value=total_paginas, step=1,
+        key="pagina_historial",
+    )
+
+# Las rutas más recientes primero; solo se leen del almacén las de la página actual
+resumenes = almacen_rutas.listar_resumen(
+    st.session_state.propietario,
+    limite=RUTAS_POR_PAGINA,
+    desplazamiento=(st.session_state.pagina_historial - 1) * RUTAS_POR_PAGINA
+)
+
+for ruta in resumenes:
+    col_info, col_ver, col_borrar = st.columns([8, 1, 1])
+    with col_info:
+        st.markdown(
+            f"**🗓️ Ruta {ruta['id']}** · {ruta['fecha_hora']} · "
+            f"🟢 {ruta.get('origen', 'No especificado')} → 🔴 {ruta.get('destino') or 'No especificado'} · "
+            f"{ruta['distancia_km']:.2f} km · {ruta['duracion_min']:.1f} min · {ruta['n_lugares']} lugares"
+        )
+    with col_ver:
+        st.button("🔎 Ver", key=f"ver_ruta_{ruta['id']}", on_click=abrir_ruta, args=(ruta['id'],))
+    with col_borrar:
+        st.button("🗑️ Eliminar", key=f"borrar_ruta_{ruta['id']}", on_click=eliminar_ruta, args=(ruta['id'],))
+
+# ----------- Detalle de la ruta seleccionada (solo ella se carga del almacén, y se mantiene compactada en la sesión) -----------
+ruta = (
+    st.session_state.rutas_sesion.cargar_guardada(st.session_state.propietario, st.session_state.ruta_detalle)
+    if st.session_state.ruta_detalle is not None else None
+)
+if ruta is not None:
+    st.markdown("---")
+    st.markdown(f"### 🗓️ Ruta {ruta.id} (guardada el {ruta.fecha_hora})")
+    st.markdown(f"**🟢 Inicio:** {ruta.origen or 'No especificado'}")
+    st.markdown(f"**🔴 Fin:** {ruta.destino or 'No especificado'}")
+    st.markdown(f"**Distancia total {ruta.distancia_km:.2f} km**")
+    st.markdown(f"**Tiempo estimado {ruta.duracion_min:.2f} min**")
+
+    st.markdown("**📍 Lugares visitados en la ruta**")
+    df_lugares = ruta.lugares_df()
+    if df_lugares is None:  # ruta guardada sin lugares
+        df_lugares = pd.DataFrame(columns=["Nombre", "Dirección", "Lat", "Lng"])
+    st.dataframe(df_lugares.drop(columns=["ID", "Web", "Validado por"], errors="ignore"), use_container_width=True)
+
+    st.markdown("**🗺️ Mapa de la ruta optimizada**")
+    mapa_html = generar_mapa_ruta_html(
+        ruta.a_geojson,
+        ruta.coords,
+        df_lugares,
+        clave_ruta=ruta.huella
+    )
+    components.html(mapa_html, width=1000, height=600)
+
+    st.markdown("**🧭 Instrucciones de la ruta**")
+    for paso in ruta.instrucciones:
+        st.markdown(f"- {paso}")
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# Las cachés y el almacén de rutas se crean al importar `functions`: en las pruebas van a un directorio temporal
+_directorio = tempfile.mkdtemp(prefix="tfm_pruebas_")
+os.environ["CACHE_DIR"] = os.path.join(_directorio, "cache")
+os.environ["RUTAS_DB"] = os.path.join(_directorio, "rutas.sqlite")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
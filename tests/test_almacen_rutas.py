@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from functions import AlmacenRutas, _codificar_polilinea, _decodificar_polilinea, huella_ruta
+
+
+def _coordenadas(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return (np.array([-3.70, 40.41]) + rng.normal(scale=0.5, size=(n, 2))).round(6).tolist()
+
+
+def _comprobar_coordenadas(obtenidas, esperadas):
+    np.testing.assert_allclose(
+        np.asarray(obtenidas, dtype=float).reshape(-1, 2), np.asarray(esperadas, dtype=float).reshape(-1, 2), rtol=0, atol=1e-9
+    )
+
+
+def _ruta(semilla=0, n_paradas=4):
+    coords = _coordenadas(n_paradas + 2, semilla)
+    geometria = _coordenadas(60, semilla + 100)
+    return {
+        "hash": huella_ruta("foot-walking", coords[0], coords[-1], coords[1:-1]),
+        "fecha_hora": "2026-10-17 10:00:00",
+        "origen": "Ciudad Real",
+        "destino": "Toledo",
+        "perfil": "foot-walking",
+        "distancia_km": 12.5,
+        "duracion_min": 150.0,
+        "coords": coords,
+        "instrucciones": ["1. Gira a la derecha (120 m)", "2. Llegada (0 m)"],
+        "ruta_geojson": {
+            "type": "FeatureCollection",
+            "bbox": [-4.0, 40.0, -3.0, 41.0],
+            "features": [{
+                "type": "Feature",
+                "bbox": [-4.0, 40.0, -3.0, 41.0],
+                "properties": {"summary": {"distance": 12500.0, "duration": 9000.0}, "way_points": [0, 59]},
+                "geometry": {"type": "LineString", "coordinates": geometria}
+            }],
+            "metadata": {"query": {"profile": "foot-walking"}}
+        },
+        "lugares": [
+            {"ID": f"id{k}", "Nombre": f"Lugar {k}", "Categoría": "Museo", "Lat": c[1], "Lng": c[0]}
+            for k, c in enumerate(coords[1:-1])
+        ]
+    }
+
+
+@pytest.mark.parametrize("coords", [
+    [],
+    [[0.0, 0.0]],
+    [[-179.999999, -89.999999], [179.999999, 89.999999], [0.000001, -0.000001]],
+    _coordenadas(500)
+])
+def test_polilinea_ida_y_vuelta(coords):
+    _comprobar_coordenadas(_decodificar_polilinea(_codificar_polilinea(coords)), coords)
+
+
+def test_cargar_devuelve_lo_guardado(tmp_path):
+    almacen = AlmacenRutas(str(tmp_path / "rutas.sqlite"))
+    ruta = _ruta()
+
+    id_ruta = almacen.guardar("a" * 32, ruta)
+    cargada = almacen.cargar("a" * 32, id_ruta)
+
+    assert cargada.pop("id") == id_ruta
+    _comprobar_coordenadas(cargada.pop("coords"), ruta["coords"])
+    geometria = cargada["ruta_geojson"]["features"][0]["geometry"].pop("coordinates")
+    esperada = ruta["ruta_geojson"]["features"][0]["geometry"]["coordinates"]
+    _comprobar_coordenadas(geometria, esperada)
+    ruta["ruta_geojson"]["features"][0]["geometry"].pop("coordinates")
+    ruta.pop("coords")
+    assert cargada == ruta
+
+
+def test_rutas_separadas_por_propietario(tmp_path):
+    almacen = AlmacenRutas(str(tmp_path / "rutas.sqlite"))
+    ruta = _ruta()
+
+    id_a = almacen.guardar("a" * 32, ruta)
+    assert almacen.guardar("a" * 32, ruta) is None  # duplicada para el mismo propietario
+    id_b = almacen.guardar("b" * 32, ruta)
+    assert id_b is not None
+
+    assert almacen.cargar("b" * 32, id_a) is None
+    assert [r["id"] for r in almacen.listar_resumen("a" * 32)] == [id_a]
+    almacen.borrar_todo("a" * 32)
+    assert almacen.contar("a" * 32) == 0
+    assert almacen.contar("b" * 32) == 1
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from functions import obtener_direcciones, cache_tramos
+
+
+class _ClienteORSFalso:
+    """
+    Sustituye al cliente de ORS: devuelve una ruta GeoJSON determinista con el mismo formato que
+    `directions` (un segmento por tramo, con dos pasos y un punto intermedio) y cuenta las llamadas.
+    """
+
+    def __init__(self):
+        self.llamadas = []
+
+    def directions(self, coordinates, profile, format, instructions):
+        self.llamadas.append(len(coordinates))
+        geometria, segmentos, way_points = [], [], [0]
+        for a, b in zip(coordinates[:-1], coordinates[1:]):
+            inicio = max(len(geometria) - 1, 0)
+            puntos = [list(a), [(a[0] + b[0]) / 2, (a[1] + b[1]) / 2], list(b)]
+            geometria.extend(puntos if not geometria else puntos[1:])
+            fin = len(geometria) - 1
+            distancia = float(np.hypot(b[0] - a[0], b[1] - a[1]) * 1e5)
+            segmentos.append({
+                "distance": distancia,
+                "duration": distancia / 10,
+                "steps": [
+                    {"distance": distancia / 2, "duration": distancia / 20, "instruction": f"Sigue hacia {b}", "way_points": [inicio, inicio + 1]},
+                    {"distance": distancia / 2, "duration": distancia / 20, "instruction": "Llegada", "way_points": [inicio + 1, fin]}
+                ]
+            })
+            way_points.append(fin)
+
+        lngs, lats = [c[0] for c in geometria], [c[1] for c in geometria]
+        bbox = [min(lngs), min(lats), max(lngs), max(lats)]
+        return {
+            "type": "FeatureCollection",
+            "bbox": bbox,
+            "features": [{
+                "type": "Feature",
+                "bbox": bbox,
+                "properties": {
+                    "segments": segmentos,
+                    "way_points": way_points,
+                    "summary": {
+                        "distance": sum(s["distance"] for s in segmentos),
+                        "duration": sum(s["duration"] for s in segmentos)
+                    }
+                },
+                "geometry": {"type": "LineString", "coordinates": geometria}
+            }],
+            "metadata": {"query": {"profile": profile}}
+        }
+
+
+def _puntos(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return (np.array([-3.70, 40.41]) + rng.random((n, 2)) * 0.05).round(6).tolist()
+
+
+def _comprobar_igual(unida, directa):
+    feature, esperado = unida["features"][0], directa["features"][0]
+    assert feature["geometry"] == esperado["geometry"]
+    assert feature["properties"]["way_points"] == esperado["properties"]["way_points"]
+    assert feature["properties"]["segments"] == esperado["properties"]["segments"]
+    assert feature["properties"]["summary"] == pytest.approx(esperado["properties"]["summary"])
+    assert feature["bbox"] == pytest.approx(esperado["bbox"])
+
+
+@pytest.mark.parametrize("max_puntos", [2, 5, 50])
+def test_por_partes_igual_que_una_sola_peticion(max_puntos):
+    puntos = _puntos(23)
+    cliente = _ClienteORSFalso()
+
+    unida = obtener_direcciones(cliente, puntos, "foot-walking", max_puntos=max_puntos, usar_cache=False)
+
+    assert all(n <= max_puntos for n in cliente.llamadas)
+    assert len(cliente.llamadas) == -(-22 // (max_puntos - 1))
+    _comprobar_igual(unida, _ClienteORSFalso().directions(puntos, "foot-walking", "geojson", True))
+
+
+def test_tramos_de_cache_igual_que_una_sola_peticion():
+    cache_tramos.limpiar()
+    puntos = _puntos(15, semilla=1)
+    obtener_direcciones(_ClienteORSFalso(), puntos[3:9], "cycling-regular")
+
+    cliente = _ClienteORSFalso()
+    unida = obtener_direcciones(cliente, puntos, "cycling-regular", max_puntos=4)
+
+    assert unida["metadata"]["tramos"] == {"total": 14, "desde_cache": 5}
+    assert sum(n - 1 for n in cliente.llamadas) == 9
+    _comprobar_igual(unida, _ClienteORSFalso().directions(puntos, "cycling-regular", "geojson", True))
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from functions import RutaCompacta, MemoriaRutasSesion
+
+
+def _ruta_geojson(geometria):
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "properties": {"summary": {"distance": 4200.0, "duration": 3000.0}, "way_points": [0, len(geometria) - 1]},
+            "geometry": {"type": "LineString", "coordinates": geometria}
+        }],
+        "metadata": {"query": {"profile": "foot-walking"}}
+    }
+
+
+def _coordenadas(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return (np.array([-3.70, 40.41]) + rng.random((n, 2)) * 0.05).round(6).tolist()
+
+
+def _comprobar_coordenadas(obtenidas, esperadas):
+    np.testing.assert_allclose(np.asarray(obtenidas), np.asarray(esperadas), rtol=0, atol=1e-9)
+
+
+def test_ida_y_vuelta():
+    geometria, coords = _coordenadas(300), _coordenadas(6, semilla=1)
+    lugares = pd.DataFrame({
+        "Nombre": ["A", "B", "C", "D"],
+        "Categoría": ["Museo", "Museo", "Bar", "Museo"],
+        "Lat": [c[1] for c in coords[1:-1]],
+        "Lng": [c[0] for c in coords[1:-1]]
+    })
+
+    ruta = RutaCompacta.crear(_ruta_geojson(geometria), coords, ["1. Sigue recto (10 m)"], lugares, perfil="foot-walking")
+
+    assert ruta.distancia_km == 4.2 and ruta.duracion_min == 50.0
+    _comprobar_coordenadas(ruta.coords, coords)
+    geojson = ruta.a_geojson()
+    _comprobar_coordenadas(geojson["features"][0]["geometry"]["coordinates"], geometria)
+    assert geojson["features"][0]["properties"] == _ruta_geojson(geometria)["features"][0]["properties"]
+    pd.testing.assert_frame_equal(ruta.lugares_df(), lugares)
+
+    copia = RutaCompacta.desde_dict(ruta.a_dict())
+    assert copia.huella == ruta.huella
+    _comprobar_coordenadas(copia.a_geojson()["features"][0]["geometry"]["coordinates"], geometria)
+    pd.testing.assert_frame_equal(copia.lugares_df(), lugares)
+
+
+def test_huella_cambia_con_lo_que_se_dibuja():
+    geometria, coords = _coordenadas(50), _coordenadas(5, semilla=1)
+    ruta = RutaCompacta.crear(_ruta_geojson(geometria), coords, [])
+
+    assert RutaCompacta.crear(_ruta_geojson(geometria), coords, ["otra instrucción"]).huella == ruta.huella
+    assert RutaCompacta.crear(_ruta_geojson(geometria), coords[::-1], []).huella != ruta.huella
+    assert RutaCompacta.crear(_ruta_geojson(geometria[:-1]), coords, []).huella != ruta.huella
+
+
+def test_sin_lugares():
+    ruta = RutaCompacta.crear(_ruta_geojson(_coordenadas(10)), _coordenadas(3), [])
+    assert ruta.lugares_df() is None
+    assert RutaCompacta.desde_dict(ruta.a_dict()).lugares_df() is None
+
+
+def test_memoria_vuelca_a_disco_y_recupera():
+    rutas = [RutaCompacta.crear(_ruta_geojson(_coordenadas(400, k)), _coordenadas(5, k), []) for k in range(4)]
+    memoria = MemoriaRutasSesion(max_bytes=int(rutas[0].tamano_bytes() * 1.5))
+
+    for k, ruta in enumerate(rutas):
+        memoria.guardar(f"ruta{k}", ruta)
+    assert memoria.volcadas == 3
+
+    recuperada = memoria.obtener("ruta0")
+    assert memoria.recuperadas == 1
+    assert recuperada.huella == rutas[0].huella
+    _comprobar_coordenadas(
+        recuperada.a_geojson()["features"][0]["geometry"]["coordinates"],
+        rutas[0].a_geojson()["features"][0]["geometry"]["coordinates"]
+    )
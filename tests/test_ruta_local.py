@@ -0,0 +1,59 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from functions import resolver_ruta_local, _insercion_mas_barata, _mejorar_2opt, _mejorar_or_opt
+
+
+def _coste(matriz, camino):
+    camino = np.asarray(camino)
+    return float(matriz[camino[:-1], camino[1:]].sum())
+
+
+def _matriz_aleatoria(rng, n):
+    """Distancias euclídeas entre puntos aleatorios con un ruido asimétrico de hasta un 30 %."""
+    puntos = rng.random((n, 2))
+    distancias = np.hypot(*(puntos[:, None] - puntos[None]).transpose(2, 0, 1))
+    return distancias * rng.uniform(1.0, 1.3, (n, n))
+
+
+@pytest.mark.parametrize("n", [2, 3, 5, 12, 40])
+def test_devuelve_permutacion_con_extremos_fijos(n):
+    matriz = _matriz_aleatoria(np.random.default_rng(n), n)
+    camino = resolver_ruta_local(matriz, tiempo_maximo_s=1.0)
+
+    assert sorted(camino) == list(range(n))
+    assert camino[0] == 0
+    assert camino[-1] == n - 1
+
+
+def test_cada_movimiento_reduce_el_coste():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        matriz = _matriz_aleatoria(rng, 15)
+        camino = _insercion_mas_barata(matriz, [0, 14], list(rng.permutation(np.arange(1, 14))))
+        coste = _coste(matriz, camino)
+        while _mejorar_2opt(matriz, camino) or _mejorar_or_opt(matriz, camino):
+            nuevo = _coste(matriz, camino)
+            assert nuevo < coste
+            assert camino[0] == 0 and camino[-1] == 14
+            assert sorted(camino) == list(range(15))
+            coste = nuevo
+
+
+def test_cerca_del_optimo_por_fuerza_bruta():
+    rng = np.random.default_rng(0)
+    n = 9
+    diferencias = []
+    for _ in range(40):
+        matriz = _matriz_aleatoria(rng, n)
+        optimo = min(
+            _coste(matriz, (0,) + intermedios + (n - 1,))
+            for intermedios in itertools.permutations(range(1, n - 1))
+        )
+        diferencias.append(_coste(matriz, resolver_ruta_local(matriz, tiempo_maximo_s=1.0)) / optimo - 1)
+
+    # Diferencia media con el óptimo en torno al 1 %
+    assert np.mean(diferencias) < 0.02
+    assert min(diferencias) >= -1e-9